@@ -4,6 +4,7 @@ import sys
 if sys.version_info < (3, 12):
     raise Exception("luisa_lang requires Python 3.12 or higher")
 
+from luisa_lang._version import __version__
 from luisa_lang.lang import *
 from luisa_lang.lang_builtins import *
 bool = boolean
\ No newline at end of file
@@ -1,22 +1,26 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, is_dataclass
 from typing import Any, Callable, List, Optional, Set, TypeVar, cast
 import typing
 
 from luisa_lang.lang_runtime import (
-    FlattenedTree,
     JitVar,
+    PyTreeRegistry,
     TraceContext,
+    TraceMemo,
     _invoke_function_tracer,
     current_func,
     is_jit,
     push_to_current_bb,
-    tree_flatten,
+    pytree_fields,
+    trace_memoization,
+    tree_structure,
 )
-from luisa_lang.utils import Lazy, get_full_name, inherit, unique_hash
+from luisa_lang.utils import Lazy, get_full_name, inherit, is_generic_class, unique_hash
 from luisa_lang import hir
 from luisa_lang import classinfo
 from luisa_lang import ast_rewrite
 import inspect
+import threading
 from typing import (
     Callable,
     Dict,
@@ -60,14 +64,13 @@ def _dsl_struct_impl[T](
         cls not in ctx.types
     ), f"Class {cls} is already registered in the global context"
 
-    # Register the class and get its type info
+    # Register the class, its type info is built on first instantiation
     classinfo.register_class(cls)
-    cls_info = classinfo.class_typeinfo(cls)
     globalns = classinfo._get_cls_globalns(cls)
    
     # jitvar_info = 
     # print(base_class_infos)
-    is_generic = len(cls_info.type_vars) > 0
+    is_generic = is_generic_class(cls)
 
     # Get the global namespace and register the class name
     globalns = classinfo._get_cls_globalns(cls)
@@ -79,12 +82,11 @@ def _dsl_struct_impl[T](
         if not is_generic:
             assert len(args) == 0, f"Expected 0 type arguments but got {len(args)}"
 
-        # Instantiate the class with the provided type arguments
-        instantiated_cls = cls_info.instantiate(list(args))
-
         # Create the IR type either from override or by building from fields
         ir_ty: hir.Type
         if ir_ty_override is None:
+            # Instantiate the class with the provided type arguments
+            instantiated_cls = classinfo.class_typeinfo(cls).instantiate(list(args))
             # Build struct type from fields
             fields: List[Tuple[str, hir.Type]] = []
             # print(instantiated_cls.fields)
@@ -98,21 +100,20 @@ def _dsl_struct_impl[T](
                     )
                 fields.append((name, field_ty))
 
-            # Create unique name for the struct type
+            # Create unique name for the struct type, classes in different modules may share a qualname
             ir_ty = hir.StructType(
-                f"{cls.__name__}_{unique_hash(cls.__qualname__)}",
+                f"{cls.__name__}_{unique_hash(f'{cls.__module__}.{cls.__qualname__}')}",
                 cls.__qualname__,
                 fields,
             )
         else:
             ir_ty = ir_ty_override
 
-        # Register all methods of the class
-        for name in cls_info.methods:
-            method_object = getattr(cls, name)
+        # Register all methods of the class, only their names are needed here
+        for name, method_object in inspect.getmembers(cls, inspect.isfunction):
             template = _get_func_template(method_object)
             if template is not None:
-                ir_ty.methods[name] = template
+                ir_ty.add_method(name, template)
 
         return ir_ty
 
@@ -169,9 +170,33 @@ def struct[T](cls: type[T]) -> type[T]:
     return _dsl_struct_impl(cls)
 
 
-def builtin_type(ir_type: hir.Type):
+@typing.dataclass_transform()
+def pytree[T](cls: type[T]) -> type[T]:
+    """
+    Mark a class as a pytree whose fields are flattened when it is passed to a DSL function.
+    Classes that are not dataclasses yet are turned into one.
+    """
+    if not is_dataclass(cls):
+        cls = dataclass(cls)
+    PyTreeRegistry.register_fields(cls, pytree_fields(cls))
+    return cls
+
+
+def _attach_traced(cls: type, traced: Dict[str, Any]) -> None:
+    for name, rewritten_f in traced.items():
+        method = cls.__dict__[name]
+        # `__init__` is wrapped by `inherit`
+        method = getattr(method, "__wrapped__", method)
+        lazy = getattr(method, "__luisa_rewritten__")
+        assert isinstance(lazy, Lazy)
+        lazy.set(rewritten_f)
+
+
+def builtin_type(ir_type: hir.Type, traced: Optional[Dict[str, Any]] = None):
     """
     Mark a class as a builtin type.
+    `traced` maps the names of @trace methods to their already rewritten bodies
+    (as emitted by scripts/gen_math_types.py), which are then used instead of rewriting the source.
 
     Example:
     ```
@@ -183,14 +208,56 @@ def builtin_type(ir_type: hir.Type):
 
     def decorator(cls: type):
         cls = __inherit_jitvar(cls)
+        if traced is not None:
+            _attach_traced(cls, traced)
         return _dsl_struct_impl(cls, ir_type)
 
     return decorator
 
 
-def trace[F: Callable[..., Any]](f: F) -> F:
-    rewritten = _rewrite_func("trace", f)
+@overload
+def trace[F: Callable[..., Any]](f: F) -> F: ...
+
+
+@overload
+def trace[F: Callable[..., Any]](*, memoize: bool = False) -> Callable[[F], F]: ...
+
+
+def trace(f: Optional[Callable[..., Any]] = None, *, memoize: bool = False) -> Any:
+    """
+    Decorator for Luisa functions that are inlined into the caller each time they are called.
+    The function body is only rewritten upon the first call in a JIT context (see `prewarm`).
+
+    With `memoize=True`, the HIR produced by the first call for a given argument structure is
+    recorded and spliced into later call sites instead of running the body again (see `TraceMemo`).
+    Use `trace_memoization(False)` to force re-tracing when the body has comptime side effects.
+
+    Example:
+    ```python
+    @luisa.trace(memoize=True)
+    def lerp(a: luisa.f32, b: luisa.f32, t: luisa.f32) -> luisa.f32:
+        return a + (b - a) * t
+    ```
+    """
+    if f is None:
+        return lambda f: _trace_impl(f, memoize)
+    return _trace_impl(f, memoize)
+
+
+def _trace_impl[F: Callable[..., Any]](f: F, memoize: bool) -> F:
+    rewritten = Lazy[Callable[..., Any]](lambda: _rewrite_func("trace", f))
     globalns = classinfo._get_func_globalns(f)
+    memo = TraceMemo() if memoize else None
+
+    def invoke(args: Tuple[Any, ...], kwargs: Dict[str, Any], __lc_ctx__: TraceContext) -> Any:
+        func_tracer = current_func()
+        old_globals = func_tracer.func_globals
+        func_tracer.func_globals = globalns
+        # Call the rewritten function with the trace context
+        ret = rewritten.get()(*args, **kwargs, __lc_ctx__=__lc_ctx__)
+        # Restore the original globals
+        func_tracer.func_globals = old_globals
+        return ret
 
     def wrapper(
         *args,
@@ -206,27 +273,103 @@ def trace[F: Callable[..., Any]](f: F) -> F:
             # In non-JIT context, just call the original function
             return f(*args, **kwargs)
         else:
-            func_tracer = current_func()
-            old_globals = func_tracer.func_globals
-            func_tracer.func_globals = globalns
             assert isinstance(__lc_ctx__, TraceContext), f"__lc_ctx__ must be a TraceContext but got {type(__lc_ctx__)}"
-            # Call the rewritten function with the trace context
-            ret = rewritten(*args, **kwargs, __lc_ctx__=__lc_ctx__)
-            # Restore the original globals
-            func_tracer.func_globals = old_globals
-            return ret
+            if memo is not None:
+                return memo.call(lambda: invoke(args, kwargs, __lc_ctx__), args, kwargs)
+            return invoke(args, kwargs, __lc_ctx__)
 
     # Copy over important attributes from the original function
     wrapper.__name__ = f.__name__
+    wrapper.__qualname__ = f.__qualname__
+    wrapper.__module__ = f.__module__
     wrapper.__doc__ = f.__doc__
     wrapper.__annotations__ = f.__annotations__
     setattr(wrapper, '__luisa_original_func__', f)
+    setattr(wrapper, '__luisa_rewritten__', rewritten)
+    if memo is not None:
+        setattr(wrapper, '__luisa_trace_memo__', memo)
 
     return cast(F, wrapper)
 
 
+def trace_memo_stats(f: Callable[..., Any]) -> Optional[TraceMemo]:
+    """
+    Get the memoization state (`hits`, `misses` and `rejected` counters) of a function
+    decorated with `@trace(memoize=True)`, or None for other functions.
+    """
+    return getattr(f, "__luisa_trace_memo__", None)
+
+
+def template_stats(obj: Any) -> hir.TemplateStats:
+    """
+    Get the instantiation cache statistics of a function decorated with `@func` or of a DSL type.
+    """
+    if isinstance(obj, type):
+        return hir.get_dsl_type(obj).stats
+    f = getattr(obj, "__luisa_original_func__", obj)
+    template = _get_func_template(f)
+    assert template is not None, f"{obj} is not decorated with @func"
+    return template.stats
+
+
+def _get_lazy_objects(obj: Any) -> List[Lazy[Any]]:
+    if isinstance(obj, type):
+        lazies: List[Lazy[Any]] = []
+        for member in vars(obj).values():
+            if isinstance(member, (staticmethod, classmethod)):
+                member = member.__func__
+            if callable(member):
+                lazies.extend(_get_lazy_objects(member))
+        return lazies
+    if (wrapped := getattr(obj, "__wrapped__", None)) is not None:
+        return _get_lazy_objects(wrapped)
+    if (rewritten := getattr(obj, "__luisa_rewritten__", None)) is not None:
+        return [rewritten]
+    original = getattr(obj, "__luisa_original_func__", None)
+    if (template := getattr(original, "__luisa_func__", None)) is not None:
+        return [template]
+    return []
+
+
+def prewarm(*targets: Any, background: bool = False) -> Optional[threading.Thread]:
+    """
+    Rewrite the given DSL functions ahead of their first use, so that the first trace
+    does not pay for it. Targets can be functions decorated with `@trace`/`@func` or classes,
+    in which case all of their DSL methods are prewarmed.
+
+    If `background` is True, the work is done on a daemon thread which is returned.
+    Failures are ignored there and surface again on the first actual use.
+
+    Example:
+    ```python
+    luisa.prewarm(luisa.float3, luisa.f32, my_helper, background=True)
+    ```
+    """
+    lazies: List[Lazy[Any]] = []
+    for target in targets:
+        lazies.extend(_get_lazy_objects(target))
+
+    def do(ignore_errors: bool) -> None:
+        for lazy in lazies:
+            try:
+                lazy.get()
+            except Exception:
+                if not ignore_errors:
+                    raise
+
+    if not background:
+        do(False)
+        return None
+    thread = threading.Thread(target=do, args=(True,), name="luisa_lang.prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
 def _make_func_template(
-    f: Callable[..., Any], globalns: Dict[str, Any]
+    f: Callable[..., Any],
+    globalns: Dict[str, Any],
+    capacity: Optional[int],
+    inline: hir.InlineHint = "auto",
 ) -> hir.FunctionTemplate:
     sig = classinfo.parse_func_signature(f, globalns, [], False)
     rewritten = _rewrite_func("func", f)
@@ -234,16 +377,42 @@ def _make_func_template(
     def instantiation_func(args: hir.FunctionTemplateArgs) -> hir.Function:
         func = _invoke_function_tracer(rewritten, args, globalns)
         assert isinstance(func, hir.Function)
+        func.inline_hint = inline
         return func
 
-    return hir.FunctionTemplate(hir.FunctionTemplateArgs, instantiation_func)
+    template = hir.FunctionTemplate(hir.FunctionTemplateArgs, instantiation_func, capacity)
+    # Register the function template in the global context
+    hir.GlobalContext.get().functions[f] = template
+    return template
+
+
+@overload
+def func[F: Callable[..., Any]](f: F) -> F: ...
+
+
+@overload
+def func[F: Callable[..., Any]](
+    *, capacity: Optional[int] = None, inline: hir.InlineHint = "auto"
+) -> Callable[[F], F]: ...
 
 
-def func[F: Callable[..., Any]](f: F) -> F:
+def func(
+    f: Optional[Callable[..., Any]] = None,
+    *,
+    capacity: Optional[int] = None,
+    inline: hir.InlineHint = "auto",
+) -> Any:
     """
     Decorator for Luisa functions that are compiled once and reused.
     Different from @trace, this avoids code duplication by compiling the function body only once.
 
+    One instantiation is kept per argument structure. `capacity` bounds their number, evicting
+    the least recently used ones (see `hir.Template`); the default is
+    `hir.Template.default_capacity`, set with `GlobalContext.set_template_capacity`.
+
+    `inline` is "always" or "never" to force whether calls are inlined, both by the inliner
+    pass and by the C++ compiler; "auto" leaves it to their cost models.
+
     Example:
     ```python
     @luisa.func
@@ -251,13 +420,23 @@ def func[F: Callable[..., Any]](f: F) -> F:
         return a + b
     ```
     """
+    if inline not in hir.INLINE_HINTS:
+        raise ValueError(f"inline must be one of {hir.INLINE_HINTS}, got {inline!r}")
+    if f is None:
+        return lambda f: _func_impl(f, capacity, inline)
+    return _func_impl(f, capacity, inline)
+
+
+def _func_impl[F: Callable[..., Any]](
+    f: F, capacity: Optional[int], inline: hir.InlineHint = "auto"
+) -> F:
     # Get the global namespace for the function
     globalns = classinfo._get_func_globalns(f)
 
     # Create the function template
 
     def template():
-        return _make_func_template(f, globalns)
+        return _make_func_template(f, globalns, capacity, inline)
 
     # Store the template on the function object
     setattr(f, "__luisa_func__", Lazy[hir.FunctionTemplate](template))
@@ -271,12 +450,11 @@ def func[F: Callable[..., Any]](f: F) -> F:
 
         template = cast(hir.FunctionTemplate, getattr(f, "__luisa_func__").get())
 
-        pytree_args = list([tree_flatten(x, False) for x in args])
-        pytree_kwargs: Dict[str, FlattenedTree] = {
-            k: tree_flatten(v, False) for k, v in kwargs.items()
+        jitvar_args: List[JitVar] = []
+        pytree_structure_args = [tree_structure(x, jitvar_args, False) for x in args]
+        pytree_structure_kwargs = {
+            k: tree_structure(v, jitvar_args, False) for k, v in kwargs.items()
         }
-        pytree_structure_args = [x.structure() for x in pytree_args]
-        pytree_structure_kwargs = {k: v.structure() for k, v in pytree_kwargs.items()}
         instantiated_func = template.instantiate(
             hir.FunctionTemplateArgs(
                 args=pytree_structure_args, kwargs=pytree_structure_kwargs
@@ -286,11 +464,6 @@ def func[F: Callable[..., Any]](f: F) -> F:
         # func_tracer = current_func()
         rt = instantiated_func.return_jitvar_type
         assert issubclass(rt, JitVar), f"Return type {rt} is not a JitVar"
-        jitvar_args: List[JitVar] = []
-        for arg in pytree_args:
-            jitvar_args.extend(arg.collect_jitvars())
-        for k, v in pytree_kwargs.items():
-            jitvar_args.extend(v.collect_jitvars())
         # TODO: handle kwargs properly
         if not __lc_ctx__.is_top_level:
             ret_node = push_to_current_bb(
@@ -307,6 +480,8 @@ def func[F: Callable[..., Any]](f: F) -> F:
 
     # Copy over important attributes from the original function
     wrapper.__name__ = f.__name__
+    wrapper.__qualname__ = f.__qualname__
+    wrapper.__module__ = f.__module__
     wrapper.__doc__ = f.__doc__
     wrapper.__annotations__ = f.__annotations__
     setattr(wrapper, '__luisa_original_func__', f)
@@ -1,8 +1,22 @@
 import ast
 from ast import NodeTransformer
 import copy
-from typing import Callable, Any, List, Set, cast
-from luisa_lang.utils import Span, checked_cast, retrieve_ast_and_filename, NestedHashMap
+from functools import cache
+from hashlib import sha256
+import importlib.util
+import marshal
+import os
+import tempfile
+import types
+from typing import Callable, Any, List, Optional, Set, cast
+from luisa_lang._version import __version__
+from luisa_lang import utils
+from luisa_lang.utils import (
+    Span,
+    checked_cast,
+    retrieve_function_source,
+    NestedHashMap,
+)
 
 """
 Rewrite rules:
@@ -123,11 +137,16 @@ class FuncRewriter(NodeTransformer):
     def visit_FunctionDef(self, node: ast.FunctionDef) -> Any:
         # Filter out decorators matching our decorator_name
         # Remove the decorator we're interested in
+        def is_our_decorator(d: ast.expr) -> bool:
+            # also matches decorators with arguments, e.g. `@trace(memoize=True)`
+            if isinstance(d, ast.Call):
+                d = d.func
+            return (isinstance(d, ast.Name) and d.id == self.decorator_name) or (
+                isinstance(d, ast.Attribute) and d.attr == self.decorator_name
+            )
+
         node.decorator_list = [
-            d
-            for d in node.decorator_list
-            if not (isinstance(d, ast.Name) and d.id == self.decorator_name)
-            and not (isinstance(d, ast.Attribute) and d.attr == self.decorator_name)
+            d for d in node.decorator_list if not is_our_decorator(d)
         ]
 
         body: List[ast.stmt] = []
@@ -496,11 +515,127 @@ class FuncRewriter(NodeTransformer):
         ))
 
 
+"""
+Rewritten functions are cached on disk as marshalled code objects, so that warm
+processes skip parsing, rewriting and compiling entirely.
+
+The cache is content-addressed: the key is a hash of the function source, its
+location, the decorator name, the luisa_lang version, the rewriter itself (and the
+source utilities it relies on) and the bytecode magic number of the running interpreter.
+The cache lives under `$LUISA_LANG_CACHE_DIR` (default: `~/.cache/luisa_lang`) and
+can be disabled by setting `LUISA_LANG_DISABLE_CACHE=1`.
+"""
+
+_UNSET: Any = object()
+_cache_dir: Optional[str] = _UNSET
+
+
+def _default_cache_dir() -> Optional[str]:
+    if os.environ.get("LUISA_LANG_DISABLE_CACHE", "0") not in ("", "0"):
+        return None
+    if (d := os.environ.get("LUISA_LANG_CACHE_DIR")) is not None:
+        return d
+    xdg_cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(xdg_cache, "luisa_lang")
+
+
+def rewrite_cache_dir() -> Optional[str]:
+    """
+    Directory of the on-disk cache of rewritten functions, or None if caching is disabled.
+    """
+    global _cache_dir
+    if _cache_dir is _UNSET:
+        _cache_dir = _default_cache_dir()
+    return _cache_dir
+
+
+def set_rewrite_cache_dir(path: Optional[str]) -> None:
+    """
+    Override the cache directory. Pass None to disable the on-disk cache.
+    """
+    global _cache_dir
+    _cache_dir = path
+
+
+@cache
+def _rewriter_fingerprint() -> bytes:
+    # the rewriter and the helpers it uses to parse and locate the source are part of the key
+    # so that changes to them invalidate stale entries even without a version bump
+    h = sha256()
+    for path in (__file__, utils.__file__):
+        with open(path, "rb") as fp:
+            h.update(fp.read())
+    return h.digest()
+
+
+def _rewrite_cache_key(
+    source_lines: List[str], lineno: int, filename: str, decorator_name: str
+) -> str:
+    h = sha256()
+    for part in (
+        __version__.encode(),
+        importlib.util.MAGIC_NUMBER,
+        _rewriter_fingerprint(),
+        decorator_name.encode(),
+        f"{filename}:{lineno}".encode(),
+    ):
+        h.update(part)
+        h.update(b"\0")
+    h.update("".join(source_lines).encode())
+    return h.hexdigest()
+
+
+def _cache_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, "rewrite", key[:2], f"{key}.bin")
+
+
+def _load_cached_code(key: str) -> Optional[types.CodeType]:
+    cache_dir = rewrite_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        with open(_cache_path(cache_dir, key), "rb") as fp:
+            code = marshal.load(fp)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(code, types.CodeType):
+        return None
+    return code
+
+
+def _store_cached_code(key: str, code: types.CodeType) -> None:
+    cache_dir = rewrite_cache_dir()
+    if cache_dir is None:
+        return
+    path = _cache_path(cache_dir, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                marshal.dump(code, fp)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # the cache is best-effort
+        pass
+
+
 def rewrite_function[F: Callable[..., Any]](f: F, decorator_name: str) -> F:
-    tree, filename = retrieve_ast_and_filename(f)
-    tree = FuncRewriter(decorator_name, filename).visit(tree)
-    ast.fix_missing_locations(tree)
-    code = compile(tree, filename=filename, mode="exec")
+    source = retrieve_function_source(f)
+    key = _rewrite_cache_key(source.lines, source.lineno, source.filename, decorator_name)
+    code = _load_cached_code(key)
+    if code is None:
+        # only parsed when the rewritten code is not cached
+        tree = FuncRewriter(decorator_name, source.filename).visit(source.parse())
+        ast.fix_missing_locations(tree)
+        code = compile(tree, filename=source.filename, mode="exec")
+        _store_cached_code(key, code)
     local_dict: dict[Any, Any] = {}
     exec(code, f.__globals__, local_dict)
     rewrote_f = local_dict[f.__name__]
@@ -19,7 +19,9 @@ from typing import (
     cast,
 )
 import functools
+import threading
 from dataclasses import dataclass
+from luisa_lang.utils import Lazy
 
 
 class GenericInstance:
@@ -202,15 +204,25 @@ class ClassType:
         )
 
 
-_CLS_TYPE_INFO: Dict[type, ClassType] = {}
+_CLS_TYPE_INFO: Dict[type, Lazy[ClassType]] = {}
+_materialized_class_count = 0
+# classes may be materialized concurrently, each under the lock of its own `Lazy`
+_materialized_class_count_lock = threading.Lock()
 
 
 def class_typeinfo(cls: type) -> ClassType:
     if cls in _CLS_TYPE_INFO:
-        return _CLS_TYPE_INFO[cls]
+        return _CLS_TYPE_INFO[cls].get()
     raise RuntimeError(f"Class {cls} is not registered.")
 
 
+def materialized_class_count() -> int:
+    """
+    Number of registered classes whose `ClassType` has actually been built.
+    """
+    return _materialized_class_count
+
+
 def _is_class_registered(cls: type) -> bool:
     return cls in _CLS_TYPE_INFO
 
@@ -377,6 +389,11 @@ def is_static(cls: type, method_name: str) -> bool:
 
 
 def register_class(cls: type) -> None:
+    """
+    Register `cls` as a DSL class. Its `ClassType` (fields and method signatures) is only
+    built on the first `class_typeinfo(cls)`, which usually happens when the type is first
+    instantiated in a trace.
+    """
     cls_qualname = cls.__qualname__
     globalns = _get_cls_globalns(cls)
     globalns[cls.__name__] = cls
@@ -384,7 +401,17 @@ def register_class(cls: type) -> None:
     assert (
         "<locals>" not in cls_qualname
     ), f"Cannot use local class {cls_qualname} as a DSL type. Must be a top-level class!"
+    for base in getattr(cls, "__orig_bases__", ()):
+        base_orig = getattr(base, "__origin__", None)
+        if base_orig is not None and not _is_class_registered(base_orig) and base_orig not in _BUILTIN_ANNOTATION_BASES:
+            raise RuntimeError(
+                f"Base class {base_orig} of {cls} is not registered."
+            )
+    _CLS_TYPE_INFO[cls] = Lazy(lambda: _build_class_typeinfo(cls, globalns))
+
 
+def _build_class_typeinfo(cls: type, globalns: Dict[str, Any]) -> ClassType:
+    global _materialized_class_count
     origin = typing.get_origin(cls)
     type_args: List[Type]
     type_vars: Any
@@ -441,7 +468,9 @@ def register_class(cls: type) -> None:
                     f"Unsupported type hint for method {name} in {cls}: {e}") from e
     for name in local_fields:
         cls_ty.fields[name] = parse_type_hint(type_hints[name])
-    _CLS_TYPE_INFO[cls] = cls_ty
+    with _materialized_class_count_lock:
+        _materialized_class_count += 1
+    return cls_ty
 
 
 def _get_func_globalns(f: Callable[..., Any]) -> Dict[str, Any]:
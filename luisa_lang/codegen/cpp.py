@@ -1,8 +1,9 @@
+from dataclasses import dataclass
 from functools import cache
 from luisa_lang import hir
 from luisa_lang.utils import unique_hash, unwrap
 from luisa_lang.codegen import CodeGen, ScratchBuffer
-from typing import Any, Callable, Dict, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 
 @cache
@@ -13,22 +14,47 @@ def _get_cpp_lib() -> str:
     return bz2.decompress(base64.b64decode(CPP_LIB_COMPRESSED)).decode('utf-8')
 
 
+@dataclass
+class CppFragment:
+    """
+    Type and function definitions generated for a set of functions, keyed by their C++ names.
+    Fragments are plain strings, so they can be produced in worker processes and merged later.
+    """
+    types: List[Tuple[str, str]]
+    functions: List[Tuple[str, str]]
+
+
 class TypeCodeGenCache:
     cache: Dict[hir.Type, str]
     impl: ScratchBuffer
+    definitions: Dict[str, str]
 
     def __init__(self) -> None:
         self.cache = {}
         self.impl = ScratchBuffer(0)
+        self.definitions = {}
 
     def gen(self, ty: hir.Type) -> str:
         if ty in self.cache:
             return self.cache[ty]
         else:
-            res = self.gen_impl(ty)
+            # each type is written to its own buffer, so that the definitions of the types
+            # it depends on come first
+            outer, self.impl = self.impl, ScratchBuffer(0)
+            try:
+                res = self.gen_impl(ty)
+                if self.impl.body:
+                    self.define(res, self.impl.body)
+            finally:
+                self.impl = outer
             self.cache[ty] = res
             return res
 
+    def define(self, name: str, code: str) -> None:
+        # types with the same name are shared, which is only correct if they have the same layout
+        existing = self.definitions.setdefault(name, code)
+        assert existing == code, f"type {name} is generated with two different definitions"
+
     def gen_impl(self, ty: hir.Type) -> str:
         match ty:
             case hir.IntType(bits=bits, signed=signed):
@@ -189,27 +215,53 @@ class CppCodeGen(CodeGen):
     type_cache: TypeCodeGenCache
     func_cache: Dict[int, Tuple[hir.Function, str]]
     mangling: Mangling
-    generated_code: ScratchBuffer
+    generated_code: Dict[str, str]
 
     def __init__(self) -> None:
         super().__init__()
         self.type_cache = TypeCodeGenCache()
         self.func_cache = {}
         self.mangling = Mangling()
-        self.generated_code = ScratchBuffer()
+        self.generated_code = {}
 
     def gen_function(self, func: hir.Function) -> str:
         if id(func) in self.func_cache:
             return self.func_cache[id(func)][1]
         func_code_gen = FuncCodeGen(self, func)
+        func_code_gen.gen()
         name = func_code_gen.name
         self.func_cache[id(func)] = (func, name)
-        func_code_gen.gen()
-        self.generated_code.merge(func_code_gen.body)
+        self._add_function(name, func_code_gen.body.body)
         return name
 
+    def _add_function(self, name: str, code: str) -> None:
+        # names identify the code (see `FuncCodeGen.gen`), only identical definitions are shared
+        existing = self.generated_code.setdefault(name, code)
+        assert existing == code, f"function {name} is generated with two different bodies"
+
+    def fragment(self) -> CppFragment:
+        """
+        The definitions generated so far.
+        """
+        return CppFragment(
+            list(self.type_cache.definitions.items()), list(self.generated_code.items())
+        )
+
+    def merge_fragment(self, fragment: CppFragment) -> None:
+        """
+        Append the definitions of `fragment`, skipping those already generated.
+        """
+        for name, code in fragment.types:
+            self.type_cache.define(name, code)
+        for name, code in fragment.functions:
+            self._add_function(name, code)
+
     def finalize_code(self) -> str:
-        return _get_cpp_lib() + self.type_cache.impl.body + self.generated_code.body
+        return (
+            _get_cpp_lib()
+            + "".join(self.type_cache.definitions.values())
+            + "".join(self.generated_code.values())
+        )
 
 
 class FuncCodeGen:
@@ -217,6 +269,7 @@ class FuncCodeGen:
     body: ScratchBuffer
     name: str
     signature: str
+    specifiers: str
     func: hir.Function
     params: Set[str]
     node_map: Dict[hir.Node, str]
@@ -238,16 +291,17 @@ class FuncCodeGen:
             p) for p in func.params)
         assert func.return_type
 
-        self.signature = f'auto {
-            self.name}({params}) -> {base.type_cache.gen(func.return_type)}'
+        # the name is completed once the body is generated
+        self.signature = f'({params}) -> {base.type_cache.gen(func.return_type)}'
+        self.specifiers = ''
         # if func.export:
-        #     self.signature = f'extern "C" {self.signature}'
+        #     self.specifiers = 'extern "C" '
         # else:
-        #     self.signature = f"inline {self.signature}"
-        # if func.inline_hint == 'always':
-        #     self.signature = f"__lc_always_inline__ {self.signature}"
-        # elif func.inline_hint == 'never':
-        #     self.signature = f"__lc_never_inline {self.signature}"
+        #     self.specifiers = "inline "
+        if func.inline_hint == 'always':
+            self.specifiers = "__lc_always_inline__ inline "
+        elif func.inline_hint == 'never':
+            self.specifiers = "__lc_never_inline__ "
         self.body = ScratchBuffer()
         self.params = set(p.name for p in func.params)
         self.node_map = {}
@@ -320,12 +374,28 @@ class FuncCodeGen:
         #     return ''
         if isinstance(expr, hir.Constant):
             value = expr.value
-            if isinstance(value, int):
-                return f"{value}"
-            elif isinstance(value, float):
-                return f"{value}f"
-            elif isinstance(value, bool):
+            if isinstance(value, bool):
                 return "true" if value else "false"
+            elif isinstance(value, int):
+                match expr.type:
+                    case hir.IntType(bits=32, signed=True) | None:
+                        return f"{value}"
+                    case hir.IntType(bits=32 | 64 as bits, signed=signed):
+                        suffix = ("" if signed else "u") + ("ll" if bits == 64 else "")
+                        return f"{value}{suffix}"
+                    case hir.FloatType(bits=64):
+                        return f"{float(value)!r}"
+                    case _:
+                        return f"{self.base.type_cache.gen(expr.type)}({value})"
+            elif isinstance(value, float):
+                # `repr` round-trips, so the literal is exactly the value of the constant
+                match expr.type:
+                    case hir.FloatType(bits=64):
+                        return f"{value!r}"
+                    case hir.FloatType(bits=32) | None:
+                        return f"{value!r}f"
+                    case _:
+                        return f"{self.base.type_cache.gen(expr.type)}({value!r}f)"
             elif isinstance(value, str):
                 return f"\"{value}\""
             elif isinstance(value, hir.Function):
@@ -570,7 +640,7 @@ class FuncCodeGen:
             loop_again = False
             old_bb = bb
             self.body.writeln(f"// BasicBlock Begin {bb.span}")
-            for node in bb.nodes():
+            for node in bb:
                 if (next := self.gen_node(node)) and next is not None:
                     assert node.next is None
                     loop_again = True
@@ -594,10 +664,14 @@ class FuncCodeGen:
             )
 
     def gen(self) -> None:
-        self.body.writeln(f"{self.signature} {{")
         self.body.indent += 1
         self.gen_locals()
         if self.func.body:
             self.gen_bb(self.func.body)
         self.body.indent -= 1
         self.body.writeln("}")
+        # instantiations of a template with different comptime arguments (or functions of the
+        # same name in different modules) share the mangled signature, the code tells them apart
+        contents = f"{self.specifiers}{self.signature} {{\n{self.body.body}"
+        self.name = f"{self.name}_{unique_hash(contents)}"
+        self.body.body = f"{self.specifiers}auto {self.name}{self.signature} {{\n{self.body.body}"
@@ -1,16 +1,27 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 from typing import *
 
-from luisa_lang import classinfo
+from luisa_lang import classinfo, hir
 
 from luisa_lang.lang_runtime import JitVar, KernelTracer, TraceContext, is_jit
-from luisa_lang.codegen.cpp import CppCodeGen
+from luisa_lang.codegen.cpp import CppCodeGen, CppFragment
+from luisa_lang.passes import PassManager
 import traceback
 
 
 class Compiler:
     codegen: CppCodeGen
+    opt_level: int
+    pass_manager: PassManager
 
-    def __init__(self, target: Literal["cpp", "custom"]):
+    def __init__(self, target: Literal["cpp", "custom"], opt_level: int = 0):
+        """
+        `opt_level` selects the passes run on the traced functions: 0 (-O0) runs none,
+        1 (-O1) and 2 (-O2) run the presets of `passes.pipeline`.
+        """
+        self.opt_level = opt_level
+        self.pass_manager = PassManager.for_level(opt_level)
         match target:
             case "cpp":
                 self.codegen = CppCodeGen()
@@ -28,21 +39,75 @@ class Compiler:
         Compile a function/kernel with example inputs.
         """
         try:
-            globalns = classinfo._get_func_globalns(f)
-            with KernelTracer(globalns) as tracer:
-                example_inputs = example_inputs or ()
-                example_kwargs = example_kwargs or {}
-                trace_ctx = TraceContext(True)
-                assert is_jit()
-                f(*example_inputs, **example_kwargs, __lc_ctx__=trace_ctx)
-                func_ir = trace_ctx.top_level_func
-                assert func_ir is not None
-            self.codegen.gen_function(func_ir)
+            func_ir = self._trace(f, example_inputs, example_kwargs)
+            self.codegen.gen_function(self.pass_manager.run(func_ir))
 
         except Exception as e:
             print(f"Error during function execution: {e}")
             traceback.print_exc()
             return
+
+    def compile_many(
+        self,
+        jobs: Sequence[Tuple[Callable[..., Any], Tuple[Any, ...] | None, Dict[str, Any] | None]],
+        max_workers: int | None = None,
+        processes: bool = False,
+    ) -> None:
+        """
+        Compile several functions/kernels, each given as `(f, example_inputs, example_kwargs)`.
+        The functions are traced concurrently in a thread pool of `max_workers` threads, code is
+        then generated in the order of `jobs`, so the output is the same as calling `compile`
+        on each job in turn.
+
+        With `processes=True`, both tracing and code generation run in a process pool instead.
+        The jobs must then be picklable, i.e. the functions and the types of the example inputs
+        must be defined at module level. Definitions shared by several jobs are emitted once.
+        """
+        if processes:
+            # forking a process that may have tracing threads running is unsafe
+            mp_context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as process_pool:
+                fragments = [
+                    process_pool.submit(
+                        _compile_fragment, f, example_inputs, example_kwargs, self.opt_level
+                    )
+                    for f, example_inputs, example_kwargs in jobs
+                ]
+                for fragment in fragments:
+                    try:
+                        self.codegen.merge_fragment(fragment.result())
+                    except Exception as e:
+                        print(f"Error during function execution: {e}")
+                        traceback.print_exc()
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(self._trace, f, example_inputs, example_kwargs)
+                for f, example_inputs, example_kwargs in jobs
+            ]
+            for future in futures:
+                try:
+                    self.codegen.gen_function(self.pass_manager.run(future.result()))
+                except Exception as e:
+                    print(f"Error during function execution: {e}")
+                    traceback.print_exc()
+
+    @staticmethod
+    def _trace(
+        f: Callable[..., Any],
+        example_inputs: Tuple[Any, ...] | None,
+        example_kwargs: Dict[str, Any] | None,
+    ) -> hir.Function:
+        globalns = classinfo._get_func_globalns(f)
+        with KernelTracer(globalns) as tracer:
+            example_inputs = example_inputs or ()
+            example_kwargs = example_kwargs or {}
+            trace_ctx = TraceContext(True)
+            assert is_jit()
+            f(*example_inputs, **example_kwargs, __lc_ctx__=trace_ctx)
+            func_ir = trace_ctx.top_level_func
+            assert func_ir is not None
+        return func_ir
     
     def output(self) -> str:
         """
@@ -51,4 +116,19 @@ class Compiler:
         return self.codegen.finalize_code()
 
 
+def _compile_fragment(
+    f: Callable[..., Any],
+    example_inputs: Tuple[Any, ...] | None,
+    example_kwargs: Dict[str, Any] | None,
+    opt_level: int = 0,
+) -> CppFragment:
+    """
+    Trace and generate code for a single job of `Compiler.compile_many` in a worker process.
+    """
+    codegen = CppCodeGen()
+    func_ir = Compiler._trace(f, example_inputs, example_kwargs)
+    codegen.gen_function(PassManager.for_level(opt_level).run(func_ir))
+    return codegen.fragment()
+
+
 __all__ = ["Compiler"]
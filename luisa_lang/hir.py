@@ -1,15 +1,22 @@
 import ast
+from collections import OrderedDict
 from dataclasses import dataclass
 from enum import Enum, auto
 import os
 import sys
+import threading
+import time
+from types import MappingProxyType
+import weakref
 from typing import (
     Any,
     Callable,
     List,
     Literal,
+    Mapping,
     Optional,
     Protocol,
+    Sequence,
     Set,
     Tuple,
     Dict,
@@ -19,17 +26,69 @@ from typing import (
 import typing
 from typing_extensions import override
 from luisa_lang import classinfo
-from luisa_lang.utils import Span, round_to_align, unwrap
-from abc import ABC, abstractmethod
+from luisa_lang.utils import Span, get_full_name, round_to_align, unwrap
+from abc import ABC, ABCMeta, abstractmethod
 
 PATH_PREFIX = "luisa_lang"
 
 
-class Type(ABC):
-    methods: Dict[str, "FunctionTemplate"]
+class _InternedTypeMeta(ABCMeta):
+    """
+    Hash-conses types: constructing a type structurally equal to an existing one returns that
+    object. Each type class defines `_intern_key`, which maps the constructor arguments to a
+    hashable key. The table holds types strongly, there are few distinct types in a program and
+    types such as `RefType` are recreated constantly during tracing.
+    """
+    _intern_key: Callable[..., Any]
+    _interned: Dict[Any, "Type"] = {}
+    # reentrant, constructors may create other types
+    _interned_lock = threading.RLock()
+
+    def __call__(cls, *args: Any, **kwargs: Any) -> Any:
+        key = (cls, cls._intern_key(*args, **kwargs))
+        interned = _InternedTypeMeta._interned
+        ty = interned.get(key)
+        if ty is not None:
+            return ty
+        with _InternedTypeMeta._interned_lock:
+            ty = interned.get(key)
+            if ty is None:
+                ty = super().__call__(*args, **kwargs)
+                ty._hash = hash(key)
+                ty._ctor_args = (args, kwargs)
+                interned[key] = ty
+            return ty
+
+
+def _make_type(cls: type, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> "Type":
+    return cls(*args, **kwargs)
+
+
+# methods of the DSL types, kept out of the type objects since few types have any
+_type_methods: Dict["Type", Dict[str, "FunctionTemplate"]] = {}
+_no_methods: Mapping[str, "FunctionTemplate"] = MappingProxyType({})
+
+
+class Type(ABC, metaclass=_InternedTypeMeta):
+    """
+    Base class of the HIR types. Types are interned, so structurally equal types are the same
+    object, and equality and hashing are by identity.
+    """
+    __slots__ = ("_hash", "_ctor_args")
+
+    _hash: int
+    _ctor_args: Tuple[Tuple[Any, ...], Dict[str, Any]]
 
-    def __init__(self):
-        self.methods = {}
+    @property
+    def methods(self) -> Mapping[str, "FunctionTemplate"]:
+        return _type_methods.get(self, _no_methods)
+
+    def add_method(self, name: str, template: "FunctionTemplate") -> None:
+        _type_methods.setdefault(self, {})[name] = template
+
+    @staticmethod
+    def _intern_key(*args: Any, **kwargs: Any) -> Any:
+        return ()
 
     @abstractmethod
     def size(self) -> int:
@@ -39,13 +98,15 @@ class Type(ABC):
     def align(self) -> int:
         pass
 
-    @abstractmethod
     def __eq__(self, value: object) -> bool:
-        pass
+        return self is value
 
-    @abstractmethod
     def __hash__(self) -> int:
-        pass
+        return self._hash
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # re-intern when unpickling
+        return (_make_type, (type(self), *self._ctor_args))
 
     def member(self, field: Any) -> Optional["Type"]:
         return None
@@ -69,6 +130,7 @@ class RefType(Type):
     """
     A logical reference type. Cannot be returned from functions/stored in aggregates.
     """
+    __slots__ = ("element",)
 
     element: Type
 
@@ -88,11 +150,9 @@ class RefType(Type):
         raise RuntimeError(
             "RefTypes are logical and thus do not have an align")
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, RefType) and value.element == self.element
-
-    def __hash__(self) -> int:
-        return hash((RefType, self.element))
+    @staticmethod
+    def _intern_key(element: Type) -> Any:
+        return element
 
     def __str__(self) -> str:
         return f"Ref[{self.element}]"
@@ -110,6 +170,8 @@ class RefType(Type):
 
 
 class LiteralType(Type):
+    __slots__ = ("value",)
+
     value: Any
 
     def __init__(self, value: Any) -> None:
@@ -130,52 +192,45 @@ class LiteralType(Type):
     def is_addressable(self) -> bool:
         return False
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, LiteralType) and value.value == self.value
-
-    def __hash__(self) -> int:
-        return hash((LiteralType, self.value))
+    @staticmethod
+    def _intern_key(value: Any) -> Any:
+        # `1`, `1.0` and `True` are equal but distinct literals
+        return (type(value), value)
 
 
 class UnitType(Type):
+    __slots__ = ()
+
     def size(self) -> int:
         return 0
 
     def align(self) -> int:
         return 1
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, UnitType)
-
-    def __hash__(self) -> int:
-        return hash(UnitType)
-
     def __str__(self) -> str:
         return "UnitType"
 
 
 class ScalarType(Type):
-    pass
+    __slots__ = ()
 
 
 class BoolType(ScalarType):
+    __slots__ = ()
+
     def size(self) -> int:
         return 1
 
     def align(self) -> int:
         return 1
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, BoolType)
-
-    def __hash__(self) -> int:
-        return hash(BoolType)
-
     def __str__(self) -> str:
         return "bool"
 
 
 class IntType(ScalarType):
+    __slots__ = ("bits", "signed")
+
     bits: int
     signed: bool
 
@@ -190,15 +245,9 @@ class IntType(ScalarType):
     def align(self) -> int:
         return self.size()
 
-    def __eq__(self, value: object) -> bool:
-        return (
-            isinstance(value, IntType)
-            and value.bits == self.bits
-            and value.signed == self.signed
-        )
-
-    def __hash__(self) -> int:
-        return hash((IntType, self.bits, self.signed))
+    @staticmethod
+    def _intern_key(bits: int, signed: bool) -> Any:
+        return (bits, signed)
 
     def __repr__(self) -> str:
         return f"IntType({self.bits}, {self.signed})"
@@ -208,6 +257,8 @@ class IntType(ScalarType):
 
 
 class FloatType(ScalarType):
+    __slots__ = ("bits",)
+
     bits: int
 
     def __init__(self, bits: int) -> None:
@@ -220,20 +271,20 @@ class FloatType(ScalarType):
     def align(self) -> int:
         return self.size()
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, FloatType) and value.bits == self.bits
+    @staticmethod
+    def _intern_key(bits: int) -> Any:
+        return bits
 
     def __repr__(self) -> str:
         return f"FloatType({self.bits})"
 
-    def __hash__(self) -> int:
-        return hash((FloatType, self.bits))
-
     def __str__(self) -> str:
         return f"f{self.bits}"
 
 
 class VectorType(Type):
+    __slots__ = ("element", "count", "_align", "_size")
+
     element: Type
     count: int
     _align: int
@@ -256,19 +307,13 @@ class VectorType(Type):
     def align(self) -> int:
         return self._align
 
-    def __eq__(self, value: object) -> bool:
-        return (
-            isinstance(value, VectorType)
-            and value.element == self.element
-            and value.count == self.count
-        )
+    @staticmethod
+    def _intern_key(element: Type, count: int, align: int | None = None) -> Any:
+        return (element, count, element.align() if align is None else align)
 
     def __repr__(self) -> str:
         return f"VectorType({self.element}, {self.count})"
 
-    def __hash__(self) -> int:
-        return hash((VectorType, self.element, self.count))
-
     def __str__(self) -> str:
         return f"<{self.count} x {self.element}>"
 
@@ -284,10 +329,12 @@ class VectorType(Type):
 
 
 class MatrixType(Type):
-    pass
+    __slots__ = ()
 
 
 class ArrayType(Type):
+    __slots__ = ("element", "count")
+
     element: Type
     count: int
 
@@ -302,24 +349,20 @@ class ArrayType(Type):
     def align(self) -> int:
         return self.element.align()
 
-    def __eq__(self, value: object) -> bool:
-        return (
-            isinstance(value, ArrayType)
-            and value.element == self.element
-            and value.count == self.count
-        )
+    @staticmethod
+    def _intern_key(element: Type, count: int) -> Any:
+        return (element, count)
 
     def __repr__(self) -> str:
         return f"ArrayType({self.element}, {self.count})"
 
-    def __hash__(self) -> int:
-        return hash((ArrayType, self.element, self.count))
-
     def __str__(self) -> str:
         return f"[{self.count} x {self.element}]"
 
 
 class PointerType(Type):
+    __slots__ = ("element",)
+
     element: Type
 
     def __init__(self, element: Type) -> None:
@@ -332,20 +375,20 @@ class PointerType(Type):
     def align(self) -> int:
         return 8
 
-    def __eq__(self, value: object) -> bool:
-        return isinstance(value, PointerType) and value.element == self.element
+    @staticmethod
+    def _intern_key(element: Type) -> Any:
+        return element
 
     def __repr__(self) -> str:
         return f"PointerType({self.element})"
 
-    def __hash__(self) -> int:
-        return hash((PointerType, self.element))
-
     def __str__(self) -> str:
         return f"*{self.element}"
 
 
 class TupleType(Type):
+    __slots__ = ("elements",)
+
     elements: List[Type]
 
     def __init__(self, elements: List[Type]) -> None:
@@ -358,17 +401,13 @@ class TupleType(Type):
     def align(self) -> int:
         return max(element.align() for element in self.elements)
 
-    def __eq__(self, value: object) -> bool:
-        return self is value or (
-            isinstance(value, TupleType) and value.elements == self.elements
-        )
+    @staticmethod
+    def _intern_key(elements: List[Type]) -> Any:
+        return tuple(elements)
 
     def __repr__(self) -> str:
         return f"TupleType({self.elements})"
 
-    def __hash__(self) -> int:
-        return hash((TupleType, tuple(self.elements)))
-
     def __str__(self) -> str:
         return f"({', '.join(str(e) for e in self.elements)})"
 
@@ -381,6 +420,8 @@ class TupleType(Type):
 
 
 class StructType(Type):
+    __slots__ = ("name", "display_name", "_fields", "_field_dict")
+
     name: str
     display_name: str
     _fields: List[Tuple[str, Type]]
@@ -396,15 +437,14 @@ class StructType(Type):
         self.display_name = display_name
         self._field_dict = {name: ty for name, ty in fields}
 
+    @staticmethod
+    def _intern_key(name: str, display_name: str, fields: List[Tuple[str, Type]]) -> Any:
+        return (name, tuple(fields))
+
     @property
     def fields(self) -> List[Tuple[str, Type]]:
         return self._fields
 
-    @fields.setter
-    def fields(self, value: List[Tuple[str, Type]]) -> None:
-        self._fields = value
-        self._field_dict = {name: ty for name, ty in value}
-
     def size(self) -> int:
         return sum(field.size() for _, field in self.fields)
 
@@ -414,14 +454,6 @@ class StructType(Type):
     def __str__(self) -> str:
         return self.display_name
 
-    @override
-    def __eq__(self, value: object) -> bool:
-        return value is self or (
-            isinstance(value, StructType)
-            and value.fields == self.fields
-            and value.name == self.name
-        )
-
     @override
     def member(self, field: Any) -> Optional["Type"]:
         if isinstance(field, str):
@@ -429,12 +461,10 @@ class StructType(Type):
                 return self._field_dict[field]
         return Type.member(self, field)
 
-    @override
-    def __hash__(self) -> int:
-        return hash((StructType, tuple(self.fields), self.name))
-
 
 class OpaqueType(Type):
+    __slots__ = ("name", "extra_args")
+
     name: str
     extra_args: List[Any]
 
@@ -449,15 +479,9 @@ class OpaqueType(Type):
     def align(self) -> int:
         raise RuntimeError("OpaqueType has no align")
 
-    def __eq__(self, value: object) -> bool:
-        return (
-            isinstance(value, OpaqueType)
-            and value.name == self.name
-            and value.extra_args == self.extra_args
-        )
-
-    def __hash__(self) -> int:
-        return hash((OpaqueType, self.name, tuple(self.extra_args)))
+    @staticmethod
+    def _intern_key(name: str, extra: List[Any] | None = None) -> Any:
+        return (name, tuple(extra or ()))
 
     def __str__(self) -> str:
         return self.name
@@ -475,30 +499,130 @@ class TemplateArgs(Protocol):
     pass
 
 
+class TemplateStats:
+    """
+    Counters of a template cache. `instantiation_time` is the total time in seconds spent
+    instantiating, including instantiations that were later evicted.
+    """
+    hits: int
+    misses: int
+    evictions: int
+    instantiation_time: float
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.instantiation_time = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"TemplateStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+            f"instantiation_time={self.instantiation_time:.6f})"
+        )
+
+
+_MISSING: Any = object()
+
+
 class Template[T, Args: TemplateArgs]:
-    cache: Dict[Args, T]
+    """
+    Instantiations of a template, created on demand. Instantiation is thread-safe: concurrent
+    requests for the same arguments wait for a single instantiation, while different arguments
+    are instantiated in parallel.
+
+    The cache holds at most `capacity` instantiations (or `Template.default_capacity` if
+    `capacity` is None), the least recently used ones are evicted first. None means unbounded.
+    """
+    default_capacity: ClassVar[Optional[int]] = None
+    cache: OrderedDict[Args, T]
+    capacity: Optional[int]
+    stats: TemplateStats
     instantiation_func: Callable[[Args], T]
     arg_type: type[Args]
+    _lock: threading.Lock
+    _pending: Dict[Args, threading.RLock]
 
     def __init__(
-        self, arg_type: type[Args], instantiation_func: Callable[[Args], T]
+        self,
+        arg_type: type[Args],
+        instantiation_func: Callable[[Args], T],
+        capacity: Optional[int] = None,
     ) -> None:
-        self.cache = {}
+        self.cache = OrderedDict()
+        self.capacity = capacity
+        self.stats = TemplateStats()
         self.instantiation_func = instantiation_func
         self.arg_type = arg_type
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _lookup(self, args: Args) -> Any:
+        """
+        The cached instantiation for `args`, or `_MISSING`.
+        """
+        value = self.cache.get(args, _MISSING)
+        if value is not _MISSING:
+            self.stats.hits += 1
+            if self.capacity is not None or Template.default_capacity is not None:
+                self._touch(args)
+        return value
+
+    def _touch(self, args: Args) -> None:
+        # the recency order only matters for bounded caches
+        with self._lock:
+            if args in self.cache:
+                self.cache.move_to_end(args)
+
+    def _evict(self) -> None:
+        # the caller holds `_lock`
+        capacity = self.capacity if self.capacity is not None else Template.default_capacity
+        if capacity is None:
+            return
+        while len(self.cache) > capacity:
+            self.cache.popitem(last=False)
+            self.stats.evictions += 1
 
     def instantiate(self, args: Args) -> T:
-        if args in self.cache:
-            return self.cache[args]
-        func = self.instantiation_func(args)
-        self.cache[args] = func
-        return func
+        value = self._lookup(args)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            # reentrant so that a recursive instantiation fails the same way as without locking
+            key_lock = self._pending.setdefault(args, threading.RLock())
+        try:
+            with key_lock:
+                value = self._lookup(args)
+                if value is not _MISSING:
+                    return value
+                start = time.perf_counter()
+                func = self.instantiation_func(args)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.stats.misses += 1
+                    self.stats.instantiation_time += elapsed
+                    self.cache[args] = func
+                    self._evict()
+                return func
+        finally:
+            with self._lock:
+                if self._pending.get(args) is key_lock:
+                    del self._pending[args]
+
+    def set_capacity(self, capacity: Optional[int]) -> None:
+        """
+        Set the capacity of this template, None to fall back to `Template.default_capacity`.
+        """
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
 
     def default(self) -> T:
         return self.instantiate(self.arg_type())
 
     def clear_instantiations(self) -> None:
-        self.cache = {}
+        with self._lock:
+            self.cache = OrderedDict()
 
 
 type TypeTemplateArgs = Tuple[classinfo.VarType, ...]
@@ -509,50 +633,66 @@ class TypeTemplate(Template[Type, TypeTemplateArgs]):
 
 
 class PyTreeStructure:  # TODO: refactor this into another file
+    """
+    The structure of a pytree, with the DSL values replaced by their types.
+
+    Structures are hash-consed: constructing a structure equal to a live one returns that
+    object, so equal structures are identical and compare in O(1). The order-sensitive hash
+    is computed once, from the metadata and the (already hashed) children.
+    """
     metadata: (
         Tuple[type, Tuple[Any], Any] | None
         # for JitVars, this is (type, type_args, hir.Type), for other types, this is (type, (), Any)
     )
-    children: List["PyTreeStructure"]
+    children: Tuple["PyTreeStructure", ...]
+    _hash: int
+    _interned: ClassVar[weakref.WeakValueDictionary[Any, "PyTreeStructure"]] = weakref.WeakValueDictionary()
+    _interned_lock: ClassVar[threading.Lock] = threading.Lock()
 
-    def __init__(
-        self,
+    def __new__(
+        cls,
         metadata: Tuple[type, Tuple[Any], Any] | None = None,
-        children: List["PyTreeStructure"] | None = None,
-    ) -> None:
-        self.metadata = metadata
-        self.children = children or []
+        children: Sequence["PyTreeStructure"] | None = None,
+    ) -> "PyTreeStructure":
+        children = tuple(children) if children else ()
+        # the types are part of the key, as `1 == 1.0 == True`
+        key = (type(metadata[2]) if metadata is not None else None, metadata, children)
+        existing = cls._interned.get(key)
+        if existing is not None:
+            return existing
+        with cls._interned_lock:
+            existing = cls._interned.get(key)
+            if existing is not None:
+                return existing
+            self = object.__new__(cls)
+            self.metadata = metadata
+            self.children = children
+            self._hash = hash(key)
+            cls._interned[key] = self
+            return self
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # re-intern when unpickling
+        return (PyTreeStructure, (self.metadata, self.children))
 
     def __eq__(self, value: object) -> bool:
-        if not isinstance(value, PyTreeStructure):
-            return False
-        if self.metadata != value.metadata:
-            return False
-        if len(self.children) != len(value.children):
-            return False
-        for a, b in zip(self.children, value.children):
-            if a != b:
-                return False
-        return True
+        return self is value
 
     def __hash__(self) -> int:
-        h = hash(PyTreeStructure)
-        if self.metadata is not None:
-            h ^= hash(self.metadata[0])
-            for arg in self.metadata[1]:
-                h ^= hash(arg)
-            h ^= hash(self.metadata[2])
-        for child in self.children:
-            h ^= hash(child)
-        return h
+        return self._hash
 
 
 type FunctionTemplateArg = PyTreeStructure
 
 
 class FunctionTemplateArgs:
+    """
+    The structures of the arguments a function template is instantiated with. As the structures
+    are hash-consed, comparing two instances only compares the argument structures by identity.
+    """
     __args: List[FunctionTemplateArg]
     __kwargs: Dict[str, FunctionTemplateArg]
+    __hash: int
 
     def __init__(
         self,
@@ -561,6 +701,8 @@ class FunctionTemplateArgs:
     ) -> None:
         self.__args = args or []
         self.__kwargs = kwargs or {}
+        # keyword arguments are unordered
+        self.__hash = hash((tuple(self.__args), frozenset(self.__kwargs.items())))
 
     @property
     def args(self) -> List[FunctionTemplateArg]:
@@ -577,38 +719,35 @@ class FunctionTemplateArgs:
         other_kwargs = other.kwargs
 
         return (
-            len(self.__args) == len(other_args)
-            and all(a == b for a, b in zip(self.__args, other_args))
-            and len(self.__kwargs) == len(other_kwargs)
-            and all(
-                k in self.__kwargs and self.__kwargs[k] == v
-                for k, v in other_kwargs.items()
-            )
+            self.__hash == other.__hash
+            and self.__args == other_args
+            and self.__kwargs == other_kwargs
         )
 
     def __hash__(self) -> int:
-        h = hash(FunctionTemplateArgs)
-        h ^= hash(len(self.__args))
-        for a in self.__args:
-            h ^= hash(a)
-        h ^= hash(len(self.__kwargs))
-        for k, v in self.__kwargs.items():
-            h ^= hash(k)
-            h ^= hash(v)
-        return h
+        return self.__hash
 
 
 class FunctionTemplate(Template["Function", FunctionTemplateArgs]):
     pass
 
 
+InlineHint = Literal["always", "never", "auto"]
+INLINE_HINTS: Tuple[InlineHint, ...] = ("always", "never", "auto")
+
+
 class Function:
+    """
+    `inline_hint` asks the inliner (and the C++ compiler) to always or never inline calls to
+    the function, "auto" leaves it to their cost models.
+    """
     name: str
     params: List["Var"]
     locals: List["Var"]
     body: "BasicBlock"
     return_jitvar_type: typing.Type['Any']
     return_type: Type
+    inline_hint: InlineHint
 
     def __init__(
         self,
@@ -617,7 +756,8 @@ class Function:
         locals: List["Var"],
         body: "BasicBlock",
         return_jitvar_type: typing.Type['Any'],
-        return_type: Type
+        return_type: Type,
+        inline_hint: InlineHint = "auto",
     ) -> None:
         self.name = name
         self.params = params
@@ -625,25 +765,31 @@ class Function:
         self.body = body
         self.return_type = return_type
         self.return_jitvar_type = return_jitvar_type
+        self.inline_hint = inline_hint
 
 
 class Node:
     """
     Base class for all nodes in the HIR. A node could be a value, a reference, or a statement.
     Nodes equality is based on their identity.
+    A node inserted into a basic block knows the block and caches its position in it, its
+    neighbours are looked up through the block.
     """
+    __slots__ = ("span", "block", "_index", "func")
+    # attributes holding the operands of the node, either a node, None or a list of nodes
+    operand_fields: ClassVar[Tuple[str, ...]] = ()
+    # attributes holding nested basic blocks (or None), in program order
+    block_fields: ClassVar[Tuple[str, ...]] = ()
 
     span: Optional[Span]
-    prev: Optional["Node"]
-    next: Optional["Node"]
     block: Optional["BasicBlock"]
+    _index: int
     func: Optional[Function]
 
     def __init__(self, span: Optional[Span] = None) -> None:
         self.span = span
-        self.prev = None
-        self.next = None
         self.block = None
+        self._index = -1
         self.func = None
 
     def __eq__(self, value: object) -> bool:
@@ -652,47 +798,111 @@ class Node:
     def __hash__(self) -> int:
         return id(self)
 
+    @property
+    def prev(self) -> Optional["Node"]:
+        block = self.block
+        if block is None:
+            return None
+        return block._live_before(block._index_of(self))
+
+    @property
+    def next(self) -> Optional["Node"]:
+        block = self.block
+        if block is None:
+            return None
+        return block._live_after(block._index_of(self))
+
+    def operands(self) -> List["TypedNode"]:
+        operands: List[TypedNode] = []
+        for name in self.operand_fields:
+            v = getattr(self, name)
+            if type(v) is list:
+                operands.extend(x for x in v if isinstance(x, TypedNode))
+            elif v is not None:
+                operands.append(v)
+        return operands
+
+    def replace_operand(self, old: "TypedNode", new: "TypedNode") -> None:
+        """
+        Replace every occurrence of `old` among the operands with `new`.
+        """
+        tracked = self.block is not None
+        for name in self.operand_fields:
+            v = getattr(self, name)
+            if type(v) is list:
+                for i, x in enumerate(v):
+                    if x is old:
+                        v[i] = new
+                        if tracked:
+                            old._remove_use(self)
+                            new._add_use(self)
+            elif v is old:
+                setattr(self, name, new)
+                if tracked:
+                    old._remove_use(self)
+                    new._add_use(self)
+
+    def _add_uses(self) -> None:
+        for name in self.operand_fields:
+            v = getattr(self, name)
+            if type(v) is list:
+                for x in v:
+                    if isinstance(x, TypedNode):
+                        x._add_use(self)
+            elif v is not None:
+                v._add_use(self)
+
+    def _remove_uses(self) -> None:
+        for name in self.operand_fields:
+            v = getattr(self, name)
+            if type(v) is list:
+                for x in v:
+                    if isinstance(x, TypedNode):
+                        x._remove_use(self)
+            elif v is not None:
+                v._remove_use(self)
+
     def append(self, node: "Node") -> "Node":
-        assert node.next is None
-        assert node.prev is None
-        if node.block is not None:
-            assert node.block is self.block
-        else:
-            node.block = self.block
-        if self.next is not None:
-            self.next.prev = node
-        node.prev = self
-        node.next = self.next
-        self.next = node
-        if self.block:
-            if self.block.tail is self:
-                self.block.tail = node
+        """
+        Insert `node` right after this node.
+        """
+        block = self.block
+        assert block is not None, "cannot insert next to a node that is not in a basic block"
+        block._insert(block._index_of(self) + 1, node)
         return node
 
     def prepend(self, node: "Node") -> "Node":
-        assert node.next is None
-        assert node.prev is None
-        if node.block is not None:
-            assert node.block is self
-        else:
-            node.block = self.block
-        if self.prev is not None:
-            self.prev.next = node
-        node.next = self
-        node.prev = self.prev
-        self.prev = node
-        if self.block:
-            if self.block.head is self:
-                self.block.head = node
+        """
+        Insert `node` right before this node.
+        """
+        block = self.block
+        assert block is not None, "cannot insert next to a node that is not in a basic block"
+        block._insert(block._index_of(self), node)
         return node
 
     def remove(self) -> None:
-        if self.prev is not None:
-            self.prev.next = self.next
-        if self.next is not None:
-            self.next.prev = self.prev
-        self.prev = None
-        self.next = None
+        """
+        Remove this node from its basic block, if any.
+        """
+        block = self.block
+        if block is not None:
+            block._remove_at(block._index_of(self))
+
+
+_slots_cache: Dict[type, Tuple[str, ...]] = {}
+
+
+def slots_of(cls: type) -> Tuple[str, ...]:
+    """
+    Names of the slots of a node class, including those of its base classes.
+    """
+    slots = _slots_cache.get(cls)
+    if slots is None:
+        slots = tuple(
+            name for base in reversed(cls.__mro__) for name in base.__dict__.get("__slots__", ())
+        )
+        _slots_cache[cls] = slots
+    return slots
 
 
 class SpannedError(Exception):
@@ -720,44 +930,147 @@ class TypeCheckError(SpannedError):
 
 
 class BasicBlock(Node):
-    head: Node | None
-    tail: Node | None
+    """
+    A sequence of nodes, stored in an array. Removed nodes leave a `None` tombstone behind, so
+    removal is O(1) and does not disturb iterations in progress; tombstones are compacted away
+    once they outnumber the live nodes. The positions cached in the nodes are only computed when
+    needed, appending a node is just a list append.
+    Nodes are registered as users of their operands while they are in a block.
+    """
+    __slots__ = ("_nodes", "_num_live", "_stale_from", "_iterators", "terminated")
+
+    _nodes: List[Optional[Node]]
+    _num_live: int
+    # cached positions of the nodes at and after `_stale_from` may be out of date
+    _stale_from: int
+    # compaction would move the nodes under active iterators
+    _iterators: int
     terminated: bool
 
     def __init__(self, span: Optional[Span] = None) -> None:
-        self.head = None
-        self.tail = None
+        self._nodes = []
+        self._num_live = 0
+        self._stale_from = 0
+        self._iterators = 0
         self.terminated = False
         self.span = span
 
+    @property
+    def head(self) -> Optional[Node]:
+        return self._live_after(-1)
+
+    @property
+    def tail(self) -> Optional[Node]:
+        return self._live_before(len(self._nodes))
+
     def append[T: Node](self, node: T) -> T:
         assert node.block is None
-        node.block = self
         if isinstance(node, Terminator):
             assert not self.terminated
             self.terminated = True
-        if self.tail is not None:
-            self.tail = self.tail.append(node)
-        else:
-            self.head = node
-            self.tail = node
+        node.block = self
+        self._nodes.append(node)
+        self._num_live += 1
+        node._add_uses()
         return node
 
     def nodes(self) -> List[Node]:
-        nodes = []
-        node = self.head
-        while node is not None:
-            nodes.append(node)
-            node = node.next
-        return nodes
+        return list(self)
+
+    def __iter__(self) -> typing.Iterator[Node]:
+        """
+        Iterate over the nodes in order. Nodes may be removed or inserted during the iteration,
+        nodes inserted after the current one are visited.
+        """
+        self._maybe_compact()
+        nodes = self._nodes
+        self._iterators += 1
+        try:
+            i = 0
+            while i < len(nodes):
+                node = nodes[i]
+                if node is not None:
+                    yield node
+                    if nodes[i] is not node and node.block is self:
+                        # something was inserted before `node`
+                        i = self._index_of(node)
+                i += 1
+        finally:
+            self._iterators -= 1
+
+    def num_nodes(self) -> int:
+        return self._num_live
+
+    def _index_of(self, node: Node) -> int:
+        nodes = self._nodes
+        i = node._index
+        if 0 <= i < len(nodes) and nodes[i] is node:
+            return i
+        assert node.block is self
+        for j in range(self._stale_from, len(nodes)):
+            n = nodes[j]
+            if n is not None:
+                n._index = j
+        self._stale_from = len(nodes)
+        return node._index
+
+    def _live_after(self, i: int) -> Optional[Node]:
+        nodes = self._nodes
+        for j in range(i + 1, len(nodes)):
+            node = nodes[j]
+            if node is not None:
+                return node
+        return None
+
+    def _live_before(self, i: int) -> Optional[Node]:
+        nodes = self._nodes
+        for j in range(i - 1, -1, -1):
+            node = nodes[j]
+            if node is not None:
+                return node
+        return None
+
+    def _insert(self, i: int, node: Node) -> None:
+        assert node.block is None
+        if i == len(self._nodes):
+            self.append(node)
+            return
+        node.block = self
+        node._index = i
+        self._nodes.insert(i, node)
+        self._num_live += 1
+        self._stale_from = min(self._stale_from, i + 1)
+        node._add_uses()
+
+    def _remove_at(self, i: int) -> None:
+        node = self._nodes[i]
+        assert node is not None
+        self._nodes[i] = None
+        self._num_live -= 1
+        node._remove_uses()
+        node.block = None
+        node._index = -1
+        if isinstance(node, Terminator):
+            self.terminated = False
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        nodes = self._nodes
+        if self._iterators == 0 and len(nodes) > 2 * self._num_live + 16:
+            nodes[:] = [node for node in nodes if node is not None]
+            self._stale_from = 0
 
 
 class TypedNode(Node):
     """
     A node with a type, which can either be values or references.
+    Typed nodes can be operands, and keep track of the nodes in basic blocks that use them.
     """
+    __slots__ = ("type", "_uses")
 
     type: Optional[Type]
+    # the users, one entry per use: None, a single node, or a list once there are several
+    _uses: Union[None, Node, List[Node]]
 
     def __init__(
         self, type: Optional[Type] = None, span: Optional[Span] = None
@@ -765,6 +1078,59 @@ class TypedNode(Node):
         super().__init__()
         self.type = type
         self.span = span
+        self._uses = None
+
+    @property
+    def uses(self) -> List[Node]:
+        """
+        The nodes using this node as an operand, once per use. The list is a copy.
+        """
+        uses = self._uses
+        if uses is None:
+            return []
+        if isinstance(uses, list):
+            return list(uses)
+        return [uses]
+
+    def num_uses(self) -> int:
+        uses = self._uses
+        if uses is None:
+            return 0
+        if isinstance(uses, list):
+            return len(uses)
+        return 1
+
+    def replace_all_uses_with(self, new: "TypedNode") -> None:
+        """
+        Make every user of this node use `new` instead.
+        """
+        assert new is not self
+        for user in self.uses:
+            user.replace_operand(self, new)
+
+    def _add_use(self, user: Node) -> None:
+        uses = self._uses
+        if uses is None:
+            self._uses = user
+        elif isinstance(uses, list):
+            uses.append(user)
+        else:
+            self._uses = [uses, user]
+
+    def _remove_use(self, user: Node) -> None:
+        uses = self._uses
+        if uses is user:
+            self._uses = None
+            return
+        assert isinstance(uses, list), "not a user of this node"
+        for i in range(len(uses) - 1, -1, -1):
+            if uses[i] is user:
+                del uses[i]
+                break
+        else:
+            raise AssertionError("not a user of this node")
+        if len(uses) == 1:
+            self._uses = uses[0]
 
 
 class ValueCategory(Enum):
@@ -774,6 +1140,8 @@ class ValueCategory(Enum):
 
 
 class Value(TypedNode):
+    __slots__ = ("category",)
+
     category: ValueCategory
 
     def __init__(self, type: Optional[Type] = None,
@@ -788,6 +1156,8 @@ class Value(TypedNode):
 
 
 class Unit(Value):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__(UnitType())
 
@@ -798,6 +1168,8 @@ class ParameterSemantic(Enum):
 
 
 class Var(TypedNode):
+    __slots__ = ("name", "semantic")
+
     name: str
     semantic: ParameterSemantic
 
@@ -816,6 +1188,9 @@ class Var(TypedNode):
 
 
 class VarValue(Value):
+    __slots__ = ("var",)
+    operand_fields = ("var",)
+
     var: Var
 
     def __init__(self, var: Var, span: Optional[Span] = None) -> None:
@@ -824,6 +1199,9 @@ class VarValue(Value):
 
 
 class VarRef(Value):
+    __slots__ = ("var",)
+    operand_fields = ("var",)
+
     var: Var
 
     def __init__(self, var: Var, span: Optional[Span] = None) -> None:
@@ -836,6 +1214,9 @@ class VarRef(Value):
 
 
 class Member(Value):
+    __slots__ = ("base", "field")
+    operand_fields = ("base",)
+
     base: Value
     field: str
 
@@ -848,6 +1229,9 @@ class Member(Value):
 
 
 class Index(Value):
+    __slots__ = ("base", "index")
+    operand_fields = ("base", "index")
+
     base: Value
     index: Value
 
@@ -860,6 +1244,9 @@ class Index(Value):
 
 
 class Load(Value):
+    __slots__ = ("ref",)
+    operand_fields = ("ref",)
+
     ref: Value
 
     def __init__(self, ref: Value) -> None:
@@ -869,6 +1256,8 @@ class Load(Value):
 
 
 class Constant(Value):
+    __slots__ = ("value",)
+
     value: Any
 
     def __init__(
@@ -892,6 +1281,7 @@ class Alloca(Value):
     """
     A temporary variable
     """
+    __slots__ = ()
 
     def __init__(self, ty: Type, span: Optional[Span] = None) -> None:
         # assert isinstance(ty, RefType), f"expected a RefType but got {ty}"
@@ -907,6 +1297,9 @@ class Alloca(Value):
 
 
 class AggregateInit(Value):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     args: List[Value]
 
     def __init__(
@@ -917,6 +1310,9 @@ class AggregateInit(Value):
 
 
 class Intrinsic(Value):
+    __slots__ = ("name", "args")
+    operand_fields = ("args",)
+
     name: str
     args: List[Value]
 
@@ -935,6 +1331,9 @@ class Intrinsic(Value):
 
 
 class Call(Value):
+    __slots__ = ("op", "args")
+    operand_fields = ("args",)
+
     op: "Function"
 
     args: List[Value]
@@ -952,6 +1351,9 @@ class Call(Value):
 
 
 class Assign(Node):
+    __slots__ = ("ref", "value")
+    operand_fields = ("ref", "value")
+
     ref: Value
     value: Value
 
@@ -967,6 +1369,9 @@ class Assign(Node):
 
 
 class Assert(Node):
+    __slots__ = ("cond", "msg")
+    operand_fields = ("cond", "msg")
+
     cond: Value
     msg: List[Union[Value, str]]
 
@@ -979,6 +1384,9 @@ class Assert(Node):
 
 
 class Print(Node):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     args: List[Union[Value, str]]
 
     def __init__(
@@ -989,10 +1397,14 @@ class Print(Node):
 
 
 class Terminator(Node):
-    pass
+    __slots__ = ()
 
 
 class Loop(Terminator):
+    __slots__ = ("prepare", "cond", "body", "update", "merge")
+    operand_fields = ("cond",)
+    block_fields = ("prepare", "body", "update", "merge")
+
     prepare: BasicBlock
     cond: Optional[Value]
     body: BasicBlock
@@ -1017,6 +1429,8 @@ class Loop(Terminator):
 
 
 class Break(Terminator):
+    __slots__ = ("target",)
+
     target: Loop | None
 
     def __init__(self, target: Loop | None, span: Optional[Span] = None) -> None:
@@ -1025,6 +1439,8 @@ class Break(Terminator):
 
 
 class Continue(Terminator):
+    __slots__ = ("target",)
+
     target: Loop | None
 
     def __init__(self, target: Loop | None, span: Optional[Span] = None) -> None:
@@ -1033,6 +1449,10 @@ class Continue(Terminator):
 
 
 class If(Terminator):
+    __slots__ = ("cond", "then_body", "else_body", "merge")
+    operand_fields = ("cond",)
+    block_fields = ("then_body", "else_body", "merge")
+
     cond: Value
     then_body: BasicBlock
     else_body: Optional[BasicBlock]
@@ -1054,6 +1474,9 @@ class If(Terminator):
 
 
 class Return(Terminator):
+    __slots__ = ("value",)
+    operand_fields = ("value",)
+
     value: Optional[Value]
 
     def __init__(self, value: Optional[Value], span: Optional[Span] = None) -> None:
@@ -1062,6 +1485,9 @@ class Return(Terminator):
 
 
 class Range(Value):
+    __slots__ = ("start", "step", "stop")
+    operand_fields = ("start", "stop", "step")
+
     start: Value
     step: Value
     stop: Value
@@ -1083,13 +1509,17 @@ class GlobalContext:
     types: Dict[type, TypeTemplate]
     functions: Dict[Callable[..., Any], FunctionTemplate]
     _instance: ClassVar["GlobalContext"]
+    _instance_lock: ClassVar[threading.Lock] = threading.Lock()
 
     @staticmethod
     def get() -> "GlobalContext":
         if not hasattr(GlobalContext, "_instance"):
-            GlobalContext._instance = GlobalContext.__new__(GlobalContext)
-            GlobalContext._instance.types = {}
-            GlobalContext._instance.functions = {}
+            with GlobalContext._instance_lock:
+                if not hasattr(GlobalContext, "_instance"):
+                    instance = GlobalContext.__new__(GlobalContext)
+                    instance.types = {}
+                    instance.functions = {}
+                    GlobalContext._instance = instance
         return GlobalContext._instance
 
     def clear_all_instantiations(self) -> None:
@@ -1098,6 +1528,36 @@ class GlobalContext:
         for func in self.functions.values():
             func.clear_instantiations()
 
+    def set_template_capacity(self, capacity: Optional[int]) -> None:
+        """
+        Set the capacity of all templates that have no capacity of their own, None for unbounded.
+        """
+        Template.default_capacity = capacity
+        for _, template in self._templates():
+            template.set_capacity(template.capacity)
+
+    def _templates(self) -> List[Tuple[str, Template[Any, Any]]]:
+        templates: List[Tuple[str, Template[Any, Any]]] = []
+        templates.extend((get_full_name(cls), ty) for cls, ty in list(self.types.items()))
+        templates.extend((get_full_name(f), func) for f, func in list(self.functions.items()))
+        return templates
+
+    def template_report(self, top: int = 10) -> str:
+        """
+        A table of the `top` templates that spent the most time instantiating.
+        """
+        templates = sorted(
+            self._templates(), key=lambda t: t[1].stats.instantiation_time, reverse=True
+        )[:top]
+        lines = [f"{'template':<48} {'size':>6} {'hits':>8} {'misses':>8} {'evicted':>8} {'time (ms)':>10}"]
+        for name, template in templates:
+            stats = template.stats
+            lines.append(
+                f"{name:<48} {len(template.cache):>6} {stats.hits:>8} {stats.misses:>8} "
+                f"{stats.evictions:>8} {stats.instantiation_time * 1e3:>10.2f}"
+            )
+        return "\n".join(lines)
+
 
 def get_dsl_type(target: type) -> TypeTemplate:
     """
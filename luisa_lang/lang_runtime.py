@@ -3,15 +3,23 @@ Runtime support for DSL
 """
 
 from abc import abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+import copy
+import dataclasses
+import operator
+import threading
 import typing
 
-from luisa_lang.utils import IdentityDict, check_type, is_generic_class
+from luisa_lang.utils import TypePattern, compile_type_pattern, is_generic_class, unwrap
 import luisa_lang.hir as hir
 from luisa_lang.hir import PyTreeStructure
+from luisa_lang.passes.constant_fold import fold_intrinsic, round_to_type
 from typing import (
     Any,
     Callable,
     Dict,
+    Iterator,
     List,
     Mapping,
     Optional,
@@ -27,10 +35,22 @@ class Scope:
     parent: Optional["Scope"]
     bb: hir.BasicBlock
     local_refs: Dict[str, hir.Var]
+    inline: bool
 
-    def __init__(self, parent: Optional["Scope"], span: Optional[hir.Span] = None):
+    def __init__(
+        self, parent: Optional["Scope"], span: Optional[hir.Span] = None, inline: bool = False
+    ):
+        """
+        The code of an inline scope, such as the branch taken by a static `if`, continues the
+        basic block of its parent.
+        """
         self.parent = parent
-        self.bb = hir.BasicBlock(span)
+        self.inline = inline
+        if inline:
+            assert parent is not None, "an inline scope needs a parent"
+            self.bb = parent.bb
+        else:
+            self.bb = hir.BasicBlock(span)
         self.local_refs = {}
 
     def is_local_ref_defined(self, name: str) -> bool:
@@ -70,12 +90,16 @@ class FuncTracer:
         self.name = name
         self.entry_bb = self.scopes[0].bb
 
-    def push_scope(self) -> Scope:
-        self.scopes.append(Scope(self.scopes[-1]))
+    def push_scope(self, inline: bool = False) -> Scope:
+        self.scopes.append(Scope(self.scopes[-1], inline=inline))
         return self.scopes[-1]
 
     def pop_scope(self) -> Scope:
-        return self.scopes.pop()
+        scope = self.scopes.pop()
+        if scope.inline:
+            # control flow inside the scope may have moved on to a merge block
+            self.scopes[-1].bb = scope.bb
+        return scope
 
     def create_var(self, name: str, ty: hir.Type, is_param: bool) -> hir.Var:
         if self.scopes[-1].is_local_ref_defined(name):
@@ -167,15 +191,17 @@ class FuncTracer:
         )
 
 
-FUNC_STACK: List[FuncTracer] = []
+# each thread (and asyncio task) traces with its own stack of function tracers
+FUNC_STACK: ContextVar[Tuple[FuncTracer, ...]] = ContextVar("FUNC_STACK", default=())
 
 
 def current_func() -> FuncTracer:
     """
     Get the current function tracer
     """
-    assert is_jit(), "Not in JIT context"
-    return FUNC_STACK[-1]
+    stack = FUNC_STACK.get()
+    assert stack, "Not in JIT context"
+    return stack[-1]
 
 
 def push_to_current_bb[T: hir.Node](node: T) -> T:
@@ -231,7 +257,7 @@ class FlattenedTree:
             assert len(self.children) == 0
             node = self.metadata[2]
             assert isinstance(node, JitVar)
-            return hir.PyTreeStructure((typ, self.metadata[1], node._symbolic_type()))
+            return _leaf_structure(node)
         else:
             children = [c.structure() for c in self.children]
             return hir.PyTreeStructure(
@@ -251,23 +277,6 @@ class FlattenedTree:
                 jit_vars.extend(child.collect_jitvars())
         return jit_vars
 
-    @staticmethod
-    def unstructure(
-        s: PyTreeStructure, mapping: IdentityDict[hir.PyTreeStructure, "JitVar"]
-    ) -> "FlattenedTree":
-        assert s.metadata is not None
-        if s in mapping:
-            v = mapping[s]
-
-            typ, type_args, _ = s.metadata
-            return FlattenedTree((typ, type_args, v), [])
-        else:
-            typ, type_args, other = s.metadata
-            assert not issubclass(typ, JitVar)
-            children = [FlattenedTree.unstructure(
-                c, mapping) for c in s.children]
-            return FlattenedTree((typ, type_args, other), children)
-
 
 class PyTree:
     """
@@ -330,7 +339,9 @@ class JitVar:
         #     hir.VarValue(current_func().create_var(
         #         "", dsl_type.default(), False))
         # )
-        self.__symbolic__ = Symbolic(hir.Alloca(dsl_type.default(), span=None))
+        self.__symbolic__ = Symbolic(
+            push_to_current_bb(hir.Alloca(hir.RefType(dsl_type.default()), span=None))
+        )
 
     def _destroy_symbolic(self):
         self.__symbolic__ = None
@@ -375,6 +386,7 @@ class JitVar:
 
 type PyTreeFlattenFunc = Callable[[Any], FlattenedTree]
 type PyTreeUnflattenFunc = Callable[[FlattenedTree], Any]
+type PyTreeStructureFunc = Callable[[Any, List["JitVar"]], hir.PyTreeStructure]
 
 
 def tree_flatten(obj: Any, allow_non_pytree_objects: bool) -> FlattenedTree:
@@ -382,10 +394,77 @@ def tree_flatten(obj: Any, allow_non_pytree_objects: bool) -> FlattenedTree:
         return FlattenedTree((type(obj), obj._type_args(), obj), [])
     if isinstance(obj, PyTree):
         return obj._flatten()
-    if allow_non_pytree_objects and not PyTreeRegistry.is_registered(type(obj)):
-        return FlattenedTree((type(obj), cast(Tuple[Any, ...], tuple()), obj), [])
-    flatten_func, _ = PyTreeRegistry.get(type(obj))
-    return flatten_func(obj)
+    funcs = PyTreeRegistry.lookup(type(obj))
+    if funcs is None:
+        if allow_non_pytree_objects:
+            return FlattenedTree((type(obj), cast(Tuple[Any, ...], tuple()), obj), [])
+        raise ValueError(
+            f"No flatten/unflatten functions registered for {type(obj)}")
+    return funcs[0](obj)
+
+
+# structures of DSL leaves, keyed by (type(var), var.dtype, type args)
+_leaf_structures: Dict[Tuple[type, type, Tuple[Any, ...]], hir.PyTreeStructure] = {}
+
+# python values that are stored verbatim in the structure
+_PRIMITIVE_TYPES = frozenset([int, float, str, bool, type(None)])
+_NO_TYPE_ARGS = cast(Tuple[Any, ...], tuple())
+
+
+def _leaf_structure(var: "JitVar") -> hir.PyTreeStructure:
+    typ = type(var)
+    type_args = var._type_args()
+    key = (typ, var.__dtype__, type_args)
+    structure = _leaf_structures.get(key)
+    if structure is None:
+        structure = hir.PyTreeStructure((typ, type_args, var._symbolic_type()))
+        _leaf_structures[key] = structure
+    return structure
+
+
+def _structure_of_flattened(
+    tree: FlattenedTree, leaves: List["JitVar"]
+) -> hir.PyTreeStructure:
+    typ = tree.metadata[0]
+    if issubclass(typ, JitVar):
+        assert len(tree.children) == 0
+        node = tree.metadata[2]
+        assert isinstance(node, JitVar)
+        leaves.append(node)
+        return _leaf_structure(node)
+    return hir.PyTreeStructure(
+        tree.metadata, [_structure_of_flattened(
+            c, leaves) for c in tree.children]
+    )
+
+
+def tree_structure(
+    obj: Any, leaves: List["JitVar"], allow_non_pytree_objects: bool
+) -> hir.PyTreeStructure:
+    """
+    Compute the (interned) structure of `obj` in a single traversal, appending its DSL variables to `leaves`.
+    Equivalent to `tree_flatten(obj, ...).structure()` followed by `collect_jitvars()`.
+    """
+    if isinstance(obj, JitVar):
+        leaves.append(obj)
+        return _leaf_structure(obj)
+    typ = type(obj)
+    if typ is tuple or typ is list:
+        return hir.PyTreeStructure(
+            (typ, _NO_TYPE_ARGS, None), [tree_structure(o, leaves, True) for o in obj]
+        )
+    if typ in _PRIMITIVE_TYPES:
+        return hir.PyTreeStructure((typ, _NO_TYPE_ARGS, obj))
+    if typ is dict:
+        children = [tree_structure(k, leaves, True) for k in obj.keys()]
+        children.extend(tree_structure(v, leaves, True) for v in obj.values())
+        return hir.PyTreeStructure((dict, _NO_TYPE_ARGS, len(obj)), children)
+    if not isinstance(obj, PyTree):
+        structure_func = PyTreeRegistry.lookup_structure(typ)
+        if structure_func is not None:
+            return structure_func(obj, leaves)
+    # user defined pytrees
+    return _structure_of_flattened(tree_flatten(obj, allow_non_pytree_objects), leaves)
 
 
 def tree_unflatten(obj: FlattenedTree, allow_non_pytree_objects: bool) -> Any:
@@ -396,10 +475,74 @@ def tree_unflatten(obj: FlattenedTree, allow_non_pytree_objects: bool) -> Any:
         return v
     if issubclass(typ, PyTree):
         return typ._unflatten(obj)
-    if allow_non_pytree_objects and not PyTreeRegistry.is_registered(typ):
-        return typ(obj.metadata[1])
-    _, unflatten_func = PyTreeRegistry.get(typ)
-    return unflatten_func(obj)
+    funcs = PyTreeRegistry.lookup(typ)
+    if funcs is None:
+        if allow_non_pytree_objects:
+            return obj.metadata[2]
+        raise ValueError(
+            f"No flatten/unflatten functions registered for {typ}")
+    return funcs[1](obj)
+
+
+def _is_namedtuple(typ: type) -> bool:
+    return issubclass(typ, tuple) and hasattr(typ, "_fields")
+
+
+def pytree_fields(typ: type) -> List[str]:
+    """
+    Get the names of the fields of a dataclass or a NamedTuple, in declaration order.
+    """
+    if _is_namedtuple(typ):
+        return list(getattr(typ, "_fields"))
+    if dataclasses.is_dataclass(typ):
+        return [f.name for f in dataclasses.fields(typ)]
+    raise TypeError(f"{typ} is neither a dataclass nor a NamedTuple")
+
+
+def _generate_pytree_funcs(
+    cls: type, fields: Sequence[str]
+) -> Tuple[PyTreeFlattenFunc, PyTreeUnflattenFunc, PyTreeStructureFunc]:
+    """
+    Generate flatten/unflatten/structure functions for `cls` with straight-line accesses to `fields`.
+    Instances are rebuilt without calling `__init__`, as a NamedTuple if `cls` is one.
+    """
+    for name in fields:
+        if not name.isidentifier():
+            raise ValueError(f"invalid pytree field name {name!r} in {cls}")
+    getters = [f"obj.{name}" for name in fields]
+    values = [f"tree_unflatten(c[{i}], True)" for i in range(len(fields))]
+    lines = [
+        "def flatten(obj):",
+        f"    return FlattenedTree(metadata, [{', '.join(f'tree_flatten({g}, True)' for g in getters)}])",
+        "def structure(obj, leaves):",
+        f"    return PyTreeStructure(metadata, [{', '.join(f'tree_structure({g}, leaves, True)' for g in getters)}])",
+        "def unflatten(tree):",
+        "    c = tree.children",
+        f"    assert tree.metadata[0] is cls and len(c) == {len(fields)}",
+    ]
+    if _is_namedtuple(cls):
+        lines.append(f"    return tuple_new(cls, [{', '.join(values)}])")
+    else:
+        lines.append("    obj = object_new(cls)")
+        lines += [
+            f"    object_setattr(obj, {name!r}, {v})" for name, v in zip(fields, values)
+        ]
+        lines.append("    return obj")
+    namespace: Dict[str, Any] = {
+        "cls": cls,
+        "metadata": (cls, cast(Tuple[Any, ...], tuple()), None),
+        "FlattenedTree": FlattenedTree,
+        "PyTreeStructure": hir.PyTreeStructure,
+        "tree_flatten": tree_flatten,
+        "tree_unflatten": tree_unflatten,
+        "tree_structure": tree_structure,
+        "tuple_new": tuple.__new__,
+        "object_new": object.__new__,
+        "object_setattr": object.__setattr__,
+    }
+    code = compile("\n".join(lines) + "\n", f"<pytree {cls.__qualname__}>", "exec")
+    exec(code, namespace)
+    return namespace["flatten"], namespace["unflatten"], namespace["structure"]
 
 
 class PyTreeRegistry:
@@ -408,6 +551,12 @@ class PyTreeRegistry:
     """
 
     funcs: Dict[type, Tuple[PyTreeFlattenFunc, PyTreeUnflattenFunc]]
+    # single pass flatten functions, see `tree_structure`. Not inherited by subclasses.
+    structure_funcs: Dict[type, PyTreeStructureFunc]
+    # the classes registered with `register_fields`, whose subclasses inherit the fields
+    fields: Dict[type, Tuple[str, ...]]
+    # `funcs` resolved for each type seen so far
+    resolved: Dict[type, Optional[Tuple[PyTreeFlattenFunc, PyTreeUnflattenFunc]]]
 
     _instance: Optional["PyTreeRegistry"] = None
 
@@ -420,22 +569,88 @@ class PyTreeRegistry:
 
     def __init__(self):
         self.funcs = {}
+        self.structure_funcs = {}
+        self.fields = {}
+        self.resolved = {}
 
     @staticmethod
     def register(
-        typ: type, flatten_func: PyTreeFlattenFunc, unflatten_func: PyTreeUnflattenFunc
+        typ: type,
+        flatten_func: PyTreeFlattenFunc,
+        unflatten_func: PyTreeUnflattenFunc,
+        structure_func: Optional[PyTreeStructureFunc] = None,
     ) -> None:
         """
         Register a PyTree type with its flatten and unflatten functions.
+        `structure_func(obj, leaves)` optionally computes the structure of `obj` in a single pass.
         """
-        PyTreeRegistry.instance().funcs[typ] = (flatten_func, unflatten_func)
+        registry = PyTreeRegistry.instance()
+        registry.funcs[typ] = (flatten_func, unflatten_func)
+        if structure_func is not None:
+            registry.structure_funcs[typ] = structure_func
+        else:
+            registry.structure_funcs.pop(typ, None)
+        registry.fields.pop(typ, None)
+        # subclasses of `typ` may resolve differently now
+        registry.resolved.clear()
+
+    @staticmethod
+    def register_fields(typ: type, fields: Sequence[str]) -> None:
+        """
+        Register a class whose instances are flattened into the given fields, using generated functions.
+        Its subclasses are flattened into the same fields, as instances of the subclass.
+        """
+        flatten_func, unflatten_func, structure_func = _generate_pytree_funcs(
+            typ, fields)
+        PyTreeRegistry.register(
+            typ, flatten_func, unflatten_func, structure_func)
+        PyTreeRegistry.instance().fields[typ] = tuple(fields)
+
+    @staticmethod
+    def lookup(
+        typ: type,
+    ) -> Optional[Tuple[PyTreeFlattenFunc, PyTreeUnflattenFunc]]:
+        """
+        Find the flatten and unflatten functions registered for `typ`. Subclasses of a class
+        registered with `register_fields` get functions of their own, the subclasses of other
+        registered types (e.g. of `list` or `int`) are not pytrees unless registered themselves.
+        The result is cached per type.
+        """
+        registry = PyTreeRegistry.instance()
+        try:
+            return registry.resolved[typ]
+        except KeyError:
+            pass
+        funcs = registry.funcs.get(typ)
+        if funcs is None and (dataclasses.is_dataclass(typ) or _is_namedtuple(typ)):
+            # registered on first use, before a NamedTuple could resolve to `tuple`
+            PyTreeRegistry.register_fields(typ, pytree_fields(typ))
+            funcs = registry.funcs[typ]
+        if funcs is None:
+            for base in typ.__mro__[1:]:
+                fields = registry.fields.get(base)
+                if fields is not None:
+                    # the structure keeps the type of the subclass, which unflattens into it
+                    PyTreeRegistry.register_fields(typ, fields)
+                    funcs = registry.funcs[typ]
+                    break
+        registry.resolved[typ] = funcs
+        return funcs
+
+    @staticmethod
+    def lookup_structure(typ: type) -> Optional[PyTreeStructureFunc]:
+        """
+        Find the single pass flatten function registered for exactly `typ`.
+        """
+        PyTreeRegistry.lookup(typ)
+        return PyTreeRegistry.instance().structure_funcs.get(typ)
 
     @staticmethod
     def get(typ: type) -> Tuple[PyTreeFlattenFunc, PyTreeUnflattenFunc]:
         """
         Get the flatten and unflatten functions for a PyTree type.
         """
-        funcs = PyTreeRegistry.instance().funcs.get(typ)
+        funcs = PyTreeRegistry.lookup(typ)
         if funcs is None:
             raise ValueError(
                 f"No flatten/unflatten functions registered for {typ}")
@@ -444,9 +659,9 @@ class PyTreeRegistry:
     @staticmethod
     def is_registered(typ: type) -> bool:
         """
-        Check if a PyTree type is registered.
+        Check if a PyTree type is registered (see `lookup`).
         """
-        return typ in PyTreeRegistry.instance().funcs
+        return PyTreeRegistry.lookup(typ) is not None
 
     @staticmethod
     def __register_default_types() -> None:
@@ -455,7 +670,7 @@ class PyTreeRegistry:
 
         def unflatten_primitive(tree: FlattenedTree) -> Any:
             assert len(tree.children) == 0
-            return tree.metadata[1]
+            return tree.metadata[2]
 
         PyTreeRegistry.register(int, flatten_primitive, unflatten_primitive)
         PyTreeRegistry.register(float, flatten_primitive, unflatten_primitive)
@@ -472,7 +687,6 @@ class PyTreeRegistry:
 
         def unflatten_list(tree: FlattenedTree) -> List[Any]:
             assert tree.metadata[0] is list
-            assert len(tree.children) == tree.metadata[1]
             return [tree_unflatten(c, True) for c in tree.children]
 
         PyTreeRegistry.register(list, flatten_list, unflatten_list)
@@ -485,7 +699,6 @@ class PyTreeRegistry:
 
         def unflatten_tuple(tree: FlattenedTree) -> Tuple[Any, ...]:
             assert tree.metadata[0] is tuple
-            assert len(tree.children) == tree.metadata[1]
             return tuple(tree_unflatten(c, True) for c in tree.children)
 
         PyTreeRegistry.register(tuple, flatten_tuple, unflatten_tuple)
@@ -499,7 +712,7 @@ class PyTreeRegistry:
 
         def unflatten_dict(tree: FlattenedTree) -> Dict[Any, Any]:
             assert tree.metadata[0] is dict
-            length = tree.metadata[2][0]
+            length = tree.metadata[2]
             assert isinstance(
                 length, int), "Invalid length for dict unflattening"
             assert len(tree.children) == length * 2
@@ -524,29 +737,63 @@ def type_of(value: type) -> hir.Type:
     return hir.get_dsl_type(value).default()
 
 
+_LITERAL_TYPES = (bool, int, float)
+
+
 def create_intrinsic_node[T: JitVar](
     name: str, ret_type: type[T] | None, *args
 ) -> hir.Value:
     """
     Call an intrinsic function
     """
-    nodes: List[hir.Value] = []
+    nodes: List[hir.Value | None] = []
+    operand_type: hir.Type | None = None
     for i, a in enumerate(args):
+        node: hir.Value
         if isinstance(a, JitVar):
-            nodes.append(a.symbolic().node)
+            node = a.symbolic().node
         elif isinstance(a, hir.Value):
-            nodes.append(a)
+            node = a
+        elif type(a) in _LITERAL_TYPES:
+            # typed after the other operands, e.g. `x * 2.0`
+            nodes.append(None)
+            continue
         else:
             raise ValueError(
                 f"Argument [{i}] `{a}` of type {type(a)} is not a valid DSL variable or HIR node"
             )
+        nodes.append(node)
+        if operand_type is None and node.type is not None:
+            operand_type = node.type.remove_ref()
+            if isinstance(operand_type, hir.VectorType):
+                # `v * 0.5` scales each component
+                operand_type = operand_type.element
+    for i, a in enumerate(args):
+        if nodes[i] is None:
+            value = None
+            if operand_type is not None and (
+                type(a) is not float or isinstance(operand_type, hir.FloatType)
+            ):
+                value = round_to_type(a, operand_type)
+            if value is None:
+                raise ValueError(
+                    f"Argument [{i}] `{a}` of type {type(a)} is not a valid DSL variable or HIR node"
+                )
+            if type(a) is int and isinstance(operand_type, hir.IntType) and value != a:
+                # rather than wrapping it around, e.g. `x_u8 + 300` into `x_u8 + 44`
+                raise ValueError(f"Argument [{i}] `{a}` is out of the range of {operand_type}")
+            nodes[i] = hir.Constant(value, operand_type)
     if ret_type is not None:
         ret_dsl_type = hir.get_dsl_type(ret_type).default()
         if ret_dsl_type is None:
             raise ValueError(f"{ret_type} is not a valid DSL type")
     else:
         ret_dsl_type = hir.UnitType()
-    return push_to_current_bb(hir.Intrinsic(name, nodes, ret_dsl_type))
+    operands = cast(List[hir.Value], nodes)
+    folded = fold_intrinsic(name, operands, ret_dsl_type)
+    if folded is not None:
+        return folded
+    return push_to_current_bb(hir.Intrinsic(name, operands, ret_dsl_type))
 
 
 def __escape__(x: Any) -> Any:
@@ -561,12 +808,14 @@ def __intrinsic_checked__[T](
 ) -> T:
     """
     Call an intrinsic function with type checking.
+    `arg_types` may contain patterns precompiled with `compile_type_pattern`.
     """
     assert len(args) == len(
         arg_types
     ), f"Intrinsic {name} expects {len(arg_types)} arguments, got {len(args)}"
     for i, (arg, arg_type) in enumerate(zip(args, arg_types)):
-        if not check_type(arg_type, arg):
+        pattern = arg_type if type(arg_type) is TypePattern else compile_type_pattern(arg_type)
+        if not pattern(arg):
             raise ValueError(
                 f"Argument {i} of intrinsic {name} is not of type {arg_type}, got {type(arg)}"
             )
@@ -591,14 +840,17 @@ def assign(dst: Any, src: Any) -> None:
     assert isinstance(
         src, JitVar
     ), "Attempting to assign normal python value to DSL variable"
-    push_to_current_bb(hir.Assign(dst.symbolic().node, src.symbolic().node))
+    value = src.symbolic().node
+    if value.is_ref():
+        value = push_to_current_bb(hir.Load(value))
+    push_to_current_bb(hir.Assign(dst.symbolic().node, value))
 
 
 def is_jit() -> bool:
     """
     Check if current context is during DSL JIT compilation
     """
-    return FUNC_STACK != []
+    return FUNC_STACK.get() != ()
 
 def is_dsl_func(obj: Any) -> bool:
     return hasattr(obj, '__luisa_original_func__')
@@ -630,11 +882,16 @@ class ControlFlowFrame:
 
 
 class ScopeGuard:
+    inline: bool
+
+    def __init__(self, inline: bool = False) -> None:
+        self.inline = inline
+
     def __enter__(self) -> Scope:
         """
         Enter a new scope
         """
-        return current_func().push_scope()
+        return current_func().push_scope(self.inline)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
@@ -770,6 +1027,81 @@ CMP_OP_TO_METHOD_NAMES: Dict[str, List[str]] = {
     "GtE": ["__ge__", "__le__"],
 }
 
+PY_BINOPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "Add": operator.add,
+    "Sub": operator.sub,
+    "Mult": operator.mul,
+    "Div": operator.truediv,
+    "FloorDiv": operator.floordiv,
+    "Mod": operator.mod,
+    "Eq": operator.eq,
+    "NotEq": operator.ne,
+    "Lt": operator.lt,
+    "LtE": operator.le,
+    "Gt": operator.gt,
+    "GtE": operator.ge,
+    "BitAnd": operator.and_,
+    "BitOr": operator.or_,
+    "BitXor": operator.xor,
+    "LShift": operator.lshift,
+    "RShift": operator.rshift,
+    "Pow": operator.pow,
+}
+
+# how a resolved binary operation is invoked
+_DISPATCH_DSL = 0
+_DISPATCH_DSL_REFLECTED = 1
+_DISPATCH_PYTHON = 2
+
+type BinaryDispatch = Tuple[Callable[..., Any], int]
+
+# (op, type(x), type(y)) -> resolved implementation, see `_resolve_binary`
+_BINARY_DISPATCH_CACHE: Dict[Tuple[str, type, type], BinaryDispatch] = {}
+
+
+def _resolve_binary(
+    method_names: Dict[str, List[str]], op: str, tx: type, ty: type
+) -> BinaryDispatch:
+    """
+    Find the implementation of `x op y` for operands of type `tx` and `ty`.
+    DSL methods take precedence, operations on plain Python values are evaluated by Python.
+    """
+    name, rname = method_names[op]
+    method = getattr(tx, name, None)
+    if method is not None and is_dsl_func(method):
+        return method, _DISPATCH_DSL
+    rmethod = getattr(ty, rname, None)
+    if rmethod is not None and is_dsl_func(rmethod):
+        return rmethod, _DISPATCH_DSL_REFLECTED
+    if not issubclass(tx, JitVar) and not issubclass(ty, JitVar):
+        return PY_BINOPS[op], _DISPATCH_PYTHON
+    raise ValueError(
+        f"Binary operation {name} not supported for {tx} and {ty}"
+    )
+
+
+def _dispatch_binary(
+    ctx: "TraceContext", method_names: Dict[str, List[str]], op: str, x: Any, y: Any
+) -> Any:
+    key = (op, type(x), type(y))
+    entry = _BINARY_DISPATCH_CACHE.get(key)
+    if entry is None:
+        entry = _resolve_binary(method_names, *key)
+        _BINARY_DISPATCH_CACHE[key] = entry
+    f, kind = entry
+    if kind == _DISPATCH_DSL:
+        return f(x, y, __lc_ctx__=ctx)
+    if kind == _DISPATCH_DSL_REFLECTED:
+        return f(y, x, __lc_ctx__=ctx)
+    return f(x, y)
+
+
+def clear_dispatch_cache() -> None:
+    """
+    Forget resolved operator implementations, needed only if DSL classes are patched after use.
+    """
+    _BINARY_DISPATCH_CACHE.clear()
+
 
 class LineTable:
     span_of_line: Dict[int, hir.Span]
@@ -808,7 +1140,8 @@ class TraceContext:
         return ControlFrameGuard(self, IfFrame, cond)
 
     def scope(self) -> ScopeGuard:
-        return ScopeGuard()
+        # the branches of a static control flow frame are not emitted as separate blocks
+        return ScopeGuard(self.cf_frame.is_static)
 
     def return_(self, expr: JitVar) -> None:
         """
@@ -821,29 +1154,25 @@ class TraceContext:
 
     def redirect_binary(self, op, x, y):
         # print(op, x, y)
-        op, rop = BINOP_TO_METHOD_NAMES[op]
-        if hasattr(x, op):
-            return getattr(x, op)(y, __lc_ctx__=self)
-        elif hasattr(y, rop):
-            return getattr(y, rop)(x, __lc_ctx__=self)
-        else:
-            raise ValueError(
-                f"Binary operation {op} not supported for {type(x)} and {type(y)}"
-            )
+        # this is the hottest path while tracing, so `_dispatch_binary` is inlined here
+        key = (op, type(x), type(y))
+        entry = _BINARY_DISPATCH_CACHE.get(key)
+        if entry is None:
+            entry = _resolve_binary(BINOP_TO_METHOD_NAMES, *key)
+            _BINARY_DISPATCH_CACHE[key] = entry
+        f, kind = entry
+        if kind == _DISPATCH_DSL:
+            return f(x, y, __lc_ctx__=self)
+        if kind == _DISPATCH_DSL_REFLECTED:
+            return f(y, x, __lc_ctx__=self)
+        return f(x, y)
 
     def redirect_attr(self, obj: Any) -> Any:
         return obj
 
     def redirect_cmp(self, op, x, y):
-        op, rop = CMP_OP_TO_METHOD_NAMES[op]
-        if hasattr(x, op):
-            return getattr(x, op)(y, __lc_ctx__=self)
-        elif hasattr(y, rop):
-            return getattr(y, rop)(x, __lc_ctx__=self)
-        else:
-            raise ValueError(
-                f"Comparison operation {op} not supported for {type(x)} and {type(y)}"
-            )
+        # comparisons share the entries of `redirect_binary` as both tables agree on them
+        return _dispatch_binary(self, CMP_OP_TO_METHOD_NAMES, op, x, y)
 
     def redirect_call(self, f, *args, **kwargs):
         if isinstance(f, type):
@@ -890,42 +1219,335 @@ class TraceContext:
         return current_func().get_var(key)
 
 
+_trace_memoization_enabled: ContextVar[bool] = ContextVar("_trace_memoization_enabled", default=True)
+
+
+@contextmanager
+def trace_memoization(enabled: bool) -> Iterator[None]:
+    """
+    Enable or disable replaying memoized `@trace(memoize=True)` calls within the `with` block.
+    Disable it when the traced Python code has comptime side effects that must happen on every call.
+    """
+    token = _trace_memoization_enabled.set(enabled)
+    try:
+        yield
+    finally:
+        _trace_memoization_enabled.reset(token)
+
+
+class _NotMemoizable(Exception):
+    pass
+
+
+_MEMO_PRIMITIVES = (int, float, bool, str, type(None))
+
+
+def _memo_key_of(obj: Any, leaves: List[hir.Value]) -> Any:
+    """
+    The part of a memoization key describing `obj`. Symbolic nodes are collected into `leaves`.
+    """
+    if isinstance(obj, JitVar):
+        if not obj.is_symbolic() or obj._type_args():
+            raise _NotMemoizable()
+        node = obj.symbolic().node
+        leaves.append(node)
+        return (type(obj), node.type)
+    if type(obj) in _MEMO_PRIMITIVES:
+        return (type(obj), obj)
+    if type(obj) is tuple or type(obj) is list:
+        return (type(obj), tuple(_memo_key_of(x, leaves) for x in obj))
+    raise _NotMemoizable()
+
+
+# the position of a node in the HIR, not copied by `_clone_node`
+_LINK_FIELDS = ("block", "_index", "_uses")
+
+# marks slots that were never assigned
+_UNSET: Any = object()
+
+
+def _clone_node[T: hir.Node](node: T, fields: List[str], mapping: Dict[int, hir.Node]) -> T:
+    """
+    Copy `node` detached from any basic block, with the operands in `fields` replaced according to
+    `mapping` (keyed by `id`).
+    """
+    cloned = object.__new__(type(node))
+    for name in hir.slots_of(type(node)):
+        if name in _LINK_FIELDS:
+            continue
+        v = getattr(node, name, _UNSET)
+        if v is _UNSET:
+            continue
+        setattr(cloned, name, v)
+    cloned.block = None
+    cloned._index = -1
+    if isinstance(cloned, hir.TypedNode):
+        cloned._uses = None
+    for name in fields:
+        v = getattr(cloned, name)
+        if isinstance(v, list):
+            setattr(cloned, name, [_map_operand(x, mapping) for x in v])
+        else:
+            setattr(cloned, name, _map_operand(v, mapping))
+    return cloned
+
+
+def _map_operand(v: Any, mapping: Dict[int, hir.Node]) -> Any:
+    """
+    Operands outside basic blocks (constants, variable references...) are copied along. The other
+    operands and the variables not in `mapping` are external state, which cannot be memoized.
+    """
+    if not isinstance(v, hir.Node):
+        return v
+    mapped = mapping.get(id(v))
+    if mapped is not None:
+        return mapped
+    if v.block is None and not isinstance(v, hir.Var):
+        c = _clone_node(v, list(v.operand_fields), mapping)
+        mapping[id(v)] = c
+        return c
+    raise _NotMemoizable()
+
+
+class _RecordedTrace:
+    """
+    The HIR subgraph produced by one trace of a `@trace` function, detached from the function
+    it was recorded in. `params` are placeholders for the symbolic nodes of the arguments and
+    `vars` for the variables the body created. `bindings` are the names the body bound in the
+    namespace of the caller, which `@trace` functions share.
+    """
+    params: List[hir.Value]
+    vars: List[hir.Var]
+    nodes: List[Tuple[hir.Node, List[str]]]
+    bindings: Dict[str, Any]
+    ret: Any
+
+    def __init__(
+        self,
+        params: List[hir.Value],
+        vars: List[hir.Var],
+        nodes: List[Tuple[hir.Node, List[str]]],
+        bindings: Dict[str, Any],
+        ret: Any,
+    ) -> None:
+        self.params = params
+        self.vars = vars
+        self.nodes = nodes
+        self.bindings = bindings
+        self.ret = ret
+
+    @staticmethod
+    def record(
+        leaves: List[hir.Value],
+        created: List[hir.Var],
+        nodes: List[hir.Node],
+        bindings: Dict[str, Any],
+        ret: Any,
+    ) -> "_RecordedTrace":
+        mapping: Dict[int, hir.Node] = {}
+        params: List[hir.Value] = []
+        for leaf in leaves:
+            # aliased arguments share a placeholder, the aliasing is part of the key
+            if id(leaf) not in mapping:
+                mapping[id(leaf)] = hir.Value(leaf.type)
+            params.append(cast(hir.Value, mapping[id(leaf)]))
+        vars: List[hir.Var] = []
+        for var in created:
+            placeholder = hir.Var(var.name, var.type, None, var.semantic)
+            mapping[id(var)] = placeholder
+            vars.append(placeholder)
+        recorded: List[Tuple[hir.Node, List[str]]] = []
+        for node in nodes:
+            if isinstance(node, hir.Terminator):
+                raise _NotMemoizable()
+            fields = list(node.operand_fields)
+            cloned = _clone_node(node, fields, mapping)
+            mapping[id(node)] = cloned
+            recorded.append((cloned, fields))
+        return _RecordedTrace(
+            params,
+            vars,
+            recorded,
+            {name: _RecordedTrace._map_ret(v, mapping) for name, v in bindings.items()},
+            _RecordedTrace._map_ret(ret, mapping),
+        )
+
+    @staticmethod
+    def _map_ret(ret: Any, mapping: Dict[int, hir.Node]) -> Any:
+        if isinstance(ret, JitVar):
+            if not ret.is_symbolic() or ret._type_args():
+                raise _NotMemoizable()
+            return type(ret).from_hir_node(_map_operand(ret.symbolic().node, mapping))
+        if type(ret) in _MEMO_PRIMITIVES:
+            return ret
+        if type(ret) is tuple or type(ret) is list:
+            return type(ret)(_RecordedTrace._map_ret(x, mapping) for x in ret)
+        raise _NotMemoizable()
+
+    def _resolve_vars(self, func: "FuncTracer") -> Optional[List[Optional[hir.Var]]]:
+        """
+        The variables of the caller the recorded ones are bound to by name, None for those to
+        create. Returns None if tracing the body would not bind its names to variables of the
+        recorded types.
+        """
+        resolved: List[Optional[hir.Var]] = []
+        for var in self.vars:
+            if var.name not in func.py_locals:
+                if var.name in func.func_globals or func.scopes[-1].is_local_ref_defined(var.name):
+                    return None
+                resolved.append(None)
+                continue
+            bound = func.py_locals[var.name]
+            if not isinstance(bound, JitVar) or not bound.is_symbolic():
+                return None
+            node = bound.symbolic().node
+            if not isinstance(node, hir.VarRef) or node.var.type != var.type:
+                return None
+            resolved.append(node.var)
+        return resolved
+
+    def replay(self, leaves: List[hir.Value]) -> Any:
+        """
+        Splice fresh copies of the recorded nodes into the current basic block. Returns
+        `_NOT_REPLAYED` if the names the body binds do not refer to compatible variables.
+        """
+        func = current_func()
+        resolved = self._resolve_vars(func)
+        if resolved is None:
+            return _NOT_REPLAYED
+        mapping: Dict[int, hir.Node] = {}
+        for param, leaf in zip(self.params, leaves):
+            mapping[id(param)] = leaf
+        for placeholder, var in zip(self.vars, resolved):
+            if var is None:
+                var = func.create_var(placeholder.name, unwrap(placeholder.type), False)
+            mapping[id(placeholder)] = var
+        bb = func.cur_bb()
+        for node, fields in self.nodes:
+            cloned = _clone_node(node, fields, mapping)
+            mapping[id(node)] = cloned
+            bb.append(cloned)
+        for name, v in self.bindings.items():
+            func.py_locals[name] = _RecordedTrace._map_ret(v, mapping)
+        return _RecordedTrace._map_ret(self.ret, mapping)
+
+
+# returned by `_RecordedTrace.replay` when the call has to be traced
+_NOT_REPLAYED: Any = object()
+
+
+class TraceMemo:
+    """
+    Memoized traces of a `@trace(memoize=True)` function, keyed by the structure of its arguments.
+    The first call for a key runs the Python body and records the nodes it appends to the current
+    basic block, the variables it creates and the names it binds; later calls replay them without
+    running Python. A recording is rejected, and the key always traced, if the body changes control
+    flow or uses values other than its arguments, its own variables and constants.
+    Calls may be traced from several threads at once.
+    """
+    entries: Dict[Any, Optional[_RecordedTrace]]
+    hits: int
+    misses: int
+    rejected: int
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries = {}
+
+    def call(self, invoke: Callable[[], Any], args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+        if not _trace_memoization_enabled.get():
+            return invoke()
+        leaves: List[hir.Value] = []
+        try:
+            args_key = _memo_key_of(args, leaves)
+            kwargs_key = tuple(sorted((k, _memo_key_of(v, leaves)) for k, v in kwargs.items()))
+            first_use: Dict[int, int] = {}
+            aliasing = tuple(first_use.setdefault(id(leaf), i) for i, leaf in enumerate(leaves))
+            key = (args_key, kwargs_key, aliasing)
+            with self._lock:
+                entry = self.entries.get(key, ...)
+        except (_NotMemoizable, TypeError):
+            return invoke()
+        if isinstance(entry, _RecordedTrace):
+            ret = entry.replay(leaves)
+            if ret is not _NOT_REPLAYED:
+                with self._lock:
+                    self.hits += 1
+                return ret
+            return invoke()
+        if entry is None:
+            return invoke()
+
+        func = current_func()
+        bb = func.cur_bb()
+        start = bb.tail
+        num_locals = len(func.locals)
+        num_scopes = len(func.scopes)
+        py_locals = dict(func.py_locals)
+        ret = invoke()
+        recorded: Optional[_RecordedTrace] = None
+        try:
+            if func.cur_bb() is not bb or len(func.scopes) != num_scopes:
+                raise _NotMemoizable()
+            nodes: List[hir.Node] = []
+            node = start.next if start is not None else bb.head
+            while node is not None:
+                nodes.append(node)
+                node = node.next
+            bindings = {
+                name: v for name, v in func.py_locals.items()
+                if py_locals.get(name, _UNSET) is not v
+            }
+            recorded = _RecordedTrace.record(leaves, func.locals[num_locals:], nodes, bindings, ret)
+        except _NotMemoizable:
+            pass
+        with self._lock:
+            # another thread may have recorded the key in the meantime
+            if key not in self.entries:
+                self.entries[key] = recorded
+            if recorded is not None:
+                self.misses += 1
+            else:
+                self.rejected += 1
+        return ret
+
+
 def _encode_func_args(
     args: hir.FunctionTemplateArgs,
 ) -> Tuple[List[Any], Dict[str, Any], List[JitVar]]:
     jit_vars: List[JitVar] = []
     args_list: List[Any] = []
     kwargs_dict: Dict[str, Any] = {}
-    mapping: IdentityDict[hir.PyTreeStructure, JitVar] = IdentityDict()
 
-    def create_var(name: str, v: hir.PyTreeStructure):
+    # structures are hash-consed, so equal leaves are the same object and a parameter
+    # has to be created for each occurrence of a leaf, not for each distinct leaf
+    def create_var(name: str, v: hir.PyTreeStructure) -> FlattenedTree:
         assert v.metadata
-        typ = v.metadata[0]
+        typ, type_args, other = v.metadata
         if issubclass(typ, JitVar):
             assert len(v.children) == 0
-            ir_type = v.metadata[2]
+            ir_type = other
             assert isinstance(ir_type, hir.Type)
             ir_var = current_func().create_var(name, ir_type, True)
             jit_v = typ.from_hir_node(hir.VarRef(ir_var))
             jit_vars.append(jit_v)
-            mapping[v] = jit_v
-        else:
-            for i, c in enumerate(v.children):
-                create_var(f"name_{i}", c)
+            return FlattenedTree((typ, type_args, jit_v), [])
+        children = [create_var(f"{name}_{i}", c) for i, c in enumerate(v.children)]
+        return FlattenedTree((typ, type_args, other), children)
 
     for i, a in enumerate(args.args):
-        create_var(f"__arg_{i}", a)
-
-    for k, v in args.kwargs.items():
-        create_var(k, v)
-
-    for a in args.args:
-        args_list.append(tree_unflatten(
-            FlattenedTree.unstructure(a, mapping), False))
+        args_list.append(tree_unflatten(create_var(f"__arg_{i}", a), False))
 
     for k, v in args.kwargs.items():
-        kwargs_dict[k] = tree_unflatten(
-            FlattenedTree.unstructure(v, mapping), False)
+        kwargs_dict[k] = tree_unflatten(create_var(k, v), False)
 
     return args_list, kwargs_dict, jit_vars
 
@@ -937,29 +1559,34 @@ def _invoke_function_tracer(
 
     # args is Type | object
     func_tracer = FuncTracer(f.__name__.replace(".", "_"), globalns)
-    FUNC_STACK.append(func_tracer)
+    token = FUNC_STACK.set(FUNC_STACK.get() + (func_tracer,))
     try:
         args_vars, kwargs_vars, jit_vars = _encode_func_args(args)
         ret = f(*args_vars, **kwargs_vars, __lc_ctx__=trace_ctx)
         assert ret is None
         return func_tracer.finalize()
     finally:
-        FUNC_STACK.pop()
+        FUNC_STACK.reset(token)
 
 
 class KernelTracer:
     top_level_tracer: FuncTracer
+    _token: Optional[Token[Tuple[FuncTracer, ...]]]
 
     def __init__(self, func_globals: Dict[str, Any]):
         self.top_level_tracer = FuncTracer("__kernel__", func_globals)
+        self._token = None
 
     def __enter__(self) -> FuncTracer:
-        FUNC_STACK.append(self.top_level_tracer)
+        assert FUNC_STACK.get() == (), "kernels cannot be traced within another kernel"
+        self._token = FUNC_STACK.set((self.top_level_tracer,))
         return self.top_level_tracer
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        assert FUNC_STACK.pop() is self.top_level_tracer
-        assert len(FUNC_STACK) == 0
+        assert self._token is not None
+        assert FUNC_STACK.get()[-1] is self.top_level_tracer
+        FUNC_STACK.reset(self._token)
+        self._token = None
 
 
 __all__: List[str] = [
@@ -968,4 +1595,6 @@ __all__: List[str] = [
     "TraceContext",
     "KernelTracer",
     "PyTreeStructure",
+    "TraceMemo",
+    "trace_memoization",
 ]
@@ -0,0 +1,10 @@
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.constant_fold import ConstantFold, fold_intrinsic
+from luisa_lang.passes.dce import DCE
+from luisa_lang.passes.effects import Effect, intrinsic_effect
+from luisa_lang.passes.gvn import GVN
+from luisa_lang.passes.inline import Inliner
+from luisa_lang.passes.licm import LICM
+from luisa_lang.passes.manager import PassManager, PassStats
+from luisa_lang.passes.mem2reg import Mem2Reg
+from luisa_lang.passes.presets import pipeline
@@ -0,0 +1,28 @@
+"""
+The interface implemented by the HIR passes.
+"""
+
+from abc import ABC, abstractmethod
+from typing import ClassVar
+
+from luisa_lang import hir
+
+
+class FunctionPass(ABC):
+    """
+    A transformation of a single `hir.Function`, applied in place.
+    """
+    name: ClassVar[str]
+
+    @abstractmethod
+    def run(self, func: hir.Function) -> bool:
+        """
+        Transform `func`, returning whether anything changed.
+        """
+        pass
+
+    def clear(self) -> None:
+        """
+        Forget the state kept between runs, such as the analyses of callees.
+        """
+        pass
@@ -0,0 +1,208 @@
+"""
+Folding intrinsics whose arguments are all constants.
+
+Results follow the semantics of the target: integers wrap around at the width of their type and
+floats are rounded to the nearest value of their width, which for the basic arithmetic, `sqrt`
+and conversions is exactly the IEEE result. Intrinsics whose result is not exactly defined (e.g.
+`math.sin`), would be undefined at runtime (division by zero, out of range conversions) or is
+not finite are left alone.
+"""
+
+import math
+import operator
+import struct
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.utils import blocks
+
+# integers up to this magnitude convert to a double exactly, so rounding once more is exact
+_MAX_EXACT_INT = 2**53
+
+
+def round_to_type(value: Any, ty: hir.Type) -> Any:
+    """
+    `value` converted to the scalar type `ty`, or None if it is not representable.
+    """
+    match ty:
+        case hir.BoolType():
+            return bool(value)
+        case hir.IntType(bits=bits, signed=signed):
+            i = int(value) & ((1 << bits) - 1)
+            if signed and i >= 1 << (bits - 1):
+                i -= 1 << bits
+            return i
+        case hir.FloatType(bits=bits):
+            x = float(value)
+            try:
+                if bits == 32:
+                    x = struct.unpack("f", struct.pack("f", x))[0]
+                elif bits == 16:
+                    x = struct.unpack("e", struct.pack("e", x))[0]
+                elif bits != 64:
+                    return None
+            except OverflowError:
+                return None
+            return x if math.isfinite(x) else None
+    return None
+
+
+def _convert(value: Any, src: hir.Type, dst: hir.Type) -> Any:
+    if isinstance(dst, hir.IntType) and isinstance(src, hir.FloatType):
+        if not math.isfinite(value):
+            return None
+        v = math.trunc(value)
+        lo, hi = (-(1 << (dst.bits - 1)), 1 << (dst.bits - 1)) if dst.signed else (0, 1 << dst.bits)
+        # out of range conversions are undefined
+        return v if lo <= v < hi else None
+    if isinstance(dst, hir.FloatType) and not isinstance(src, hir.FloatType):
+        if abs(int(value)) > _MAX_EXACT_INT:
+            return None
+    return round_to_type(value, dst)
+
+
+def _c_div(a: Any, b: Any) -> Any:
+    if b == 0:
+        return None
+    if isinstance(a, float):
+        return a / b
+    # only the cases where C and Python agree
+    return a // b if a >= 0 and b > 0 else None
+
+
+def _c_mod(a: Any, b: Any) -> Any:
+    if isinstance(a, float) or b == 0:
+        return None
+    return a % b if a >= 0 and b > 0 else None
+
+
+def _int_only(op: Callable[[Any, Any], Any]) -> Callable[[Any, Any], Any]:
+    def f(a: Any, b: Any) -> Any:
+        return op(a, b) if not isinstance(a, float) else None
+    return f
+
+
+_BINOPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "__add__": operator.add,
+    "__sub__": operator.sub,
+    "__mul__": operator.mul,
+    "__truediv__": _c_div,
+    # lowered to `/` by the code generator for now, so the result depends on the operand types
+    "__floordiv__": lambda a, b: _c_div(a, b) if not isinstance(a, float) else None,
+    "__mod__": _c_mod,
+    "__and__": _int_only(operator.and_),
+    "__or__": _int_only(operator.or_),
+    "__xor__": _int_only(operator.xor),
+    # the shift amount is checked against the width of the type in `fold_intrinsic`
+    "__lshift__": _int_only(operator.lshift),
+    "__rshift__": _int_only(operator.rshift),
+}
+
+_CMPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "__eq__": operator.eq,
+    "__ne__": operator.ne,
+    "__lt__": operator.lt,
+    "__le__": operator.le,
+    "__gt__": operator.gt,
+    "__ge__": operator.ge,
+}
+
+_BINOPS_AND_CMPS = {**_BINOPS, **_CMPS}
+
+_UNARY: Dict[str, Callable[[Any], Any]] = {
+    "__neg__": lambda a: -a if type(a) is not bool else None,
+    "__pos__": lambda a: a if type(a) is not bool else None,
+    # `~` on a bool promotes it to int first
+    "__invert__": lambda a: ~a if type(a) is int else None,
+}
+
+# only the functions that are exactly rounded, the others differ between math libraries
+_MATH: Dict[str, Callable[..., Any]] = {
+    "abs": abs,
+    "ceil": lambda a: float(math.ceil(a)) if isinstance(a, float) else None,
+    "floor": lambda a: float(math.floor(a)) if isinstance(a, float) else None,
+    "trunc": lambda a: float(math.trunc(a)) if isinstance(a, float) else None,
+    "sqrt": lambda a: math.sqrt(a) if isinstance(a, float) and a >= 0.0 else None,
+    "copysign": lambda a, b: math.copysign(a, b) if isinstance(a, float) else None,
+}
+
+
+def fold_intrinsic(name: str, args: Sequence[hir.Value], ret_type: hir.Type) -> Optional[hir.Constant]:
+    """
+    The constant an intrinsic evaluates to, or None if it cannot be folded.
+    """
+    if not isinstance(ret_type, hir.ScalarType) or not args:
+        return None
+    values = []
+    for arg in args:
+        if not isinstance(arg, hir.Constant) or not isinstance(arg.type, hir.ScalarType):
+            return None
+        v = round_to_type(arg.value, arg.type)
+        if v is None:
+            return None
+        values.append(v)
+    comps = name.split(".")
+    kind, op = comps[0], comps[1] if len(comps) > 1 else ""
+    f: Optional[Callable[..., Any]]
+    try:
+        result: Any
+        match kind:
+            case "init" | "cast" if len(values) == 1:
+                assert args[0].type is not None
+                result = _convert(values[0], args[0].type, ret_type)
+            case "binop" | "cmp" if len(values) == 2:
+                if args[0].type != args[1].type:
+                    return None
+                if kind == "binop" and op.startswith("__r") and "__" + op[3:] in _BINOPS:
+                    # reflected operators are called on the right operand
+                    op = "__" + op[3:]
+                    values.reverse()
+                f = (_CMPS if kind == "cmp" else _BINOPS_AND_CMPS).get(op)
+                if f is None:
+                    return None
+                if op in ("__lshift__", "__rshift__"):
+                    ty = args[0].type
+                    if not isinstance(ty, hir.IntType) or not 0 <= values[1] < ty.bits:
+                        return None
+                result = f(values[0], values[1])
+            case "unary" if len(values) == 1:
+                f = _UNARY.get(op)
+                if f is None:
+                    return None
+                result = f(values[0])
+            case "math":
+                f = _MATH.get(op)
+                if f is None or len({arg.type for arg in args}) != 1:
+                    return None
+                result = f(*values)
+            case _:
+                return None
+    except (ArithmeticError, TypeError, ValueError):
+        return None
+    if result is None:
+        return None
+    result = round_to_type(result, ret_type)
+    if result is None:
+        return None
+    return hir.Constant(result, ret_type)
+
+
+class ConstantFold(FunctionPass):
+    """
+    Replaces intrinsics whose arguments are constants with their results.
+    """
+    name = "constant_fold"
+
+    def run(self, func: hir.Function) -> bool:
+        changed = False
+        for bb in blocks(func):
+            for node in bb:
+                if not isinstance(node, hir.Intrinsic) or node.type is None:
+                    continue
+                folded = fold_intrinsic(node.name, node.args, node.type)
+                if folded is not None:
+                    node.replace_all_uses_with(folded)
+                    node.remove()
+                    changed = True
+        return changed
@@ -0,0 +1,203 @@
+"""
+Dead code elimination: unused values, stores that are never read, unreferenced locals and
+unused parameters of called functions.
+"""
+
+import weakref
+from typing import List, Optional, Set, Tuple
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.effects import MEMORY, Effect, intrinsic_effect, ref_root, written_roots
+from luisa_lang.passes.utils import blocks, calls, clone_function
+from luisa_lang.utils import unique_hash
+
+# values that can be dropped when unused, intrinsics and calls are decided by their effects
+_REMOVABLE = (
+    hir.Load,
+    hir.Member,
+    hir.Index,
+    hir.VarValue,
+    hir.VarRef,
+    hir.AggregateInit,
+    hir.Alloca,
+    hir.Constant,
+)
+
+
+class DCE(FunctionPass):
+    """
+    Removes, until nothing changes:
+    - values without uses that have no side effects, including calls to functions that only
+      write their own locals;
+    - assignments to a local variable or temporary that is never read;
+    - locals no node refers to.
+
+    A call whose callee never refers to some of its parameters is redirected to a copy of the
+    callee without them, shared by all calls to the same callee. The function the pass runs on
+    keeps its signature, it may be an entry point.
+    """
+    name = "dce"
+
+    # the pruned copy of each callee (None if it keeps all its parameters) and the kept indices
+    _pruned: weakref.WeakKeyDictionary[hir.Function, Tuple[Optional[hir.Function], List[int]]]
+    _side_effects: weakref.WeakKeyDictionary[hir.Function, bool]
+
+    def __init__(self) -> None:
+        # the callees are not kept alive, so that the template caches can evict them
+        self._pruned = weakref.WeakKeyDictionary()
+        self._side_effects = weakref.WeakKeyDictionary()
+
+    def clear(self) -> None:
+        self._pruned.clear()
+        self._side_effects.clear()
+
+    def run(self, func: hir.Function) -> bool:
+        changed = self._prune_calls(func)
+        while self._sweep(func):
+            changed = True
+        return self._remove_locals(func) or changed
+
+    def _sweep(self, func: hir.Function) -> bool:
+        refs = _References(func)
+        dead: List[hir.Node] = []
+        for bb in blocks(func):
+            for node in bb:
+                if isinstance(node, hir.Assign):
+                    root = ref_root(node.ref)
+                    if isinstance(root, (hir.Var, hir.Alloca)) and id(root) not in refs.read:
+                        dead.append(node)
+                elif (
+                    isinstance(node, hir.TypedNode)
+                    and node.num_uses() == 0
+                    and id(node) not in refs.used
+                    and not self._has_side_effects(node)
+                ):
+                    dead.append(node)
+        for node in dead:
+            node.remove()
+        return len(dead) > 0
+
+    def _has_side_effects(self, node: hir.Node) -> bool:
+        match node:
+            case hir.Intrinsic():
+                return intrinsic_effect(node.name) not in (Effect.PURE, Effect.FRESH)
+            case hir.Call():
+                return self._writes_memory(node.op)
+        return not isinstance(node, _REMOVABLE)
+
+    def _writes_memory(self, func: hir.Function) -> bool:
+        entry = self._side_effects.get(func)
+        if entry is not None:
+            return entry
+        # recursion is assumed to have side effects
+        self._side_effects[func] = True
+        writes = False
+        for bb in blocks(func):
+            for node in bb:
+                if isinstance(node, (hir.Print, hir.Assert)) or MEMORY in written_roots(node):
+                    writes = True
+                elif isinstance(node, hir.Call) and self._writes_memory(node.op):
+                    writes = True
+        self._side_effects[func] = writes
+        return writes
+
+    def _prune_calls(self, func: hir.Function) -> bool:
+        changed = False
+        for node in calls(func):
+            if node.op is func:
+                continue
+            pruned, kept = self._pruned_callee(node.op)
+            if pruned is node.op:
+                continue
+            assert node.type is not None
+            call = hir.Call(pruned, [node.args[i] for i in kept], node.type, node.span)
+            node.prepend(call)
+            node.replace_all_uses_with(call)
+            node.remove()
+            changed = True
+        return changed
+
+    def _pruned_callee(self, callee: hir.Function) -> Tuple[hir.Function, List[int]]:
+        """
+        A copy of `callee` without the parameters it never refers to, and the indices of the
+        parameters it keeps. `callee` itself if it refers to all of them.
+        """
+        entry = self._pruned.get(callee)
+        if entry is not None:
+            return entry[0] or callee, entry[1]
+        referenced = _References(callee).referenced
+        kept = [i for i, p in enumerate(callee.params) if id(p) in referenced]
+        pruned = callee
+        if len(kept) < len(callee.params):
+            pruned = clone_function(callee)
+            dropped = [p for i, p in enumerate(pruned.params) if i not in kept]
+            # the mangled name only covers the kept parameters
+            pruned.name = callee.name + "." + unique_hash(
+                ",".join(f"{i}:{p.type}" for i, p in enumerate(callee.params) if i not in kept)
+            )
+            pruned.params = [pruned.params[i] for i in kept]
+            pruned.locals = [v for v in pruned.locals if all(v is not p for p in dropped)]
+        # the entry must not refer to `callee`, which would keep it alive
+        self._pruned[callee] = (pruned if pruned is not callee else None, kept)
+        return pruned, kept
+
+    def _remove_locals(self, func: hir.Function) -> bool:
+        referenced = _References(func).referenced
+        params = set(id(p) for p in func.params)
+        locals = [v for v in func.locals if id(v) in params or id(v) in referenced]
+        if len(locals) == len(func.locals):
+            return False
+        func.locals = locals
+        return True
+
+
+class _References:
+    """
+    The variables and temporaries the nodes of a function refer to, those they read, and the
+    nodes in blocks that are operands of nodes outside any block, which do not track their uses.
+    """
+    referenced: Set[int]
+    read: Set[int]
+    used: Set[int]
+
+    def __init__(self, func: hir.Function) -> None:
+        self.referenced = set()
+        self.read = set()
+        self.used = set()
+        for bb in blocks(func):
+            for node in bb:
+                if isinstance(node, hir.Assign):
+                    self._target(node.ref, False)
+                    self._operand(node.value, False)
+                else:
+                    for operand in node.operands():
+                        self._operand(operand, False)
+
+    def _operand(self, node: hir.Node, nested: bool) -> None:
+        if isinstance(node, (hir.Var, hir.Alloca)):
+            self.referenced.add(id(node))
+            self.read.add(id(node))
+        if node.block is not None:
+            if nested:
+                self.used.add(id(node))
+            return
+        for operand in node.operands():
+            self._operand(operand, True)
+
+    def _target(self, ref: hir.Node, nested: bool) -> None:
+        # an assignment does not read the variable it stores to, only the indices on the way
+        match ref:
+            case hir.VarRef(var=var) if ref.block is None:
+                self.referenced.add(id(var))
+            case hir.Var() | hir.Alloca():
+                self.referenced.add(id(ref))
+                if nested and ref.block is not None:
+                    self.used.add(id(ref))
+            case hir.Member() if ref.block is None:
+                self._target(ref.base, True)
+            case hir.Index() if ref.block is None:
+                self._operand(ref.index, True)
+                self._target(ref.base, True)
+            case _:
+                self._operand(ref, nested)
@@ -0,0 +1,128 @@
+"""
+What the HIR nodes read and write, for the passes that move or remove them.
+"""
+
+from enum import Enum, auto
+from typing import Iterable, List, Optional, Set
+
+from luisa_lang import hir
+from luisa_lang.passes.utils import blocks_in
+
+
+class Effect(Enum):
+    """
+    The side effects of an intrinsic.
+    """
+    PURE = auto()
+    """The result only depends on the values of the arguments, references are read."""
+    FRESH = auto()
+    """No side effects, but every evaluation produces a distinct object (e.g. `copy`)."""
+    WRITE = auto()
+    """Writes through its first argument, a reference."""
+    UNKNOWN = auto()
+    """May read and write anything its arguments or memory refer to."""
+
+
+_EFFECTS_BY_KIND = {
+    "init": Effect.PURE,
+    "cast": Effect.PURE,
+    "bitcast": Effect.PURE,
+    "cmp": Effect.PURE,
+    "unary": Effect.PURE,
+    "math": Effect.PURE,
+}
+
+_EFFECTS_BY_NAME = {
+    "copy": Effect.FRESH,
+    "ref.read": Effect.PURE,
+    "buffer.ref": Effect.FRESH,
+    "buffer.size": Effect.PURE,
+    "array.ref": Effect.FRESH,
+    "array.size": Effect.PURE,
+    "pointer.read": Effect.PURE,
+    "pointer.add": Effect.PURE,
+    "pointer.sub": Effect.PURE,
+    "pointer.write": Effect.WRITE,
+}
+
+
+def intrinsic_effect(name: str) -> Effect:
+    """
+    The side effects of the intrinsic `name`, UNKNOWN for intrinsics that are not in the table.
+    """
+    effect = _EFFECTS_BY_NAME.get(name)
+    if effect is not None:
+        return effect
+    kind, _, rest = name.partition(".")
+    if kind == "binop":
+        # in-place operators such as `binop.__iadd__.f32` assign to their first argument
+        op = rest.split(".", 1)[0]
+        if op.startswith("__i"):
+            return Effect.WRITE
+        return Effect.PURE
+    return _EFFECTS_BY_KIND.get(kind, Effect.UNKNOWN)
+
+
+class Memory:
+    """
+    The root of references that do not refer to a local variable, e.g. buffer elements and
+    by-reference parameters, which may alias each other.
+    """
+
+    def __repr__(self) -> str:
+        return "MEMORY"
+
+
+MEMORY = Memory()
+
+
+def is_ref(node: hir.Node) -> bool:
+    return isinstance(node, hir.TypedNode) and isinstance(node.type, hir.RefType)
+
+
+def ref_root(ref: hir.Node) -> hir.Node | Memory:
+    """
+    The variable or temporary `ref` refers into, or `MEMORY`.
+    """
+    while True:
+        match ref:
+            case hir.VarRef(var=var) | hir.VarValue(var=var):
+                return var if var.semantic == hir.ParameterSemantic.BYVAL else MEMORY
+            case hir.Var():
+                return ref if ref.semantic == hir.ParameterSemantic.BYVAL else MEMORY
+            case hir.Alloca():
+                return ref
+            case hir.Member() | hir.Index():
+                ref = ref.base
+            case _:
+                return MEMORY
+
+
+def written_roots(node: hir.Node) -> List[hir.Node | Memory]:
+    """
+    The roots of the references `node` may write through. Nested blocks are not included.
+    """
+    match node:
+        case hir.Assign():
+            return [ref_root(node.ref)]
+        case hir.Intrinsic():
+            match intrinsic_effect(node.name):
+                case Effect.PURE | Effect.FRESH:
+                    return []
+                case Effect.WRITE:
+                    return [ref_root(node.args[0])] if node.args else [MEMORY]
+            return [ref_root(arg) for arg in node.args if is_ref(arg)] + [MEMORY]
+        case hir.Call():
+            return [ref_root(arg) for arg in node.args if is_ref(arg)] + [MEMORY]
+    return []
+
+
+def roots_written_in(bbs: Iterable[Optional[hir.BasicBlock]]) -> Set[hir.Node | Memory]:
+    """
+    The roots written by the nodes of `bbs` and of the blocks nested in them.
+    """
+    roots: Set[hir.Node | Memory] = set()
+    for bb in blocks_in(bbs):
+        for node in bb:
+            roots.update(written_roots(node))
+    return roots
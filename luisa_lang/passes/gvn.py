@@ -0,0 +1,142 @@
+"""
+Global value numbering of pure computations.
+"""
+
+from collections import ChainMap
+import struct
+from typing import Any, Dict, Iterable, Optional
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.effects import (
+    MEMORY,
+    Effect,
+    Memory,
+    intrinsic_effect,
+    is_ref,
+    ref_root,
+    roots_written_in,
+    written_roots,
+)
+
+Scope = ChainMap[Any, hir.TypedNode]
+
+
+class GVN(FunctionPass):
+    """
+    Replaces a pure computation with an equal one that dominates it. Computations are keyed by
+    their kind, type and the value numbers of their operands. Values are numbered by identity,
+    constants by value, and reads of a reference by the variable it refers into together with
+    a generation counting the writes to that variable (or to `MEMORY`) on the way there.
+
+    Blocks are walked in dominance order: the branches of an `If` and the blocks of a `Loop` see
+    the computations before them, the merge block continues the block of its terminator. The
+    variables written in a branch or a loop get a new generation when the walk leaves them,
+    and those written in a loop also when it enters, since the loop may run again.
+    """
+    name = "gvn"
+
+    _gens: Dict[int, int]
+    _counter: int
+    _changed: bool
+
+    def run(self, func: hir.Function) -> bool:
+        self._gens = {}
+        self._counter = 0
+        self._changed = False
+        self._visit(func.body, ChainMap())
+        return self._changed
+
+    def _visit(self, bb: Optional[hir.BasicBlock], scope: Scope) -> None:
+        while bb is not None:
+            next_bb = None
+            for node in bb:
+                match node:
+                    case hir.If():
+                        gens = dict(self._gens)
+                        self._visit(node.then_body, scope.new_child())
+                        self._gens = dict(gens)
+                        self._visit(node.else_body, scope.new_child())
+                        self._gens = gens
+                        self._bump(roots_written_in([node.then_body, node.else_body]))
+                        next_bb = node.merge
+                    case hir.Loop():
+                        written = roots_written_in([node.prepare, node.body, node.update])
+                        self._bump(written)
+                        prepare_scope = scope.new_child()
+                        self._visit(node.prepare, prepare_scope)
+                        self._visit(node.body, prepare_scope.new_child())
+                        self._visit(node.update, prepare_scope.new_child())
+                        self._bump(written)
+                        next_bb = node.merge
+                    case _:
+                        self._number(node, scope)
+                        self._bump(written_roots(node))
+            bb = next_bb
+
+    def _number(self, node: hir.Node, scope: Scope) -> None:
+        key = self._key(node)
+        if key is None:
+            return
+        assert isinstance(node, hir.TypedNode)
+        leader = scope.get(key)
+        if leader is None:
+            scope[key] = node
+            return
+        node.replace_all_uses_with(leader)
+        node.remove()
+        self._changed = True
+
+    def _bump(self, roots: Iterable[hir.Node | Memory]) -> None:
+        for root in roots:
+            self._counter += 1
+            self._gens[id(root)] = self._counter
+
+    def _key(self, node: hir.Node) -> Any:
+        if not isinstance(node, hir.TypedNode) or node.type is None or is_ref(node):
+            return None
+        match node:
+            case hir.Intrinsic():
+                if intrinsic_effect(node.name) != Effect.PURE:
+                    return None
+                return (node.name, node.type, tuple(self._operand(a) for a in node.args))
+            case hir.Member():
+                return ("member", node.type, self._operand(node.base), node.field)
+            case hir.Index():
+                return ("index", node.type, self._operand(node.base), self._operand(node.index))
+            case hir.Load():
+                return ("load", node.type, self._ref(node.ref))
+            case hir.VarValue():
+                return ("var", node.type, self._ref(node))
+            case hir.AggregateInit():
+                return ("aggregate", node.type, tuple(self._operand(a) for a in node.args))
+        return None
+
+    def _operand(self, v: hir.Node) -> Any:
+        if isinstance(v, hir.Constant):
+            value = v.value
+            # -0.0 == 0.0, but they are different constants
+            if isinstance(value, float):
+                return ("const", v.type, struct.pack("d", value))
+            if isinstance(value, (bool, int, str)):
+                return ("const", v.type, type(value), value)
+            return id(v)
+        if is_ref(v):
+            return self._ref(v)
+        return id(v)
+
+    def _ref(self, ref: hir.Node) -> Any:
+        match ref:
+            case hir.VarRef() | hir.VarValue():
+                return ("var", id(ref.var), self._gen(ref.var))
+            case hir.Var() | hir.Alloca():
+                return ("var", id(ref), self._gen(ref))
+            case hir.Member():
+                return ("member", self._ref(ref.base), ref.field)
+            case hir.Index():
+                return ("index", self._ref(ref.base), self._operand(ref.index))
+        return ("memory", id(ref), self._gens.get(id(MEMORY), 0))
+
+    def _gen(self, node: hir.Node) -> int:
+        return self._gens.get(id(ref_root(node)), 0)
+
@@ -0,0 +1,205 @@
+"""
+Inlining of calls to small functions, driven by the size of the callee and the number of calls
+to it.
+"""
+
+from typing import Dict, List, Optional, Set
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.effects import Memory, is_ref, ref_root, roots_written_in
+from luisa_lang.passes.utils import (
+    blocks,
+    blocks_in,
+    calls,
+    clone_function,
+    count_nodes,
+    merge_chain,
+)
+
+
+class Inliner(FunctionPass):
+    """
+    Replaces calls with a copy of the callee's body. A callee hinted `inline="always"` is always
+    inlined and one hinted `"never"` never is. Otherwise the cost model inlines a callee of at
+    most `small` nodes (a wrapper around a single intrinsic, like the math builtins), or one
+    whose copies at all its calls in the function add at most `budget` nodes.
+
+    A parameter the callee never writes reads the variable passed to it, the others become
+    locals of the caller assigned the arguments, which Mem2Reg forwards to their reads. The
+    call is replaced by the value the callee returns.
+    Callees are expected to be optimized (and their own calls inlined) before their callers,
+    as the `PassManager` does. Callees with early returns and recursive calls are not inlined.
+    """
+    name = "inline"
+
+    small: int
+    budget: int
+
+    def __init__(self, small: int = 4, budget: int = 16) -> None:
+        self.small = small
+        self.budget = budget
+
+    def run(self, func: hir.Function) -> bool:
+        sites = calls(func)
+        counts: Dict[int, int] = {}
+        for call in sites:
+            counts[id(call.op)] = counts.get(id(call.op), 0) + 1
+        nested = _used_by_nested(func)
+        names = set(v.name for v in func.locals)
+        changed = False
+        for call in sites:
+            callee = call.op
+            if callee is func or id(call) in nested or not self._should_inline(callee, counts):
+                continue
+            changed = _inline(func, call, names) or changed
+        return changed
+
+    def _should_inline(self, callee: hir.Function, counts: Dict[int, int]) -> bool:
+        if callee.inline_hint != "auto":
+            return callee.inline_hint == "always"
+        size = count_nodes(callee)
+        return size <= self.small or size * counts[id(callee)] <= self.budget
+
+
+def _used_by_nested(func: hir.Function) -> Set[int]:
+    """
+    The nodes in blocks that are operands of nodes outside any block, which do not track their
+    uses.
+    """
+    used: Set[int] = set()
+
+    def walk(node: hir.Node) -> None:
+        for operand in node.operands():
+            if operand.block is not None:
+                used.add(id(operand))
+            else:
+                walk(operand)
+
+    for bb in blocks(func):
+        for node in bb:
+            for operand in node.operands():
+                if operand.block is None:
+                    walk(operand)
+    return used
+
+
+def _source(value: hir.Node) -> Optional[hir.Node | Memory]:
+    """
+    The root `value` refers into, if it is generated as a C++ reference.
+    """
+    match value:
+        case hir.Load():
+            return ref_root(value.ref)
+        case hir.Member() | hir.Index():
+            if is_ref(value.base):
+                return ref_root(value.base)
+            # e.g. a member of a load
+            return _source(value.base)
+    return None
+
+
+def _substitute(body: hir.BasicBlock, old: hir.Var, new: hir.Var) -> None:
+    """
+    Make the nodes of `body` refer to `new` wherever they refer to `old`.
+    """
+
+    def walk(node: hir.Node) -> None:
+        for operand in node.operands():
+            if operand is old:
+                node.replace_operand(old, new)
+            elif operand.block is None:
+                walk(operand)
+
+    for bb in blocks_in([body]):
+        for node in bb:
+            walk(node)
+
+
+def _inline(func: hir.Function, call: hir.Call, names: Set[str]) -> bool:
+    """
+    Replace `call` with a copy of the body of its callee. Returns False, leaving `call` as is,
+    if the callee returns before the end of its body.
+    """
+    callee = clone_function(call.op)
+    *_, tail = merge_chain(callee.body)
+    returns = [node for bb in blocks(callee) for node in bb if isinstance(node, hir.Return)]
+    if len(returns) > 1 or any(ret.block is not tail for ret in returns):
+        return False
+    ret = returns[0] if returns else None
+    result: Optional[hir.Value] = None
+    if ret is not None and ret.value is not None:
+        result = ret.value
+        if result.is_ref():
+            result = hir.Load(result)
+        elif isinstance(result, hir.VarValue) and result.block is None:
+            result = hir.Load(hir.VarRef(result.var))
+        elif result.block is None and not isinstance(result, hir.Constant):
+            return False
+    if any(
+        arg.block is None and not arg.is_ref() and not isinstance(arg, hir.Constant)
+        for arg in call.args
+    ):
+        return False
+
+    # a parameter the callee never writes reads the variable passed to it directly, unless the
+    # result is generated as a reference into it and would see the caller's later writes
+    written = roots_written_in([callee.body])
+    escaping = _source(result) if result is not None else None
+    substituted: Set[int] = set()
+    for param, arg in zip(callee.params, call.args):
+        if (
+            isinstance(arg, hir.VarRef)
+            and arg.block is None
+            and arg.var.semantic == hir.ParameterSemantic.BYVAL
+            and param not in written
+            and param is not escaping
+        ):
+            _substitute(callee.body, param, arg.var)
+            substituted.add(id(param))
+        elif arg.is_ref():
+            load = hir.Load(arg)
+            call.prepend(load)
+            call.prepend(hir.Assign(hir.VarRef(param), load))
+        else:
+            call.prepend(hir.Assign(hir.VarRef(param), arg))
+
+    locals = callee.locals + [p for p in callee.params if all(p is not v for v in callee.locals)]
+    for var in locals:
+        if id(var) in substituted:
+            continue
+        name = var.name
+        k = 1
+        while name in names:
+            name = f"{var.name}_{k}"
+            k += 1
+        var.name = name
+        names.add(name)
+        func.locals.append(var)
+
+    bb = call.block
+    assert bb is not None
+    rest: List[hir.Node] = []
+    after = False
+    for node in bb:
+        if after:
+            rest.append(node)
+        after = after or node is call
+    for node in rest:
+        node.remove()
+    for node in callee.body.nodes():
+        node.remove()
+        bb.append(node)
+    if tail is callee.body:
+        tail = bb
+    if ret is not None:
+        ret.remove()
+    if result is not None and result.block is None and not isinstance(result, hir.Constant):
+        tail.append(result)
+    # the nodes after the call register their uses again once they are back in a block
+    for node in rest:
+        tail.append(node)
+    if result is not None:
+        call.replace_all_uses_with(result)
+    call.remove()
+    return True
@@ -0,0 +1,101 @@
+"""
+Loop-invariant code motion: pure computations that do not change between the iterations of a
+loop are moved before it.
+"""
+
+from typing import List, Set
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.effects import (
+    Effect,
+    Memory,
+    intrinsic_effect,
+    is_ref,
+    ref_root,
+    roots_written_in,
+)
+from luisa_lang.passes.utils import blocks, blocks_in, merge_chain
+
+# undefined for an integer divisor of zero, only moved where the loop would evaluate them
+_TRAPPING_OPS = frozenset(("__truediv__", "__floordiv__", "__mod__"))
+
+
+class LICM(FunctionPass):
+    """
+    Moves the pure computations of a loop whose operands are all defined outside it (or moved)
+    right before the `Loop`, its preheader: the code emitted before the C++ `while (true)`.
+    Pure intrinsics, aggregates and reads (loads, variable, member and index reads) are moved.
+
+    A read is invariant when the root it reads from is not written in the loop (see
+    `effects.ref_root`). Stores through `buffer.ref` and other references into memory only
+    write `MEMORY`: they keep the reads of memory in the loop, but not the reads of local
+    variables and by-value parameters, such as the `buffer.size` of a buffer parameter or the
+    members of a struct parameter. A call or an intrinsic with unknown effects writes both.
+
+    The prepare block runs at least once, the body, the update and the branches inside the loop
+    may not run at all: from them, computations that may trap (integer division) and reads of
+    memory, which may be out of bounds, are not moved. Inner loops are processed first, so
+    invariants move out of a loop nest as far as they can.
+    """
+    name = "licm"
+
+    _written: Set[hir.Node | Memory]
+    _inside: Set[int]
+    _hoisted: Set[int]
+
+    def run(self, func: hir.Function) -> bool:
+        loops = [node for bb in blocks(func) for node in bb if isinstance(node, hir.Loop)]
+        changed = False
+        # nested loops come after the loops containing them
+        for loop in reversed(loops):
+            changed = self._hoist(loop) or changed
+        return changed
+
+    def _hoist(self, loop: hir.Loop) -> bool:
+        bbs: List[hir.BasicBlock] = list(blocks_in([loop.prepare, loop.body, loop.update]))
+        always = set(id(bb) for bb in merge_chain(loop.prepare))
+        self._written = roots_written_in(bbs)
+        self._inside = set(id(bb) for bb in bbs)
+        self._hoisted = set()
+        for bb in bbs:
+            speculative = id(bb) not in always
+            for node in bb:
+                if self._movable(node, speculative):
+                    node.remove()
+                    loop.prepend(node)
+                    self._hoisted.add(id(node))
+        return len(self._hoisted) > 0
+
+    def _movable(self, node: hir.Node, speculative: bool) -> bool:
+        match node:
+            case hir.Intrinsic():
+                if intrinsic_effect(node.name) != Effect.PURE:
+                    return False
+                if speculative and _may_trap(node):
+                    return False
+            case hir.Load() | hir.Member() | hir.Index() | hir.VarValue() | hir.AggregateInit():
+                pass
+            case _:
+                return False
+        if is_ref(node):
+            return False
+        return all(self._invariant(operand, speculative) for operand in node.operands())
+
+    def _invariant(self, operand: hir.Node, speculative: bool) -> bool:
+        if is_ref(operand) or isinstance(operand, (hir.Var, hir.VarValue)):
+            # read through by the node using it
+            root = ref_root(operand)
+            if root in self._written or (speculative and isinstance(root, Memory)):
+                return False
+        if operand.block is not None:
+            return id(operand) in self._hoisted or id(operand.block) not in self._inside
+        return all(self._invariant(x, speculative) for x in operand.operands())
+
+
+def _may_trap(node: hir.Intrinsic) -> bool:
+    kind, _, rest = node.name.partition(".")
+    if kind != "binop" or rest.split(".", 1)[0] not in _TRAPPING_OPS:
+        return False
+    ty = node.type.element if isinstance(node.type, hir.VectorType) else node.type
+    return not isinstance(ty, hir.FloatType)
@@ -0,0 +1,163 @@
+"""
+Running pipelines of function passes over the HIR.
+"""
+
+import threading
+import time
+import weakref
+from typing import Any, Callable, ClassVar, Dict, List, Sequence, Tuple
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.presets import pipeline
+from luisa_lang.passes.utils import calls, clone_function, count_nodes, structural_key
+
+
+class PassStats:
+    """
+    Counters of a pass in a pipeline. `time` is the total wall time in seconds, `node_delta`
+    the total change in the number of nodes of the functions it ran on.
+    """
+    runs: int
+    changed: int
+    time: float
+    node_delta: int
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.changed = 0
+        self.time = 0.0
+        self.node_delta = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"PassStats(runs={self.runs}, changed={self.changed}, time={self.time:.6f}, "
+            f"node_delta={self.node_delta})"
+        )
+
+
+class PassManager:
+    """
+    Runs an ordered list of passes over functions and their callees, bottom-up. Functions are
+    copied before they are transformed, since traced functions are shared through the template
+    caches. Results are memoized by the structural key of the input, so instantiations that
+    trace to the same HIR are only optimized once. The memo does not keep the functions alive:
+    a result is forgotten once the template caches evict its inputs and nothing else uses it.
+
+    The template caches already return the same traced function for the same instantiation, so
+    the structural memo is only hit by distinct instantiations that trace to identical HIR. In a
+    typical compile `cache_hits` stays at zero; the per-function memo is what avoids rerunning
+    the passes.
+    """
+    passes: List[FunctionPass]
+    stats: Dict[str, PassStats]
+    _results: weakref.WeakKeyDictionary[hir.Function, hir.Function]
+    _outputs: weakref.WeakSet[hir.Function]
+    # structural key -> (result, callees of the input). The key refers to the callees by `id`,
+    # they are kept alive until the entry is removed along with the result.
+    _by_key: Dict[Any, Tuple[weakref.ref[hir.Function], List[hir.Function]]]
+    _lock: threading.RLock
+    cache_hits: int
+
+    _presets: ClassVar[Dict[int, "PassManager"]] = {}
+    _presets_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, passes: Sequence[FunctionPass]) -> None:
+        self.passes = list(passes)
+        self.stats = {p.name: PassStats() for p in self.passes}
+        self._results = weakref.WeakKeyDictionary()
+        self._outputs = weakref.WeakSet()
+        self._by_key = {}
+        self._lock = threading.RLock()
+        self.cache_hits = 0
+
+    @staticmethod
+    def for_level(opt_level: int) -> "PassManager":
+        """
+        The shared pass manager of the preset for `opt_level` (-O0, -O1 or -O2).
+        """
+        opt_level = max(0, min(opt_level, 2))
+        with PassManager._presets_lock:
+            manager = PassManager._presets.get(opt_level)
+            if manager is None:
+                manager = PassManager(pipeline(opt_level))
+                PassManager._presets[opt_level] = manager
+            return manager
+
+    def run(self, func: hir.Function) -> hir.Function:
+        """
+        The optimized version of `func`, whose calls refer to the optimized callees.
+        `func` itself is not modified.
+        """
+        if not self.passes:
+            return func
+        with self._lock:
+            if func in self._outputs:
+                return func
+            result = self._results.get(func)
+            if result is not None:
+                return result
+            key = structural_key(func)
+            entry = self._by_key.get(key)
+            result = entry[0]() if entry is not None else None
+            if result is not None:
+                self.cache_hits += 1
+            else:
+                callees = [call.op for call in calls(func)]
+                result = clone_function(func)
+                for call in calls(result):
+                    call.op = self.run(call.op)
+                self._run_passes(result)
+                self._by_key[key] = (weakref.ref(result, self._forget(key)), callees)
+            self._results[func] = result
+            self._outputs.add(result)
+            return result
+
+    def _forget(self, key: Any) -> Callable[[weakref.ref[hir.Function]], None]:
+        def forget(ref: weakref.ref[hir.Function]) -> None:
+            # called by the garbage collector, possibly on another thread, the entry may have
+            # been replaced since
+            entry = self._by_key.get(key)
+            if entry is not None and entry[0] is ref:
+                self._by_key.pop(key, None)
+
+        return forget
+
+    def _run_passes(self, func: hir.Function) -> None:
+        num_nodes = count_nodes(func)
+        for p in self.passes:
+            stats = self.stats[p.name]
+            t = time.perf_counter()
+            changed = p.run(func)
+            stats.time += time.perf_counter() - t
+            stats.runs += 1
+            if changed:
+                stats.changed += 1
+                new_num_nodes = count_nodes(func)
+                stats.node_delta += new_num_nodes - num_nodes
+                num_nodes = new_num_nodes
+
+    def clear(self) -> None:
+        """
+        Forget the memoized results and the state the passes keep between runs.
+        """
+        with self._lock:
+            self._results.clear()
+            self._outputs.clear()
+            self._by_key.clear()
+            for p in self.passes:
+                p.clear()
+
+    def report(self) -> str:
+        """
+        A table of the time spent in each pass and the nodes it added (or removed, if negative).
+        """
+        lines = [f"{'pass':<24} {'runs':>6} {'changed':>8} {'nodes':>8} {'time (ms)':>10}"]
+        for p in self.passes:
+            stats = self.stats[p.name]
+            lines.append(
+                f"{p.name:<24} {stats.runs:>6} {stats.changed:>8} {stats.node_delta:>+8} "
+                f"{stats.time * 1e3:>10.2f}"
+            )
+        lines.append(f"memoized functions reused: {self.cache_hits}")
+        return "\n".join(lines)
@@ -0,0 +1,202 @@
+"""
+Promotion of local variables and temporaries to values: stored values are forwarded to the
+reads of the variable.
+"""
+
+from collections import ChainMap
+from typing import Iterable, Optional, Tuple
+
+from luisa_lang import hir
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.effects import (
+    MEMORY,
+    Effect,
+    Memory,
+    intrinsic_effect,
+    is_ref,
+    ref_root,
+    roots_written_in,
+    written_roots,
+)
+
+# the value a variable or temporary is known to hold, and the root that value still refers into
+# when it is generated as a C++ reference (a load, a member read...) rather than a copy
+Known = Tuple[hir.TypedNode, Optional[hir.Node | Memory]]
+Scope = ChainMap[int, Optional[Known]]
+
+# intrinsic kinds whose arguments are only read by value
+_BY_VALUE_KINDS = frozenset(("init", "cast", "bitcast", "cmp", "unary", "math", "binop"))
+
+
+class Mem2Reg(FunctionPass):
+    """
+    Forwards the value last assigned to a local variable or temporary (`Alloca`) to the reads
+    that follow it: loads, variable reads, arguments of by-value intrinsics and calls, and
+    member reads of a struct built by an `AggregateInit`. An assignment of the value the
+    variable already holds is removed; the stores and temporaries left without reads are
+    removed by DCE.
+
+    Blocks are walked in dominance order as in GVN, so a value is only forwarded to reads it
+    dominates. There are no phis: the variables written in a branch or a loop are unknown
+    after it, and those written in a loop also inside it. Any other node writing through a
+    reference into a variable makes it unknown, as does a write to the variable a forwarded
+    value still refers into.
+    """
+    name = "mem2reg"
+
+    _changed: bool
+
+    def run(self, func: hir.Function) -> bool:
+        self._changed = False
+        self._visit(func.body, ChainMap())
+        return self._changed
+
+    def _visit(self, bb: Optional[hir.BasicBlock], scope: Scope) -> None:
+        while bb is not None:
+            next_bb = None
+            for node in bb:
+                match node:
+                    case hir.If():
+                        self._visit(node.then_body, scope.new_child())
+                        self._visit(node.else_body, scope.new_child())
+                        self._kill(scope, roots_written_in([node.then_body, node.else_body]))
+                        next_bb = node.merge
+                    case hir.Loop():
+                        written = roots_written_in([node.prepare, node.body, node.update])
+                        self._kill(scope, written)
+                        prepare_scope = scope.new_child()
+                        self._visit(node.prepare, prepare_scope)
+                        self._visit(node.body, prepare_scope.new_child())
+                        # the update follows the body, or a `continue` anywhere in it
+                        update_scope = prepare_scope.new_child()
+                        self._kill(update_scope, roots_written_in([node.body]))
+                        self._visit(node.update, update_scope)
+                        self._kill(scope, written)
+                        next_bb = node.merge
+                    case _:
+                        self._node(node, scope)
+            bb = next_bb
+
+    def _node(self, node: hir.Node, scope: Scope) -> None:
+        match node:
+            case hir.Load() | hir.VarValue() | hir.Member() if not node.is_ref():
+                value = self._read(node, scope)
+                if value is not None:
+                    node.replace_all_uses_with(value)
+                    node.remove()
+                    self._changed = True
+                    return
+            case hir.Assign():
+                root = _whole(node.ref)
+                if root is not None:
+                    known = scope.get(id(root))
+                    if known is not None and known[0] is node.value:
+                        node.remove()
+                        self._changed = True
+                        return
+                    self._kill(scope, [root])
+                    scope[id(root)] = (node.value, _source(node.value))
+                    return
+        self._forward_operands(node, scope)
+        self._kill(scope, written_roots(node))
+
+    def _forward_operands(self, node: hir.Node, scope: Scope) -> None:
+        for operand in _by_value_operands(node):
+            if operand.block is not None:
+                continue
+            value = self._read(operand, scope)
+            if value is not None:
+                node.replace_operand(operand, value)
+                self._changed = True
+
+    def _read(self, node: hir.Node, scope: Scope) -> Optional[hir.TypedNode]:
+        """
+        The value known to be read by `node`, if any.
+        """
+        if isinstance(node, hir.Member) and node.type is not None:
+            # a field of a struct temporary that was initialized as a whole
+            aggregate: Optional[hir.Node] = node.base
+            if not isinstance(node.base, hir.AggregateInit):
+                aggregate = self._read(node.base, scope)
+            if not isinstance(aggregate, hir.AggregateInit) or not isinstance(
+                aggregate.type, hir.StructType
+            ):
+                return None
+            names = [name for name, _ in aggregate.type.fields]
+            if node.field not in names:
+                return None
+            value = aggregate.args[names.index(node.field)]
+            return value if value.type == node.type.remove_ref() else None
+        if isinstance(node, hir.Load):
+            node = node.ref
+        root = _whole(node)
+        if root is None:
+            return None
+        known = scope.get(id(root))
+        return None if known is None else known[0]
+
+    def _kill(self, scope: Scope, roots: Iterable[hir.Node | Memory]) -> None:
+        roots = set(roots)
+        if not roots:
+            return
+        for key, known in list(scope.items()):
+            if known is None:
+                continue
+            source = known[1]
+            if source is not None and (source in roots or MEMORY in roots):
+                scope[key] = None
+        for root in roots:
+            if not isinstance(root, Memory):
+                scope[id(root)] = None
+
+
+def _whole(ref: hir.Node) -> Optional[hir.Node]:
+    """
+    The local variable or temporary `ref` refers to as a whole.
+    """
+    match ref:
+        case hir.VarRef(var=var) | hir.VarValue(var=var):
+            return var if var.semantic == hir.ParameterSemantic.BYVAL else None
+        case hir.Var():
+            return ref if ref.semantic == hir.ParameterSemantic.BYVAL else None
+        case hir.Alloca():
+            return ref
+    return None
+
+
+def _source(value: hir.Node) -> Optional[hir.Node | Memory]:
+    """
+    The root `value` keeps referring into once it is generated, as C++ binds loads, variable
+    reads and member and index reads by reference.
+    """
+    match value:
+        case hir.Load():
+            return ref_root(value.ref)
+        case hir.VarValue():
+            return ref_root(value)
+        case hir.Member() | hir.Index():
+            if is_ref(value.base):
+                return ref_root(value.base)
+            # a member of a value read, e.g. of a load, refers into what the read refers into
+            return _source(value.base)
+    return None
+
+
+def _by_value_operands(node: hir.Node) -> Iterable[hir.TypedNode]:
+    match node:
+        case hir.Intrinsic():
+            kind = node.name.split(".", 1)[0]
+            if kind in _BY_VALUE_KINDS and intrinsic_effect(node.name) == Effect.PURE:
+                return list(node.args)
+        case hir.AggregateInit():
+            return list(node.args)
+        case hir.Call():
+            return [
+                arg
+                for arg, param in zip(node.args, node.op.params)
+                if param.semantic == hir.ParameterSemantic.BYVAL
+            ]
+        case hir.Return() if node.value is not None:
+            return [node.value]
+    return []
+
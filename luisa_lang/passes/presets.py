@@ -0,0 +1,25 @@
+"""
+The passes run at each optimization level.
+"""
+
+from typing import List
+
+from luisa_lang.passes.base import FunctionPass
+from luisa_lang.passes.constant_fold import ConstantFold
+from luisa_lang.passes.dce import DCE
+from luisa_lang.passes.gvn import GVN
+from luisa_lang.passes.inline import Inliner
+from luisa_lang.passes.licm import LICM
+from luisa_lang.passes.mem2reg import Mem2Reg
+
+
+def pipeline(opt_level: int) -> List[FunctionPass]:
+    """
+    The passes run at `opt_level`: 0 runs none.
+    """
+    if opt_level <= 0:
+        return []
+    # -O2 also inlines larger callees, as long as their copies in a caller stay small
+    inliner = Inliner() if opt_level == 1 else Inliner(budget=64)
+    passes: List[FunctionPass] = [inliner, Mem2Reg(), ConstantFold(), LICM(), GVN(), DCE()]
+    return passes
@@ -0,0 +1,166 @@
+"""
+Helpers shared by the HIR passes: walking, counting, cloning and hashing functions.
+"""
+
+from enum import Enum
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, cast
+
+from luisa_lang import hir
+
+# slots describing where a node is, rather than what it computes
+_LINK_SLOTS = frozenset(("block", "_index", "_uses", "func", "span"))
+_UNSET: Any = object()
+
+
+def blocks(func: hir.Function) -> Iterator[hir.BasicBlock]:
+    """
+    All basic blocks of `func`, each block before the blocks nested in its nodes.
+    """
+    yield from _blocks_of(func.body)
+
+
+def blocks_in(bbs: Iterable[Optional[hir.BasicBlock]]) -> Iterator[hir.BasicBlock]:
+    """
+    The blocks `bbs` (None is skipped) and the blocks nested in them.
+    """
+    for bb in bbs:
+        if bb is not None:
+            yield from _blocks_of(bb)
+
+
+def _blocks_of(bb: hir.BasicBlock) -> Iterator[hir.BasicBlock]:
+    yield bb
+    for node in bb:
+        for name in node.block_fields:
+            child = getattr(node, name)
+            if child is not None:
+                yield from _blocks_of(child)
+
+
+def merge_chain(bb: hir.BasicBlock) -> Iterator[hir.BasicBlock]:
+    """
+    `bb` and the blocks that run after it at the same level, the merge blocks of its terminators.
+    """
+    while True:
+        yield bb
+        last = bb.nodes()[-1] if bb.num_nodes() > 0 else None
+        if not isinstance(last, (hir.If, hir.Loop)):
+            return
+        bb = last.merge
+
+
+def count_nodes(func: hir.Function) -> int:
+    return sum(bb.num_nodes() for bb in blocks(func))
+
+
+def calls(func: hir.Function) -> List[hir.Call]:
+    return [node for bb in blocks(func) for node in bb if isinstance(node, hir.Call)]
+
+
+class _Cloner:
+    mapping: Dict[int, Any]
+
+    def __init__(self) -> None:
+        # keyed by `id`, the cloned function keeps the originals alive
+        self.mapping = {}
+
+    def node(self, node: hir.Node) -> hir.Node:
+        cloned = self.mapping.get(id(node))
+        if cloned is not None:
+            return cloned
+        if isinstance(node, hir.BasicBlock):
+            return self.block(node)
+        cloned = object.__new__(type(node))
+        # registered first, nested blocks may refer back to the node (e.g. `Break.target`)
+        self.mapping[id(node)] = cloned
+        for name in hir.slots_of(type(node)):
+            if name in _LINK_SLOTS:
+                continue
+            v = getattr(node, name, _UNSET)
+            if v is not _UNSET:
+                setattr(cloned, name, self.value(v))
+        cloned.span = node.span
+        cloned.block = None
+        cloned._index = -1
+        cloned.func = None
+        if isinstance(cloned, hir.TypedNode):
+            cloned._uses = None
+        return cloned
+
+    def value(self, v: Any) -> Any:
+        if isinstance(v, hir.Node):
+            return self.node(v)
+        if type(v) is list:
+            return [self.value(x) for x in v]
+        return v
+
+    def block(self, bb: hir.BasicBlock) -> hir.BasicBlock:
+        cloned = hir.BasicBlock(bb.span)
+        self.mapping[id(bb)] = cloned
+        for node in bb:
+            cloned.append(self.node(node))
+        return cloned
+
+
+def clone_function(func: hir.Function) -> hir.Function:
+    """
+    A deep copy of the body, params and locals of `func`. Callees are shared.
+    """
+    cloner = _Cloner()
+    params = cast(List[hir.Var], [cloner.node(p) for p in func.params])
+    locals = cast(List[hir.Var], [cloner.node(v) for v in func.locals])
+    body = cloner.block(func.body)
+    return hir.Function(
+        func.name,
+        params,
+        locals,
+        body,
+        func.return_jitvar_type,
+        func.return_type,
+        func.inline_hint,
+    )
+
+
+def structural_key(func: hir.Function) -> Tuple[Any, ...]:
+    """
+    A hashable key such that functions with equal keys generate the same code. Nodes are encoded
+    by their kind and fields, operands by the order in which their definitions were encoded, and
+    callees by identity.
+    """
+    numbers: Dict[int, int] = {}
+
+    def encode_node(node: hir.Node) -> Tuple[Any, ...]:
+        numbers[id(node)] = len(numbers)
+        parts: List[Any] = [type(node)]
+        for name in hir.slots_of(type(node)):
+            if name not in _LINK_SLOTS:
+                parts.append(encode(getattr(node, name, None)))
+        return tuple(parts)
+
+    def encode(v: Any) -> Any:
+        if isinstance(v, hir.BasicBlock):
+            return tuple(encode_node(node) for node in v)
+        if isinstance(v, hir.Node):
+            number = numbers.get(id(v))
+            # nodes that are not in any block are encoded where they are used
+            return number if number is not None else encode_node(v)
+        if type(v) is list:
+            return tuple(encode(x) for x in v)
+        if isinstance(v, (hir.Type, Enum)) or v is None:
+            return v
+        if isinstance(v, (int, float, str)):
+            # `1`, `1.0` and `True` are different constants
+            return (type(v), v)
+        return ("id", id(v))
+
+    locals = tuple(encode_node(v) for v in func.locals)
+    params = tuple(encode(p) for p in func.params)
+    return (
+        func.name,
+        func.return_jitvar_type,
+        func.return_type,
+        func.inline_hint,
+        locals,
+        params,
+        encode(func.body),
+    )
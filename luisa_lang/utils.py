@@ -1,6 +1,10 @@
 import ast
 from functools import cache
+import inspect
+import os
 import textwrap
+import threading
+import tokenize
 import types
 from typing import (
     Any,
@@ -64,16 +68,210 @@ def dedent_and_retrieve_indentation(lines: List[str]) -> Tuple[str, int]:
     return textwrap.dedent("".join(lines)), len(lines[0]) - len(lines[0].lstrip())
 
 
-def retrieve_ast_and_filename(f: object) -> Tuple[ast.AST, str]:
+class _ParsedSourceFile:
+    """
+    The lines of a source file, read once. The file is parsed on the first request for the AST
+    of one of its definitions, which are indexed by (first line including decorators, name),
+    what `co_firstlineno` reports. Retrieving source lines does not parse the file.
+    """
+    path: str
+    stamp: Tuple[int, int]
+    lines: List[str]
+    defs: Optional[Dict[Tuple[int, str], ast.FunctionDef | ast.AsyncFunctionDef]]
+    blocks: Dict[int, List[str]]
+    _lock: threading.Lock
+
+    def __init__(self, path: str, stamp: Tuple[int, int]) -> None:
+        self.path = path
+        self.stamp = stamp
+        with tokenize.open(path) as fp:
+            self.lines = fp.readlines()
+        self.defs = None
+        self.blocks = {}
+        self._lock = threading.Lock()
+
+    def _index(self, body: List[ast.stmt], defs: Dict[Tuple[int, str], Any]) -> None:
+        # only statements can contain definitions, so there is no need to visit expressions
+        for stmt in body:
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                first = stmt.decorator_list[0].lineno if stmt.decorator_list else stmt.lineno
+                defs[(first, stmt.name)] = stmt
+                # definitions nested in a function belong to the AST handed out for it, which
+                # may be mutated: they are parsed from their own lines instead
+                continue
+            for field in ("body", "orelse", "finalbody", "handlers", "cases"):
+                children = getattr(stmt, field, None)
+                if isinstance(children, list):
+                    self._index(children, defs)
+
+    def find(self, lineno: int, name: str) -> Optional[Tuple[List[str], int]]:
+        block = self.blocks.get(lineno)
+        if block is None:
+            if not 0 < lineno <= len(self.lines):
+                return None
+            try:
+                # the same block `inspect.getsourcelines` returns, found by tokenizing
+                block = inspect.getblock(self.lines[lineno - 1:])
+            except (SyntaxError, tokenize.TokenError, IndentationError):
+                return None
+            self.blocks[lineno] = block
+        return block, lineno
+
+    def take(self, lineno: int, name: str) -> Optional[ast.stmt]:
+        """
+        Hand out the AST of a definition. Callers are free to mutate it (e.g. `FuncRewriter`),
+        so each node is given away only once; later requests re-parse the cached lines.
+        """
+        with self._lock:
+            if self.defs is None:
+                self.defs = {}
+                try:
+                    self._index(ast.parse("".join(self.lines), filename=self.path).body, self.defs)
+                except (SyntaxError, ValueError):
+                    pass
+            return self.defs.pop((lineno, name), None)
+
+
+_parsed_source_files: Dict[str, _ParsedSourceFile] = {}
+_parsed_source_files_lock = threading.Lock()
+
+
+def _parsed_source_file(path: str) -> Optional[_ParsedSourceFile]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _parsed_source_files_lock:
+        parsed = _parsed_source_files.get(path)
+        if parsed is None or parsed.stamp != stamp:
+            try:
+                parsed = _ParsedSourceFile(path, stamp)
+            except (OSError, SyntaxError, UnicodeDecodeError):
+                return None
+            _parsed_source_files[path] = parsed
+        return parsed
+
+
+def _locate_in_source_file(f: object) -> Optional[Tuple[_ParsedSourceFile, int, str, str]]:
+    code = getattr(f, "__code__", None)
+    if not isinstance(code, types.CodeType):
+        return None
+    source_file = sourceinspect.getsourcefile(f)
+    if source_file is None:
+        return None
+    parsed = _parsed_source_file(source_file)
+    if parsed is None:
+        return None
+    return parsed, code.co_firstlineno, code.co_name, source_file
+
+
+class FunctionSource:
+    """
+    The source lines of a function, the line number of the first line and the source file.
+    `parse` builds its AST, parsing the source file (once) only when it is called.
+    """
+    lines: List[str]
+    lineno: int
+    filename: str
+    _located: Optional[Tuple[_ParsedSourceFile, int, str, str]]
+
+    def __init__(
+        self,
+        lines: List[str],
+        lineno: int,
+        filename: str,
+        located: Optional[Tuple[_ParsedSourceFile, int, str, str]] = None,
+    ) -> None:
+        self.lines = lines
+        self.lineno = lineno
+        self.filename = filename
+        self._located = located
+
+    def parse(self) -> ast.AST:
+        """
+        The AST of the function wrapped in a module, with locations matching the source file.
+        """
+        if self._located is not None:
+            tree = _take_ast(*self._located)
+            if tree is not None:
+                return tree
+        return parse_source_lines(self.lines, self.lineno, self.filename)
+
+
+def retrieve_function_source(f: object) -> FunctionSource:
+    """
+    Locate the source of `f`. Reading the lines of a source file does not parse it.
+    """
+    located = _locate_in_source_file(f)
+    if located is not None:
+        parsed, lineno, name, source_file = located
+        found = parsed.find(lineno, name)
+        if found is not None:
+            return FunctionSource(found[0], found[1], source_file, located)
     source_file = sourceinspect.getsourcefile(f)
     if source_file is None:
         source_file = "<unknown>"
     source_lines, lineno = sourceinspect.getsourcelines(f)
+    return FunctionSource(source_lines, lineno, source_file)
+
+
+def retrieve_source_and_filename(f: object) -> Tuple[List[str], int, str]:
+    """
+    Retrieve the source lines of `f`, the line number of the first line and the source file.
+    """
+    source = retrieve_function_source(f)
+    return source.lines, source.lineno, source.filename
+
+
+def _attach_source_file(tree: ast.AST, source_file: str, col_offset: int) -> ast.AST:
+    if col_offset == 0:
+        for child in ast.walk(tree):
+            child.source_file = source_file  # type: ignore
+        return tree
+    for child in ast.walk(tree):
+        child.source_file = source_file  # type: ignore
+        if "col_offset" in child._attributes:
+            child.col_offset += col_offset  # type: ignore
+            if child.end_col_offset is not None:  # type: ignore
+                child.end_col_offset += col_offset  # type: ignore
+    return tree
+
+
+def _take_ast(
+    parsed: _ParsedSourceFile, lineno: int, name: str, source_file: str
+) -> Optional[ast.AST]:
+    node = parsed.take(lineno, name)
+    if node is None:
+        return None
+    tree = ast.Module(body=[node], type_ignores=[])
+    # columns are one-based, matching `parse_source_lines`
+    return _attach_source_file(tree, source_file, 1)
+
+
+def parse_source_lines(source_lines: List[str], lineno: int, source_file: str) -> ast.AST:
+    """
+    Parse the source lines retrieved by `retrieve_source_and_filename` into an AST
+    whose locations match the original file.
+    """
     src, indent = dedent_and_retrieve_indentation(source_lines)
     tree = increment_lineno_and_col_offset(ast.parse(src), lineno - 1, indent + 1)
-    for child in ast.walk(tree):
-        setattr(child, "source_file", source_file)
-    return tree, source_file
+    return _attach_source_file(tree, source_file, 0)
+
+
+def retrieve_ast_and_filename(f: object) -> Tuple[ast.AST, str]:
+    """
+    Retrieve the AST of `f` (wrapped in a module) and its source file.
+    Each source file is parsed only once as long as it is unchanged on disk.
+    """
+    located = _locate_in_source_file(f)
+    if located is not None:
+        # the source lines are only needed once the definition has been handed out
+        tree = _take_ast(*located)
+        if tree is not None:
+            return tree, located[3]
+    source = retrieve_function_source(f)
+    return source.parse(), source.filename
 
 
 def get_full_name(obj: Any) -> str:
@@ -207,18 +405,37 @@ class NestedHashMap[K, V]:
 
 
 class Lazy[T]:
+    """
+    A lazily constructed value. The factory runs at most once, even when `get` is
+    called from several threads at the same time.
+    """
     _instance: Optional[T]
     _factory: Callable[[], T]
     _initialized: bool
+    _lock: threading.RLock
 
     def __init__(self, factory: Callable[[], T]) -> None:
         self._factory = factory
         self._initialized = False
         self._instance = None
+        self._lock = threading.RLock()
 
     def _init_instance(self):
         if not self._initialized:
-            self._instance = self._factory()
+            with self._lock:
+                if not self._initialized:
+                    self._instance = self._factory()
+                    self._initialized = True
+
+    def is_initialized(self) -> bool:
+        return self._initialized
+
+    def set(self, value: T) -> None:
+        """
+        Provide the value directly, the factory will never run.
+        """
+        with self._lock:
+            self._instance = value
             self._initialized = True
 
     def get(self) -> T:
@@ -240,8 +457,14 @@ def inherit[T](cls: type[T], parent: Any, init_fn: Callable[..., None]) -> type[
         if original_init:
             original_init(self, *args, **kwargs, __lc_ctx__=__lc_ctx__)
 
-    # Copy attributes and override __init__
+    if original_init:
+        setattr(new_init, "__wrapped__", original_init)
+
+    # Copy attributes and override __init__, the `__dict__` and `__weakref__` descriptors
+    # belong to `cls` and would shadow the ones of the new class
     attrs = dict(cls.__dict__)
+    attrs.pop("__dict__", None)
+    attrs.pop("__weakref__", None)
     attrs["__init__"] = new_init
 
     # Construct new type with parent + original bases
@@ -284,6 +507,65 @@ def check_type(pat: Any, obj: Any) -> bool:
         return isinstance(obj, origin) and all(isinstance(o, a) for o, a in zip(obj, args))
     return False
 
+def _is_type_only_pattern(pat: Any) -> bool:
+    """
+    Whether `check_type(pat, obj)` depends only on `type(obj)`.
+    """
+    if isinstance(pat, (type, tuple)):
+        return True
+    if getattr(pat, "__origin__", None) is Union or isinstance(pat, types.UnionType):  # type: ignore
+        return all(_is_type_only_pattern(arg) for arg in getattr(pat, "__args__", ()))
+    return False
+
+
+class TypePattern:
+    """
+    A type pattern compiled into a predicate equivalent to `check_type(pattern, obj)`.
+    For patterns that only depend on the type of `obj`, the result is memoized per exact type,
+    so that subclasses (and anything else that needs the MRO) are only resolved once.
+    """
+    __slots__ = ("pattern", "_type_only", "_accepts")
+    pattern: Any
+    _type_only: bool
+    _accepts: Dict[type, bool]
+
+    def __init__(self, pattern: Any) -> None:
+        self.pattern = pattern
+        self._type_only = _is_type_only_pattern(pattern)
+        self._accepts = {}
+
+    def __call__(self, obj: Any) -> bool:
+        if not self._type_only:
+            return check_type(self.pattern, obj)
+        t = type(obj)
+        accepted = self._accepts.get(t)
+        if accepted is None:
+            accepted = self._accepts[t] = check_type(self.pattern, obj)
+        return accepted
+
+    def __repr__(self) -> str:
+        return repr(self.pattern)
+
+
+_TYPE_PATTERNS: Dict[Any, TypePattern] = {}
+
+
+def compile_type_pattern(pat: Any) -> TypePattern:
+    """
+    Compile `pat` (see `check_type`) into a `TypePattern`, which is shared by equal patterns.
+    """
+    if isinstance(pat, TypePattern):
+        return pat
+    try:
+        compiled = _TYPE_PATTERNS.get(pat)
+    except TypeError:
+        # unhashable patterns cannot be shared
+        return TypePattern(pat)
+    if compiled is None:
+        compiled = _TYPE_PATTERNS.setdefault(pat, TypePattern(pat))
+    return compiled
+
+
 class IdentityDict[K, V]:
     """
     A dictionary that uses the identity of the keys as the hash.
@@ -0,0 +1,54 @@
+"""
+Trace a kernel consisting of a chain of 10k binary operations and report the time spent tracing.
+
+Usage: python scripts/bench_dispatch.py [num_ops]
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import luisa_lang as lc
+from luisa_lang import classinfo
+from luisa_lang.lang_runtime import KernelTracer, TraceContext
+
+
+def generate_kernel(num_ops: int):
+    ops = ["+", "*", "-", "<"]
+    lines = ["import luisa_lang as lc", "@lc.func", "def chain(x, y):"]
+    for i in range(num_ops):
+        op = ops[i % len(ops)]
+        if op == "<":
+            lines.append("    c = x < y")
+        else:
+            lines.append(f"    x = x {op} y")
+    lines.append("    return x")
+    path = os.path.join(tempfile.mkdtemp(), "dispatch_chain.py")
+    with open(path, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+    spec = importlib.util.spec_from_file_location("dispatch_chain", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.chain
+
+
+def main() -> None:
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    chain = generate_kernel(num_ops)
+    # rewrite the function outside of the measurement
+    lc.prewarm(chain)
+    x, y = lc.f32(1.0), lc.f32(2.0)
+    with KernelTracer(classinfo._get_func_globalns(chain)):
+        trace_ctx = TraceContext(True)
+        t = time.perf_counter()
+        chain(x, y, __lc_ctx__=trace_ctx)
+        elapsed = time.perf_counter() - t
+    assert trace_ctx.top_level_func is not None
+    print(f"traced {num_ops} ops in {elapsed * 1e3:.1f} ms ({elapsed / num_ops * 1e6:.2f} us/op)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Trace a kernel consisting of a chain of binary operations and report the memory held by the
+resulting HIR, measured with tracemalloc.
+
+Usage: python scripts/bench_memory.py [num_ops] [max_bytes_per_node]
+
+If `max_bytes_per_node` is given, exits with a non-zero status when it is exceeded.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import luisa_lang as lc
+from luisa_lang import classinfo, hir
+from luisa_lang.lang_runtime import KernelTracer, TraceContext
+
+from bench_dispatch import generate_kernel
+
+
+NESTED_BLOCKS = ("prepare", "body", "update", "then_body", "else_body", "merge")
+
+
+def count_nodes(bb: hir.BasicBlock) -> int:
+    count = 0
+    for node in bb.nodes():
+        count += 1
+        for name in NESTED_BLOCKS:
+            child = getattr(node, name, None)
+            if isinstance(child, hir.BasicBlock):
+                count += count_nodes(child)
+    return count
+
+
+def main() -> None:
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    max_bytes_per_node = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    chain = generate_kernel(num_ops)
+    # rewrite the function outside of the measurement
+    lc.prewarm(chain)
+    x, y = lc.f32(1.0), lc.f32(2.0)
+    tracemalloc.start()
+    with KernelTracer(classinfo._get_func_globalns(chain)):
+        trace_ctx = TraceContext(True)
+        t = time.perf_counter()
+        chain(x, y, __lc_ctx__=trace_ctx)
+        elapsed = time.perf_counter() - t
+    func = trace_ctx.top_level_func
+    assert func is not None
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_nodes = count_nodes(func.body)
+    print(f"traced {num_ops} ops into {num_nodes} nodes in {elapsed * 1e3:.1f} ms")
+    print(f"retained: {current / 2**20:8.2f} MiB ({current / num_nodes:6.1f} bytes/node)")
+    print(f"    peak: {peak / 2**20:8.2f} MiB ({peak / num_nodes:6.1f} bytes/node)")
+    if max_bytes_per_node is not None and current / num_nodes > max_bytes_per_node:
+        print(f"retained memory exceeds {max_bytes_per_node} bytes/node")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
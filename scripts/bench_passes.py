@@ -0,0 +1,165 @@
+"""
+Compile ray-tracing-style kernels at each optimization level and report the C++ statements
+and bytes emitted for each, along with the time and node-count changes of each pass.
+
+Usage: python scripts/bench_passes.py
+"""
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import luisa_lang as lc
+from luisa_lang.compile import Compiler
+
+
+@lc.pytree
+class Ray:
+    o: lc.float3
+    d: lc.float3
+    t_max: lc.f32
+
+    @lc.trace
+    def at(self, t):
+        return self.o + self.d * t
+
+
+@lc.pytree
+class AABB:
+    lo: lc.float3
+    hi: lc.float3
+
+    @lc.trace
+    def size(self):
+        return self.hi - self.lo
+
+    @lc.trace
+    def center(self):
+        return self.lo + self.size() * 0.5
+
+    @lc.trace
+    def half_area(self, inv_d):
+        return self.size() * inv_d
+
+    @lc.trace
+    def slab_near(self, ray, inv_d):
+        return (self.lo - ray.o) * inv_d
+
+    @lc.trace
+    def slab_far(self, ray, inv_d):
+        return (self.hi - ray.o) * inv_d
+
+
+@lc.func
+def shade(box, ray, inv_d, t):
+    t0 = box.slab_near(ray, inv_d)
+    t1 = box.slab_far(ray, inv_d)
+    p = ray.at(t)
+    local = (p - box.center()) / box.size()
+    cost = box.half_area(inv_d)
+    if t < ray.t_max:
+        near = ray.at(t) - box.center()
+        cost = cost + near * box.size() + (t1 - t0)
+        t = t * 0.5
+    return local + cost + ray.at(t) + box.center() + (t1 - t0)
+
+
+@lc.func
+def falloff(light, dist, roughness):
+    d2 = dist * dist
+    spread = roughness * roughness
+    return light.hi / d2
+
+
+@lc.func
+def direct(box, ray, dist, roughness):
+    unused = box.center()
+    e = falloff(box, dist, roughness)
+    glossy = e * roughness
+    return e + ray.d
+
+
+@lc.func
+def tint(ray, t, absorb):
+    w = lc.float3(t, absorb, t)
+    c = ray.d * w
+    c = c + w
+    return c
+
+
+@lc.func
+def schlick(cos_t, f0):
+    m = cos_t * 0.5 + 0.5
+    m2 = m * m
+    return f0 + (f0 * 0.5 + 0.5) * (m2 * m2 * m)
+
+
+@lc.func
+def fresnel(cos_i, cos_o, f0):
+    fi = schlick(cos_i, f0)
+    fo = schlick(cos_o, f0)
+    return fi * fo
+
+
+_FUNC_BEGIN = re.compile(r"^(__lc_\w+__ (inline )?)?auto \w+\(.*\) -> .* \{$")
+
+
+def function_bodies(code: str) -> List[str]:
+    """
+    The generated functions in `code`, without the prelude.
+    """
+    bodies: List[str] = []
+    current: List[str] | None = None
+    for line in code.splitlines():
+        if current is None:
+            if _FUNC_BEGIN.match(line):
+                current = [line]
+        else:
+            current.append(line)
+            if line == "}":
+                bodies.append("\n".join(current))
+                current = None
+    return bodies
+
+
+def count_statements(body: str) -> int:
+    return sum(1 for line in body.splitlines() if line.rstrip().endswith(";"))
+
+
+def main() -> None:
+    f3 = lc.float3(0.0, 0.0, 0.0)
+    box, ray = AABB(f3, f3), Ray(f3, f3, lc.f32(1.0))
+    kernels: List[Tuple[Callable[..., Any], Tuple[Any, ...]]] = [
+        (shade, (box, ray, f3, lc.f32(0.5))),
+        (direct, (box, ray, lc.f32(2.0), lc.f32(0.5))),
+        (tint, (ray, lc.f32(0.5), lc.f32(0.25))),
+        (fresnel, (lc.f32(0.5), lc.f32(0.25), lc.f32(0.04))),
+    ]
+    for kernel, inputs in kernels:
+        print(f"{kernel.__name__}:")
+        statements: Dict[int, int] = {}
+        sizes: Dict[int, int] = {}
+        for opt_level in (0, 1, 2):
+            compiler = Compiler("cpp", opt_level=opt_level)
+            compiler.compile(kernel, inputs)
+            bodies = function_bodies(compiler.output())
+            statements[opt_level] = sum(count_statements(body) for body in bodies)
+            sizes[opt_level] = sum(len(body) for body in bodies)
+            print(f"  -O{opt_level}: {statements[opt_level]:4d} statements, {sizes[opt_level]:6d} bytes")
+        for opt_level in (1, 2):
+            reduction = 1 - statements[opt_level] / statements[0]
+            removed = sizes[0] - sizes[opt_level]
+            print(
+                f"  -O{opt_level} emits {reduction:.1%} fewer statements than -O0, "
+                f"{removed} bytes of C++ removed"
+            )
+    print()
+    compiler = Compiler("cpp", opt_level=2)
+    for kernel, inputs in kernels:
+        compiler.compile(kernel, inputs)
+    print(compiler.pass_manager.report())
+
+
+if __name__ == "__main__":
+    main()
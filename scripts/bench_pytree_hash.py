@@ -0,0 +1,61 @@
+"""
+Measure template lookups keyed by the structure of 1000-leaf pytrees: building the structure of
+the arguments (once through `tree_flatten`/`structure`/`collect_jitvars` and once in a single
+pass), and finding the instantiation for it in a template cache that already holds
+instantiations for all permutations of the leaf types.
+
+Usage: python scripts/bench_pytree_hash.py [num_leaves] [num_lookups]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.lang_runtime import tree_flatten, tree_structure
+
+
+def make_tree(num_leaves: int, shift: int):
+    # nested tuples of f32/i32 leaves, shifting the pattern permutes the leaf types
+    leaves = [lc.f32(0.0) if (i + shift) % 2 == 0 else lc.i32(0) for i in range(num_leaves)]
+    return tuple(tuple(leaves[i : i + 10]) for i in range(0, num_leaves, 10))
+
+
+def template_args_three_pass(tree) -> hir.FunctionTemplateArgs:
+    flattened = tree_flatten(tree, False)
+    flattened.collect_jitvars()
+    return hir.FunctionTemplateArgs(args=[flattened.structure()])
+
+
+def template_args(tree) -> hir.FunctionTemplateArgs:
+    return hir.FunctionTemplateArgs(args=[tree_structure(tree, [], False)])
+
+
+def main() -> None:
+    num_leaves = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    trees = [make_tree(num_leaves, shift) for shift in range(2)]
+    template = hir.Template(hir.FunctionTemplateArgs, lambda args: object())
+    keys = [template_args(tree) for tree in trees]
+    for key in keys:
+        template.instantiate(key)
+    print(f"distinct hashes of {len(keys)} permuted structures: {len(set(hash(k) for k in keys))}")
+
+    for name, build in (("three-pass structure", template_args_three_pass), ("single-pass structure", template_args)):
+        t = time.perf_counter()
+        for i in range(num_lookups):
+            build(trees[i % 2])
+        elapsed = time.perf_counter() - t
+        print(f"{name:>21}: {elapsed / num_lookups * 1e6:8.1f} us/call")
+
+    args_list = [template_args(trees[i % 2]) for i in range(num_lookups)]
+    t = time.perf_counter()
+    for args in args_list:
+        template.instantiate(args)
+    elapsed = time.perf_counter() - t
+    print(f"{'lookup':>21}: {elapsed / num_lookups * 1e6:8.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure how long it takes to retrieve the AST of every @trace method in luisa_lang/math_types.py
+and of every method in a generated module with 300 decorated methods, once by scanning and parsing
+each function separately and once through the per-file AST cache.
+
+Note that math_types.py also contains the pre-rewritten bodies emitted by gen_math_types.py,
+which the per-file cache has to parse as well: there the two approaches take about the same time,
+the cache pays off on modules made of the decorated functions themselves.
+
+Timings are noisy, so each measurement is repeated and the best run is reported.
+
+Usage: python scripts/bench_source_cache.py [repeat]
+"""
+import importlib.util
+import inspect
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sourceinspect
+import luisa_lang.math_types as math_types
+from luisa_lang import utils
+
+
+def collect_trace_methods() -> List[Callable[..., Any]]:
+    funcs = []
+    for cls in vars(math_types).values():
+        if not isinstance(cls, type) or cls.__module__ != math_types.__name__:
+            continue
+        for method in vars(cls).values():
+            # `__init__` is wrapped by `inherit`
+            method = getattr(method, "__wrapped__", method)
+            if callable(method) and hasattr(method, "__luisa_rewritten__"):
+                funcs.append(inspect.getclosurevars(method).nonlocals["f"])
+    return funcs
+
+
+def generate_methods(n: int) -> List[Callable[..., Any]]:
+    lines = ["def deco(f):", "    return f", "class Generated:"]
+    for i in range(n):
+        lines += [
+            "    @deco",
+            f"    def method_{i}(self, x, y):",
+            f"        z = x * {i} + y",
+            "        if z > x:",
+            "            return z - y",
+            "        return z",
+        ]
+    path = os.path.join(tempfile.mkdtemp(), "generated_methods.py")
+    with open(path, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+    spec = importlib.util.spec_from_file_location("generated_methods", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return [getattr(module.Generated, f"method_{i}") for i in range(n)]
+
+
+def per_function(funcs: List[Callable[..., Any]]) -> None:
+    for f in funcs:
+        source_file = sourceinspect.getsourcefile(f) or "<unknown>"
+        source_lines, lineno = sourceinspect.getsourcelines(f)
+        utils.parse_source_lines(source_lines, lineno, source_file)
+
+
+def per_file(funcs: List[Callable[..., Any]]) -> None:
+    utils._parsed_source_files.clear()
+    for f in funcs:
+        utils.retrieve_ast_and_filename(f)
+
+
+def main() -> None:
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for label, funcs in (
+        ("math_types.py @trace methods", collect_trace_methods()),
+        ("generated module", generate_methods(300)),
+    ):
+        print(f"{label}: {len(funcs)} functions")
+        for name, bench in (("per-function parse", per_function), ("per-file AST cache", per_file)):
+            elapsed = float("inf")
+            for _ in range(repeat):
+                t = time.perf_counter()
+                bench(funcs)
+                elapsed = min(elapsed, time.perf_counter() - t)
+            print(f"{name:>22}: {elapsed * 1e3:8.1f} ms total, {elapsed / len(funcs) * 1e6:6.1f} us/function")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
+import ast
+import copy
+import os
+import sys
 from typing import List, Optional
 from enum import Enum
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from luisa_lang.ast_rewrite import FuncRewriter
+
 
 class Kind(Enum):
     BOOL = 0
@@ -40,7 +47,12 @@ def main() -> None:
             + FLOAT_BULTINS_2
         )
 
+        class_lines: Optional[List[str]] = None
+
         def print(s: str) -> None:
+            if class_lines is not None:
+                class_lines.append(s)
+                return
             if s == "":
                 __builtins__.print(file=f)
             lines = s.split("\n")
@@ -49,6 +61,42 @@ def main() -> None:
                     continue
                 __builtins__.print(line, file=f)
 
+        def begin_class() -> None:
+            nonlocal class_lines
+            class_lines = []
+
+        def end_class() -> None:
+            """
+            Emit the buffered class together with the `FuncRewriter` output of its @trace methods,
+            so that `builtin_type` can attach them without retrieving and parsing the source at runtime.
+            The rewritten bodies must be regenerated whenever the rewrite rules change.
+            """
+            nonlocal class_lines
+            assert class_lines is not None
+            src = "\n".join(line for s in class_lines for line in s.split("\n") if line != "")
+            class_lines = None
+            cls = ast.parse(src).body[0]
+            assert isinstance(cls, ast.ClassDef)
+            traced: List[str] = []
+            for node in cls.body:
+                if not isinstance(node, ast.FunctionDef):
+                    continue
+                if not any(isinstance(d, ast.Name) and d.id == "trace" for d in node.decorator_list):
+                    continue
+                rewritten = FuncRewriter("trace", "luisa_lang/math_types.py").visit(copy.deepcopy(node))
+                rewritten.name = f"_traced_{cls.name}_{node.name}"
+                # annotations are only needed on the public methods
+                rewritten.returns = None
+                for arg in rewritten.args.args + rewritten.args.kwonlyargs:
+                    arg.annotation = None
+                print(ast.unparse(ast.fix_missing_locations(rewritten)))
+                traced.append(f"'{node.name}': {rewritten.name}")
+            print(f"_traced_{cls.name} = {{{', '.join(traced)}}}")
+            lines = src.split("\n")
+            assert lines[0].startswith("@builtin_type(") and lines[0].endswith(")")
+            lines[0] = f"{lines[0][:-1]}, traced=_traced_{cls.name})"
+            print("\n".join(lines))
+
         print("# fmt: off")
         print("import typing as tp")
         print(
@@ -63,6 +111,9 @@ def main() -> None:
         print(
             "from luisa_lang.classinfo import register_class",
         )
+        print(
+            "from luisa_lang.utils import compile_type_pattern",
+        )
         print("import luisa_lang.hir as _hir")
         print('IntLiteral = int')
         print('FloatLiteral = float')
@@ -99,7 +150,7 @@ def _literal_to_value(literal, dtype):
                 f"""
     @trace
     def {op}(self, _other: {operand_ty}) -> '{ty}': # type: ignore
-        return __intrinsic_checked__("binop.{op}.{ty}", [{ty}, __escape__({operand_ty.replace('\'','')})], {ty},  {'self' if not inplace else 'Ref(self)'}, _other)
+        return __intrinsic_checked__("binop.{op}.{ty}", __escape__(_{ty}_operand_types), {ty},  {'self' if not inplace else 'Ref(self)'}, _other)
 """
             )
 
@@ -108,7 +159,7 @@ def _literal_to_value(literal, dtype):
                 f"""
     @trace
     def {op}(self, _other: {operand_ty}) -> '{retrun_ty}': # type: ignore
-        return __intrinsic_checked__("cmp.{op}.{ty}", [{ty}, __escape__({operand_ty.replace('\'','')})], {retrun_ty},  self, _other) # type: ignore
+        return __intrinsic_checked__("cmp.{op}.{ty}", __escape__(_{ty}_operand_types), {retrun_ty},  self, _other) # type: ignore
 """
             )
 
@@ -145,6 +196,12 @@ def _literal_to_value(literal, dtype):
                 gen("or")
                 gen("xor")
 
+        def gen_operand_types(ty: str, operand_ty: str):
+            # hoisted out of the operators so that the patterns are built and compiled only once
+            print(
+                f"_{ty}_operand_types = (compile_type_pattern({ty}), compile_type_pattern({operand_ty.strip().replace('\'','')}))"
+            )
+
         def gen_unaryop(op: str, ty: str):
             print(
                 f"""
@@ -167,6 +224,7 @@ def _literal_to_value(literal, dtype):
                 hir_ty = f"_hir.IntType({int(ty[1:])}, {signed})"
             else:
                 hir_ty = "_hir.BoolType()"
+            begin_class()
             print(
                 f"""@builtin_type({hir_ty})
 class {ty}{inherits_str}:
@@ -178,12 +236,15 @@ class {ty}{inherits_str}:
             pass # TODO
 """
             )
-            gen_common_binop(ty, f" tp.Union['{ty}', {literal_ty}]", 'boolean', kind)
+            operand_ty = f" tp.Union['{ty}', {literal_ty}]"
+            gen_common_binop(ty, operand_ty, 'boolean', kind)
             if kind == Kind.FLOAT or kind == Kind.INT:
                 gen_unaryop("neg", ty)
                 gen_unaryop("pos", ty)
             if kind == Kind.INT or kind == Kind.BOOL:
                 gen_unaryop("invert", ty)           
+            end_class()
+            gen_operand_types(ty, operand_ty)
             print("")
 
         def gen_vector_type(ty: str, scalar_ty: str, literal_scalar_ty: str,kind: Kind, mask_ty:str, size: int):
@@ -195,6 +256,7 @@ class {ty}{inherits_str}:
             # if kind == Kind.FLOAT:
             #     inherits.append(f"FloatBuiltin['{ty}']")
             inherits_str = "" if len(inherits) == 0 else f"({', '.join(inherits)})"
+            begin_class()
             print(
                 f"""@builtin_type(_hir.VectorType(tp.cast(_hir.ScalarType, _ctx.types[{scalar_ty}].default()), {size}))
 class {ty}{inherits_str}:
@@ -218,9 +280,10 @@ class {ty}{inherits_str}:
             print('            pass # TODO')
             print("")
 
-            gen_common_binop(
-                ty, f" tp.Union['{ty}', {scalar_ty}, {literal_scalar_ty}]",mask_ty, kind
-            )
+            operand_ty = f" tp.Union['{ty}', {scalar_ty}, {literal_scalar_ty}]"
+            gen_common_binop(ty, operand_ty, mask_ty, kind)
+            end_class()
+            gen_operand_types(ty, operand_ty)
             print("")
 
         def gen_matrix_type(ty:str, vector_ty:str, scalar_ty:str, literal_scalar_ty:str, dim:int):
@@ -0,0 +1,14 @@
+import os
+import shutil
+import tempfile
+
+_cache_dir = tempfile.mkdtemp(prefix="luisa_lang_cache_")
+
+
+def pytest_configure(config):
+    # keep the rewrite cache out of the developer's home directory, worker processes inherit it
+    os.environ["LUISA_LANG_CACHE_DIR"] = _cache_dir
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_cache_dir, ignore_errors=True)
@@ -0,0 +1,126 @@
+import importlib.util
+import tracemalloc
+
+import luisa_lang as lc
+from luisa_lang import classinfo, hir
+from luisa_lang.compile import Compiler
+from luisa_lang.lang_runtime import KernelTracer, TraceContext
+
+
+@lc.func
+def chain(x, y):
+    z = x * y + x
+    return z * z - y
+
+
+def make_block(n: int) -> tuple[hir.BasicBlock, list[hir.Node]]:
+    bb = hir.BasicBlock()
+    nodes: list[hir.Node] = [bb.append(hir.Constant(i, hir.IntType(32, True))) for i in range(n)]
+    return bb, nodes
+
+
+def test_insert_and_remove():
+    bb, (a, b, c) = make_block(3)
+    d = b.append(hir.Unit())
+    e = a.prepend(hir.Unit())
+    assert bb.nodes() == [e, a, b, d, c]
+    b.remove()
+    assert b.block is None and b.prev is None and b.next is None
+    assert bb.nodes() == [e, a, d, c]
+    assert (bb.head, bb.tail) == (e, c)
+    assert (d.prev, d.next) == (a, c)
+    c.remove()
+    e.remove()
+    assert (bb.head, bb.tail, bb.num_nodes()) == (a, d, 2)
+
+
+def test_mutation_during_iteration():
+    bb, nodes = make_block(100)
+    kept = nodes[1::10]
+    visited = []
+    inserted = []
+    for node in bb:
+        visited.append(node)
+        if node is nodes[51]:
+            inserted.append(node.prepend(hir.Unit()))
+            inserted.append(node.append(hir.Unit()))
+        elif not any(node is k for k in kept + inserted):
+            node.remove()
+    # removing a node does not compact the block under the iterator
+    expected = nodes[:52] + inserted[1:] + nodes[52:]
+    assert len(visited) == len(expected) and all(a is b for a, b in zip(visited, expected))
+    expected = kept[:5] + [inserted[0], nodes[51], inserted[1]] + kept[6:]
+    remaining = bb.nodes()
+    assert len(remaining) == len(expected) and all(a is b for a, b in zip(remaining, expected))
+    for node in remaining[1:]:
+        assert node.prev is not None and node.prev.next is node
+
+
+def test_walking_a_block_does_not_allocate():
+    bb, _ = make_block(10000)
+    tracemalloc.start()
+    try:
+        for _ in bb:
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 4096
+
+
+def test_traced_nodes_stay_small(tmp_path):
+    # a chain of binary operations, as in scripts/bench_memory.py
+    lines = ["import luisa_lang as lc", "@lc.func", "def long_chain(x, y):"]
+    lines += [f"    x = x {'+*-'[i % 3]} y" for i in range(2000)]
+    lines.append("    return x")
+    path = tmp_path / "long_chain.py"
+    path.write_text("\n".join(lines) + "\n")
+    spec = importlib.util.spec_from_file_location("long_chain", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    lc.prewarm(module.long_chain)
+    x, y = lc.f32(1.0), lc.f32(2.0)
+    tracemalloc.start()
+    try:
+        with KernelTracer(classinfo._get_func_globalns(module.long_chain)):
+            trace_ctx = TraceContext(True)
+            module.long_chain(x, y, __lc_ctx__=trace_ctx)
+        func = trace_ctx.top_level_func
+        assert func is not None
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    num_nodes = len(func.body.nodes())
+    assert num_nodes >= 4000
+    # about 157 bytes per node with __slots__ on the HIR classes, 182 without them
+    assert retained / num_nodes < 170
+
+
+def test_use_lists():
+    i32 = hir.IntType(32, True)
+    bb, (a, b) = make_block(2)
+    assert isinstance(a, hir.Value) and isinstance(b, hir.Value)
+    add = bb.append(hir.Intrinsic("binop.__add__", [a, b], i32))
+    mul = bb.append(hir.Intrinsic("binop.__mul__", [add, add], i32))
+    # nodes outside of basic blocks are not users
+    hir.Intrinsic("unary.__neg__", [a], i32)
+    assert a.uses == [add] and add.uses == [mul, mul]
+
+    add.replace_all_uses_with(b)
+    assert mul.args == [b, b] and add.num_uses() == 0
+    assert b.uses == [add, mul, mul]
+    mul.remove()
+    assert b.uses == [add]
+    add.remove()
+    assert a.num_uses() == b.num_uses() == 0
+
+
+def test_traced_use_lists_are_consistent():
+    func = Compiler._trace(chain, (lc.f32(1.0), lc.f32(2.0)), None)
+    for node in func.body:
+        for operand in node.operands():
+            assert any(user is node for user in operand.uses)
+        if isinstance(node, hir.TypedNode):
+            for user in node.uses:
+                assert user.block is func.body
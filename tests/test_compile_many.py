@@ -0,0 +1,109 @@
+import re
+import threading
+import time
+
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+
+
+@lc.func
+def square(x):
+    return x * x
+
+
+@lc.func
+def sum_of_squares(a, b):
+    return square(a) + square(b)
+
+
+@lc.func
+def diff_of_squares(a, b):
+    return square(a) - square(b)
+
+
+@lc.func(inline="never")
+def scale(x, k):
+    return x * k
+
+
+@lc.func
+def scale_twice(a):
+    return scale(a, 2.0) + scale(a, 3.0)
+
+
+@lc.func
+def scale_thrice(a):
+    return scale(a, 3.0)
+
+
+def test_comptime_instantiations_are_kept_apart():
+    compiler = Compiler("cpp")
+    compiler.compile(scale_twice, (lc.f32(1.0),))
+    output = compiler.output()
+    # both instantiations have the same signature
+    assert len(re.findall(r"auto scale_[0-9A-F]", output)) == 2
+    assert "__arg_0 * 2.0f" in output and "__arg_0 * 3.0f" in output
+    parallel = Compiler("cpp")
+    parallel.compile_many(
+        [(scale_twice, (lc.f32(1.0),), None), (scale_thrice, (lc.f32(1.0),), None)],
+        max_workers=2,
+        processes=True,
+    )
+    assert len(re.findall(r"auto scale_[0-9A-F]", parallel.output())) == 2
+
+
+def test_compile_many_matches_compile():
+    jobs = [
+        (sum_of_squares, (lc.f32(1.0), lc.f32(2.0)), None),
+        (diff_of_squares, (lc.f32(1.0), lc.f32(2.0)), None),
+        (sum_of_squares, (lc.i32(1), lc.i32(2)), None),
+    ]
+    sequential = Compiler("cpp")
+    for f, example_inputs, example_kwargs in jobs:
+        sequential.compile(f, example_inputs, example_kwargs)
+    parallel = Compiler("cpp")
+    parallel.compile_many(jobs, max_workers=4)
+    assert parallel.output() == sequential.output()
+
+
+def test_template_instantiates_each_key_once():
+    calls = []
+
+    def instantiate(args: int) -> str:
+        calls.append(args)
+        time.sleep(0.01)
+        return f"inst_{args}"
+
+    template = hir.Template(int, instantiate)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def worker(i: int) -> None:
+        barrier.wait()
+        results.append(template.instantiate(i % 2))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(calls) == [0, 1]
+    assert sorted(results) == ["inst_0"] * 4 + ["inst_1"] * 4
+
+
+def test_compile_many_processes_matches_compile():
+    jobs = [
+        (sum_of_squares, (lc.f32(1.0), lc.f32(2.0)), None),
+        (diff_of_squares, (lc.f32(1.0), lc.f32(2.0)), None),
+        (sum_of_squares, (lc.i32(1), lc.i32(2)), None),
+    ]
+    sequential = Compiler("cpp")
+    for f, example_inputs, example_kwargs in jobs:
+        sequential.compile(f, example_inputs, example_kwargs)
+    parallel = Compiler("cpp")
+    parallel.compile_many(jobs, max_workers=2, processes=True)
+    output = parallel.output()
+    assert output == sequential.output()
+    # the f32 `square` is generated by two workers but emitted once
+    assert output.count("auto square_") == 2
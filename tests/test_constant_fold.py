@@ -0,0 +1,122 @@
+import math
+
+import pytest
+
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.lang_runtime import __intrinsic__
+from luisa_lang.passes import ConstantFold, fold_intrinsic
+
+f16, f32, f64 = hir.FloatType(16), hir.FloatType(32), hir.FloatType(64)
+i8, i32, u32 = hir.IntType(8, True), hir.IntType(32, True), hir.IntType(32, False)
+boolean = hir.BoolType()
+
+QUARTER = hir.Constant(0.25, f32)
+
+
+@lc.func
+def scale(x):
+    c = __intrinsic__("binop.__mul__.f32", lc.f32, QUARTER, 2.0)
+    return x * c + 1.0
+
+
+@lc.func
+def halve(v):
+    return v * 0.5
+
+
+@lc.func
+def add_300(x):
+    return x + 300
+
+
+@lc.func
+def add_2_pow_40(x):
+    return x + 2**40
+
+
+def fold(name: str, ret_type: hir.Type, *args: hir.Constant):
+    c = fold_intrinsic(name, list(args), ret_type)
+    return None if c is None else c.value
+
+
+def test_float_rounding():
+    # 0.1 + 0.2 rounded to f32 after each step, as on the device
+    a, b = hir.Constant(0.1, f32), hir.Constant(0.2, f32)
+    assert fold("binop.__add__.f32", f32, a, b) == 0.30000001192092896
+    assert fold("binop.__add__.f64", f64, hir.Constant(0.1, f64), hir.Constant(0.2, f64)) == 0.1 + 0.2
+    assert fold("binop.__mul__.f16", f16, hir.Constant(0.1, f16), hir.Constant(3.0, f16)) == 0.2998046875
+    assert fold("math.sqrt", f32, hir.Constant(2.0, f32)) == 1.4142135381698608
+    assert fold("binop.__rsub__.f32", f32, hir.Constant(1.0, f32), hir.Constant(3.0, f32)) == 2.0
+    assert fold("cmp.__lt__.f32", boolean, a, b) is True
+    assert math.copysign(1.0, fold("unary.__neg__.f32", f32, hir.Constant(0.0, f32))) == -1.0
+
+
+def test_unfoldable():
+    one, zero = hir.Constant(1.0, f32), hir.Constant(0.0, f32)
+    # division by zero, overflow, inexact math functions and out of range conversions
+    assert fold("binop.__truediv__.f32", f32, one, zero) is None
+    assert fold("binop.__mul__.f32", f32, hir.Constant(1e30, f32), hir.Constant(1e30, f32)) is None
+    assert fold("math.sin", f32, one) is None
+    assert fold("cast.i8", i8, hir.Constant(300.0, f32)) is None
+    assert fold("binop.__mod__.i32", i32, hir.Constant(-7, i32), hir.Constant(2, i32)) is None
+    assert fold("binop.__lshift__.i32", i32, hir.Constant(1, i32), hir.Constant(32, i32)) is None
+
+
+def test_integer_wrapping():
+    assert fold("binop.__add__.i8", i8, hir.Constant(127, i8), hir.Constant(1, i8)) == -128
+    assert fold("binop.__sub__.u32", u32, hir.Constant(0, u32), hir.Constant(1, u32)) == 2**32 - 1
+    assert fold("unary.__invert__.u32", u32, hir.Constant(0, u32)) == 2**32 - 1
+    assert fold("binop.__lshift__.i32", i32, hir.Constant(1, i32), hir.Constant(31, i32)) == -(2**31)
+    assert fold("binop.__floordiv__.i32", i32, hir.Constant(7, i32), hir.Constant(2, i32)) == 3
+    assert fold("cast.i32", i32, hir.Constant(-2.75, f32)) == -2
+    assert fold("cast.f32", f32, hir.Constant(2**24 + 1, i32)) == 2**24
+
+
+def test_folding_at_trace_time():
+    func = Compiler._trace(scale, (lc.f32(1.0),), None)
+    intrinsics = [node.name for node in func.body if isinstance(node, hir.Intrinsic)]
+    assert intrinsics == ["binop.__mul__.f32", "binop.__add__.f32"]
+    assigned = [node.value for node in func.body if isinstance(node, hir.Assign)]
+    assert any(isinstance(v, hir.Constant) and v.value == 0.5 for v in assigned)
+
+
+def test_literals_take_the_vector_element_type():
+    func = Compiler._trace(halve, (lc.float3(1.0, 2.0, 3.0),), None)
+    (mul,) = [node for node in func.body if isinstance(node, hir.Intrinsic)]
+    literal = mul.args[1]
+    assert isinstance(literal, hir.Constant) and literal.type == f32 and literal.value == 0.5
+
+
+def test_out_of_range_int_literals_are_rejected():
+    for f, arg in ((add_300, lc.u8(1)), (add_300, lc.i8(1)), (add_2_pow_40, lc.i32(1))):
+        with pytest.raises(ValueError, match="out of the range"):
+            Compiler._trace(f, (arg,), None)
+    func = Compiler._trace(add_300, (lc.i32(1),), None)
+    (add,) = [node for node in func.body if isinstance(node, hir.Intrinsic)]
+    literal = add.args[1]
+    assert isinstance(literal, hir.Constant) and literal.type == i32 and literal.value == 300
+
+
+def test_constant_fold_pass():
+    x = hir.Var("x", f32, None)
+    body = hir.BasicBlock()
+    a = body.append(hir.Intrinsic("binop.__mul__.f32", [hir.Constant(3.0, f32), hir.Constant(0.5, f32)], f32))
+    b = body.append(hir.Intrinsic("unary.__neg__.f32", [a], f32))
+    c = body.append(hir.Intrinsic("binop.__add__.f32", [hir.VarValue(x), b], f32))
+    body.append(hir.Return(c))
+    func = hir.Function("f", [x], [x], body, lc.f32, f32)
+    assert ConstantFold().run(func)
+    assert body.nodes()[0] is c
+    folded = c.args[1]
+    assert isinstance(folded, hir.Constant) and folded.value == -1.5
+    assert not ConstantFold().run(func)
+
+
+def test_folded_constants_are_emitted_exactly():
+    compiler = Compiler("cpp", opt_level=1)
+    compiler.compile(scale, (lc.f32(1.0),))
+    code = compiler.output()
+    # `c` is promoted, the folded constant is emitted where it is read
+    assert "__arg_0 * 0.5f;" in code and "+ 1.0f;" in code
@@ -0,0 +1,60 @@
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.passes import DCE, PassManager
+from luisa_lang.passes.utils import calls
+
+f32 = hir.FloatType(32)
+
+
+# kept out of line, the output shows the call to the pruned copy
+@lc.func(inline="never")
+def attenuate(color, dist, roughness):
+    d2 = dist * dist
+    spread = roughness * roughness
+    return color / d2
+
+
+@lc.func
+def shade(color, dist, roughness):
+    e = attenuate(color, dist, roughness)
+    glossy = e * roughness
+    return e + color
+
+
+def test_unused_values_stores_and_locals():
+    traced = Compiler._trace(shade, (lc.f32(1.0), lc.f32(2.0), lc.f32(0.5)), None)
+    # callees are optimized before their callers
+    func = PassManager([DCE()]).run(traced)
+    assert [v.name for v in func.locals if v not in func.params] == ["e"]
+    # the entry keeps its signature, the callee loses the parameter it does not use
+    assert len(func.params) == 3
+    (call,) = calls(func)
+    assert [p.name for p in call.op.params] == ["__arg_0", "__arg_1"]
+    assert [v.name for v in call.op.locals] == ["__arg_0", "__arg_1", "d2"]
+    assert len(call.args) == 2
+    assert not DCE().run(func)
+
+
+def test_side_effects_are_kept():
+    x, y = hir.Var("x", f32, None), hir.Var("y", f32, None)
+    body = hir.BasicBlock()
+    pure = body.append(hir.Intrinsic("binop.__mul__.f32", [hir.VarRef(x), hir.VarRef(x)], f32))
+    write = body.append(hir.Intrinsic("binop.__iadd__.f32", [hir.VarRef(y), hir.VarRef(x)], f32))
+    unknown = body.append(hir.Intrinsic("my.custom.op", [hir.VarRef(x)], f32))
+    store = body.append(hir.Assign(hir.VarRef(y), hir.VarValue(x)))
+    body.append(hir.Return(hir.VarValue(x)))
+    func = hir.Function("f", [x], [x, y], body, lc.f32, f32)
+    assert DCE().run(func)
+    assert pure.block is None
+    for node in (write, unknown, store):
+        assert node.block is body
+    assert func.locals == [x, y]
+
+
+def test_output():
+    compiler = Compiler("cpp", opt_level=1)
+    compiler.compile(shade, (lc.f32(1.0), lc.f32(2.0), lc.f32(0.5)))
+    code = compiler.output()
+    assert "spread" not in code and "glossy" not in code
+    assert "(__arg_0,__arg_1);" in code
@@ -0,0 +1,102 @@
+import pytest
+import luisa_lang as lc
+
+
+@lc.trace
+def traced_add(a, b):
+    return a + b
+
+
+@lc.func
+def func_mul(a, b):
+    return a * b
+
+
+def test_trace_rewrites_lazily():
+    rewritten = getattr(traced_add, "__luisa_rewritten__")
+    assert not rewritten.is_initialized()
+
+
+def test_prewarm_functions():
+    lc.prewarm(traced_add, func_mul)
+    assert getattr(traced_add, "__luisa_rewritten__").is_initialized()
+    original = getattr(func_mul, "__luisa_original_func__")
+    assert getattr(original, "__luisa_func__").is_initialized()
+
+
+@lc.struct
+class Segment:
+    a: lc.f32
+    b: lc.f32
+
+    @lc.trace
+    def length(self):
+        return self.b - self.a
+
+    @lc.trace
+    def midpoint(self):
+        return (self.a + self.b) * 0.5
+
+
+def test_prewarm_class_in_background():
+    # unlike the builtin types, user classes do not ship rewritten methods
+    rewritten = [getattr(m, "__luisa_rewritten__") for m in (Segment.length, Segment.midpoint)]
+    assert not any(r.is_initialized() for r in rewritten)
+    thread = lc.prewarm(Segment, background=True)
+    assert thread is not None
+    thread.join()
+    assert all(r.is_initialized() for r in rewritten)
+
+
+def test_builtin_types_ship_rewritten_methods():
+    assert getattr(lc.float3.__mul__, "__luisa_rewritten__").is_initialized()
+    init = getattr(lc.u32.__init__, "__wrapped__")
+    assert getattr(init, "__luisa_rewritten__").is_initialized()
+
+
+@lc.struct
+class LazyPoint:
+    x: lc.f32
+    y: lc.f32
+
+
+def test_struct_typeinfo_is_built_on_first_instantiation():
+    from luisa_lang import classinfo, hir
+
+    before = classinfo.materialized_class_count()
+    ty = hir.get_dsl_type(LazyPoint).default()
+    assert isinstance(ty, hir.StructType)
+    assert sorted(name for name, _ in ty.fields) == ["x", "y"]
+    assert classinfo.materialized_class_count() == before + 1
+    hir.get_dsl_type(LazyPoint).default()
+    assert classinfo.materialized_class_count() == before + 1
+
+
+def _struct_in_module(module_name: str, field_type: str) -> type:
+    import sys
+    import types
+
+    module = types.ModuleType(module_name)
+    sys.modules[module_name] = module
+    exec(
+        f"import luisa_lang as lc\n@lc.struct\nclass Pair:\n    a: lc.{field_type}\n    b: lc.{field_type}\n",
+        module.__dict__,
+    )
+    return module.Pair
+
+
+def test_structs_with_the_same_qualname_in_different_modules():
+    from luisa_lang import hir
+    from luisa_lang.codegen.cpp import TypeCodeGenCache
+
+    first = hir.get_dsl_type(_struct_in_module("_decor_test_a", "f32")).default()
+    second = hir.get_dsl_type(_struct_in_module("_decor_test_b", "i32")).default()
+    assert isinstance(first, hir.StructType) and isinstance(second, hir.StructType)
+    assert first.name != second.name
+    cache = TypeCodeGenCache()
+    assert cache.gen(first) != cache.gen(second)
+    assert len(cache.definitions) == 2
+    # a name shared by two layouts must not silently keep the first one
+    clash = hir.StructType(first.name, "Pair", second.fields)
+    with pytest.raises(AssertionError):
+        cache.gen(clash)
@@ -0,0 +1,19 @@
+import luisa_lang as lc
+from luisa_lang import lang_runtime
+from luisa_lang.compile import Compiler
+
+
+@lc.func
+def mixed(a, b):
+    k = 1 + 2
+    c = a * b
+    return c - a
+
+
+def test_dispatch_python_and_dsl_operands():
+    compiler = Compiler("cpp")
+    compiler.compile(mixed, example_inputs=(lc.f32(1.0), lc.f32(3.0)), name="mixed")
+    output = compiler.output()
+    assert "__arg_0 * __arg_1" in output
+    assert ("Mult", lc.f32, lc.f32) in lang_runtime._BINARY_DISPATCH_CACHE
+    assert lang_runtime._BINARY_DISPATCH_CACHE[("Add", int, int)][1] == lang_runtime._DISPATCH_PYTHON
@@ -0,0 +1,87 @@
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.passes import GVN, Effect, intrinsic_effect
+from luisa_lang.passes.utils import blocks, clone_function
+
+f32 = hir.FloatType(32)
+
+
+@lc.pytree
+class Interval:
+    lo: lc.f32
+    hi: lc.f32
+
+    @lc.trace
+    def size(self):
+        return self.hi - self.lo
+
+
+@lc.func
+def overlap(a, t):
+    s = a.size() * a.size()
+    if t < a.size():
+        t = t + 1.0
+        s = s + a.size()
+    return s + (t + 1.0) + (t + 1.0)
+
+
+def intrinsics(func: hir.Function, name: str) -> list[hir.Intrinsic]:
+    return [n for bb in blocks(func) for n in bb if isinstance(n, hir.Intrinsic) and n.name == name]
+
+
+def test_redundant_intrinsics_are_removed():
+    traced = Compiler._trace(overlap, (Interval(lc.f32(0.0), lc.f32(1.0)), lc.f32(2.0)), None)
+    func = clone_function(traced)
+    assert len(intrinsics(func, "binop.__sub__.f32")) == 4
+    assert len(intrinsics(func, "binop.__add__.f32")) == 6
+    assert GVN().run(func)
+    (size,) = intrinsics(func, "binop.__sub__.f32")
+    assert size.block is func.body
+    # `t` is assigned in the branch, so `t + 1.0` after it is not the one in the branch
+    assert len(intrinsics(func, "binop.__add__.f32")) == 5
+    assert not GVN().run(func)
+
+
+def square(var: hir.Var) -> hir.Intrinsic:
+    return hir.Intrinsic("binop.__mul__.f32", [hir.VarRef(var), hir.VarRef(var)], f32)
+
+
+def test_loops():
+    x = hir.Var("x", f32, None)
+    body = hir.BasicBlock()
+    before = body.append(square(x))
+    prepare, loop_body, merge = hir.BasicBlock(), hir.BasicBlock(), hir.BasicBlock()
+    in_prepare = prepare.append(square(x))
+    cond = prepare.append(hir.Intrinsic("cmp.__lt__.f32", [in_prepare, before], hir.BoolType()))
+    same_iteration = loop_body.append(square(x))
+    loop_body.append(hir.Assign(hir.VarRef(x), same_iteration))
+    after_store = loop_body.append(square(x))
+    body.append(hir.Loop(prepare, cond, loop_body, None, merge))
+    after_loop = merge.append(square(x))
+    merge.append(hir.Return(hir.Intrinsic("binop.__add__.f32", [after_store, after_loop], f32)))
+    func = hir.Function("f", [x], [x], body, lc.f32, f32)
+
+    assert GVN().run(func)
+    assert loop_body.nodes()[0].value is in_prepare  # type: ignore
+    for node in (before, in_prepare, after_store, after_loop):
+        assert node.block is not None
+
+
+def test_effects():
+    assert intrinsic_effect("binop.__add__.f32") == Effect.PURE
+    assert intrinsic_effect("binop.__iadd__.f32") == Effect.WRITE
+    assert intrinsic_effect("copy") == Effect.FRESH
+    assert intrinsic_effect("buffer.ref") == Effect.FRESH
+    assert intrinsic_effect("my.custom.op") == Effect.UNKNOWN
+
+    x = hir.Var("x", f32, None)
+    body = hir.BasicBlock()
+    copies = [body.append(hir.Intrinsic("copy", [hir.VarRef(x)], f32)) for _ in range(2)]
+    first = body.append(square(x))
+    body.append(hir.Intrinsic("binop.__iadd__.f32", [hir.VarRef(x), first], f32))
+    second = body.append(square(x))
+    body.append(hir.Return(None))
+    func = hir.Function("f", [x], [x], body, lc.f32, f32)
+    assert not GVN().run(func)
+    assert all(n.block is body for n in copies + [first, second])
@@ -0,0 +1,122 @@
+import pytest
+
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.passes import Inliner, PassManager
+from luisa_lang.passes.utils import blocks, calls
+
+
+@lc.func
+def half(x):
+    return x * 0.5
+
+
+@lc.func
+def schlick(cos_t, f0):
+    m = cos_t * 0.5 + 0.5
+    m2 = m * m
+    return f0 + (f0 * 0.5 + 0.5) * (m2 * m2 * m)
+
+
+@lc.func
+def fresnel(cos_i, cos_o, f0):
+    fi = schlick(cos_i, f0)
+    fo = schlick(cos_o, f0)
+    return half(fi * fo)
+
+
+@lc.func(inline="always")
+def forced(x):
+    y = x * x
+    return y * y + y
+
+
+@lc.func(inline="never")
+def kept(x):
+    return x * 2.0
+
+
+@lc.func
+def hinted(a, b):
+    return forced(a) + kept(b)
+
+
+@lc.func
+def clamp_low(x, lo):
+    if x < lo:
+        x = lo
+    return x
+
+
+@lc.func
+def clamped(a, b):
+    c = clamp_low(a, b)
+    return c + a
+
+
+def trace(f, *args):
+    return Compiler._trace(f, tuple(lc.f32(a) for a in args), None)
+
+
+def test_cost_model():
+    traced = trace(fresnel, 0.5, 0.25, 0.04)
+    # `half` is small enough to inline anywhere, two copies of `schlick` exceed the budget
+    func = PassManager([Inliner()]).run(traced)
+    assert [call.op.name for call in calls(func)] == [schlick.__name__] * 2
+    func = PassManager([Inliner(budget=64)]).run(traced)
+    assert calls(func) == []
+
+
+def test_hints():
+    func = PassManager([Inliner(small=0, budget=0)]).run(trace(hinted, 1.0, 2.0))
+    (call,) = calls(func)
+    assert call.op.inline_hint == "never"
+    compiler = Compiler("cpp", opt_level=0)
+    compiler.compile(hinted, (lc.f32(1.0), lc.f32(2.0)))
+    code = compiler.output()
+    assert "__lc_always_inline__ inline auto forced_" in code
+    assert "__lc_never_inline__ auto kept_" in code
+    with pytest.raises(ValueError):
+        lc.func(inline="sometimes")  # type: ignore[call-overload]
+
+
+def test_control_flow_and_written_parameters():
+    func = PassManager([Inliner()]).run(trace(clamped, 1.0, 2.0))
+    assert calls(func) == []
+    (branch,) = [n for bb in blocks(func) for n in bb if isinstance(n, hir.If)]
+    # the callee writes `x`, which gets a local of its own, `lo` reads the caller's argument
+    names = [v.name for v in func.locals]
+    assert "c" in names and sum(name.startswith("__arg_0") for name in names) == 2
+    assert branch.block is func.body and isinstance(branch.merge.nodes()[-1], hir.Return)
+
+
+def test_results_referring_into_parameters():
+    f32 = hir.FloatType(32)
+    pair = hir.StructType("Pair", "Pair", [("a", f32), ("b", f32)])
+    p = hir.Var("p", pair, None)
+    body = hir.BasicBlock()
+    a = body.append(hir.Member(body.append(hir.Load(hir.VarRef(p))), "a", f32, None))
+    body.append(hir.Return(a))
+    callee = hir.Function("first", [p], [p], body, lc.f32, f32)
+    s = hir.Var("s", pair, None)
+    body = hir.BasicBlock()
+    call = body.append(hir.Call(callee, [hir.VarRef(s)], f32, None))
+    init = body.append(hir.AggregateInit([call, call], pair))
+    body.append(hir.Assign(hir.VarRef(s), init))
+    body.append(hir.Return(call))
+    func = hir.Function("f", [s], [s], body, lc.f32, f32)
+
+    assert Inliner().run(func)
+    # the result is generated as a reference into the parameter, which gets a copy of `s`
+    assert [v.name for v in func.locals] == ["s", "p"]
+
+
+def test_output():
+    compiler = Compiler("cpp", opt_level=2)
+    compiler.compile(fresnel, (lc.f32(0.5), lc.f32(0.25), lc.f32(0.04)))
+    code = compiler.output()
+    assert "auto schlick_" not in code and "auto half_" not in code
+    # the copies share the computations on `f0`
+    assert code.count("__arg_2 * 0.5f;") == 1
+
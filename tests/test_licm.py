@@ -0,0 +1,81 @@
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.codegen.cpp import CppCodeGen
+from luisa_lang.passes import LICM
+
+f32 = hir.FloatType(32)
+u32 = hir.IntType(32, False)
+buffer = hir.OpaqueType("Buffer", [f32])
+pair = hir.StructType("Pair", "Pair", [("a", f32), ("b", f32)])
+
+
+def binop(op: str, lhs: hir.Value, rhs: hir.Value) -> hir.Intrinsic:
+    assert lhs.type is not None
+    ty = lhs.type.remove_ref()
+    return hir.Intrinsic(f"binop.{op}.{ty}", [lhs, rhs], ty)
+
+
+def element(buf: hir.Var, index: hir.Value) -> hir.Intrinsic:
+    return hir.Intrinsic("buffer.ref", [hir.VarValue(buf), index], hir.RefType(f32))
+
+
+def counted_loop(i: hir.Var, n: hir.Value) -> hir.Loop:
+    prepare, body, update, merge = (hir.BasicBlock() for _ in range(4))
+    cond = prepare.append(hir.Intrinsic("cmp.__lt__.u32", [hir.VarRef(i), n], hir.BoolType()))
+    update.append(binop("__iadd__", hir.VarRef(i), hir.Constant(1, u32)))
+    return hir.Loop(prepare, cond, body, update, merge)
+
+
+def test_buffer_stores():
+    buf, s, x, i = (hir.Var(name, ty, None) for name, ty in [
+        ("buf", buffer), ("s", pair), ("x", f32), ("i", u32)])
+    body = hir.BasicBlock()
+    size = hir.Intrinsic("buffer.size", [hir.VarValue(buf)], u32)
+    loop = counted_loop(i, size)
+    loop.prepare.nodes()[0].prepend(size)
+    a = loop.body.append(hir.Load(hir.Member(hir.VarRef(s), "a", hir.RefType(f32), None)))
+    scaled = loop.body.append(binop("__mul__", hir.VarRef(x), a))
+    elem = loop.body.append(element(buf, hir.VarRef(i)))
+    loop.body.append(hir.Assign(elem, scaled))
+    first = loop.body.append(hir.Load(loop.body.append(element(buf, hir.Constant(0, u32)))))
+    loop.body.append(hir.Assign(hir.VarRef(x), first))
+    body.append(loop)
+    loop.merge.append(hir.Return(None))
+    func = hir.Function("f", [buf, s, x], [buf, s, x, i], body, lc.f32, hir.UnitType())
+
+    assert LICM().run(func)
+    # the element stores do not write the buffer handle nor the struct parameter
+    assert size.block is body and a.block is body
+    # `x` is assigned in the loop, the element read may see the stores
+    assert scaled.block is loop.body and first.block is loop.body
+    assert loop.prepare.nodes() == [loop.cond]
+    assert not LICM().run(func)
+
+    codegen = CppCodeGen()
+    code = codegen.generated_code[codegen.gen_function(func)]
+    assert code.index("// load") < code.index("while(true)")
+
+
+def test_speculation_and_nesting():
+    n, k, i, j = (hir.Var(name, u32, None) for name in ("n", "k", "i", "j"))
+    ptr = hir.Var("p", f32, None, hir.ParameterSemantic.BYREF)
+    body = hir.BasicBlock()
+    outer = counted_loop(i, hir.VarRef(n))
+    inner = counted_loop(j, hir.VarRef(n))
+    in_prepare = binop("__floordiv__", hir.VarRef(n), hir.VarRef(k))
+    outer.prepare.nodes()[0].prepend(in_prepare)
+    in_body = outer.body.append(binop("__mod__", hir.VarRef(n), hir.VarRef(k)))
+    read = outer.body.append(hir.Load(hir.VarRef(ptr)))
+    nested = inner.body.append(binop("__add__", hir.VarRef(n), hir.VarRef(k)))
+    outer.body.append(inner)
+    inner.merge.append(hir.Intrinsic("binop.__iadd__.u32", [hir.VarRef(j), nested], u32))
+    body.append(outer)
+    outer.merge.append(hir.Return(None))
+    func = hir.Function("f", [n, k, ptr], [n, k, ptr, i, j], body, lc.f32, hir.UnitType())
+
+    assert LICM().run(func)
+    # the body may not run: the division and the read through the reference parameter stay
+    assert in_prepare.block is body
+    assert in_body.block is outer.body and read.block is outer.body
+    # moved out of the inner loop first, then out of the outer one
+    assert nested.block is body
@@ -0,0 +1,116 @@
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.passes import Mem2Reg
+from luisa_lang.passes.utils import blocks, clone_function
+
+f32 = hir.FloatType(32)
+
+
+@lc.func
+def blend(a, b):
+    v = lc.float3(a, b, a)
+    w = v * 2.0
+    u = w + v
+    if a < b:
+        u = u + v
+    return u
+
+
+def nodes(func: hir.Function, cls: type) -> list:
+    return [n for bb in blocks(func) for n in bb if isinstance(n, cls)]
+
+
+def test_constructor_temporaries():
+    traced = Compiler._trace(blend, (lc.f32(1.0), lc.f32(2.0)), None)
+    func = clone_function(traced)
+    (init,) = [n for n in nodes(func, hir.Intrinsic) if n.name == "init.float3"]
+    assert len(nodes(func, hir.Load)) == 1
+    assert Mem2Reg().run(func)
+    assert nodes(func, hir.Load) == []
+    # `v` and `w` are read as the values stored to them, `u` is assigned in the branch
+    mul, add, add_in_branch = [n for n in nodes(func, hir.Intrinsic) if n.name.startswith("binop")]
+    assert mul.args[0] is init and add.args == [mul, init]
+    assert add_in_branch.args == [add, init]
+    ret = nodes(func, hir.Return)[0]
+    assert isinstance(ret.value, hir.VarRef) and ret.value.var.name == "u"
+
+
+def test_struct_temporaries():
+    pair = hir.StructType("Pair", "Pair", [("a", f32), ("b", f32)])
+    x = hir.Var("x", f32, None)
+    body = hir.BasicBlock()
+    tmp = body.append(hir.Alloca(hir.RefType(pair)))
+    init = body.append(hir.AggregateInit([hir.VarValue(x), hir.Constant(1.0, f32)], pair))
+    body.append(hir.Assign(tmp, init))
+    b = body.append(hir.Member(body.append(hir.Load(tmp)), "b", f32, None))
+    total = body.append(hir.Intrinsic("binop.__add__.f32", [b, b], f32))
+    body.append(hir.Assign(hir.Member(tmp, "a", hir.RefType(f32), None), total))
+    a = body.append(hir.Member(body.append(hir.Load(tmp)), "a", f32, None))
+    body.append(hir.Return(a))
+    func = hir.Function("f", [x], [x], body, lc.f32, f32)
+
+    assert Mem2Reg().run(func)
+    assert b.block is None and total.args == [init.args[1], init.args[1]]
+    # the field store makes the temporary unknown
+    assert a.block is body
+
+
+def test_values_referring_into_written_variables():
+    x, y = hir.Var("x", f32, None), hir.Var("y", f32, None)
+    body = hir.BasicBlock()
+    read = body.append(hir.Load(hir.VarRef(x)))
+    body.append(hir.Assign(hir.VarRef(y), read))
+    body.append(hir.Assign(hir.VarRef(x), hir.Constant(2.0, f32)))
+    # the load is generated as a reference to `x`, it no longer holds what `y` was assigned
+    use = body.append(hir.Intrinsic("binop.__add__.f32", [hir.VarRef(y), hir.VarRef(x)], f32))
+    body.append(hir.Return(use))
+    func = hir.Function("f", [x], [x, y], body, lc.f32, f32)
+
+    assert Mem2Reg().run(func)
+    assert isinstance(use.args[0], hir.VarRef) and use.args[0].var is y
+    assert isinstance(use.args[1], hir.Constant) and use.args[1].value == 2.0
+
+
+def test_members_of_loads_refer_into_the_variable():
+    pair = hir.StructType("Pair", "Pair", [("a", f32), ("b", f32)])
+    x, v, r = hir.Var("x", f32, None), hir.Var("v", pair, None), hir.Var("r", f32, None)
+    body = hir.BasicBlock()
+    a = body.append(hir.Member(body.append(hir.Load(hir.VarRef(v))), "a", f32, None))
+    body.append(hir.Assign(hir.VarRef(r), a))
+    init = body.append(hir.AggregateInit([hir.VarValue(x), hir.VarValue(x)], pair))
+    body.append(hir.Assign(hir.VarRef(v), init))
+    ret = body.append(hir.Return(hir.VarRef(r)))
+    func = hir.Function("f", [x], [x, v, r], body, lc.f32, f32)
+
+    Mem2Reg().run(func)
+    # `a` is generated as a reference into `v`, which no longer holds the value read
+    assert isinstance(ret.value, hir.VarRef) and ret.value.var is r
+
+
+def test_loop_update_sees_the_body():
+    x, y = hir.Var("x", f32, None), hir.Var("y", f32, None)
+    prepare, body, update, merge = (hir.BasicBlock() for _ in range(4))
+    prepare.append(hir.Assign(hir.VarRef(x), hir.Constant(1.0, f32)))
+    cond = prepare.append(
+        hir.Intrinsic("cmp.__lt__.f32", [hir.VarRef(y), hir.VarRef(x)], hir.BoolType())
+    )
+    body.append(hir.Assign(hir.VarRef(x), hir.Constant(2.0, f32)))
+    read = update.append(hir.Load(hir.VarRef(x)))
+    update.append(hir.Assign(hir.VarRef(y), read))
+    entry = hir.BasicBlock()
+    entry.append(hir.Loop(prepare, cond, body, update, merge))
+    merge.append(hir.Return(hir.VarRef(y)))
+    func = hir.Function("f", [y], [x, y], entry, lc.f32, f32)
+
+    Mem2Reg().run(func)
+    # not the 1.0 assigned in the prepare block
+    assert read.block is update
+
+
+def test_output():
+    compiler = Compiler("cpp", opt_level=1)
+    compiler.compile(blend, (lc.f32(1.0), lc.f32(2.0)))
+    code = compiler.output()
+    assert "lc_float3 v1{ __arg_0,__arg_1,__arg_0 };" in code
+    assert "// alloca" not in code and "// load" not in code and "lc_float3 v{};" not in code
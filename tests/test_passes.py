@@ -0,0 +1,122 @@
+import gc
+import weakref
+
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.passes import DCE, FunctionPass, PassManager
+from luisa_lang.passes.utils import calls, clone_function, count_nodes, structural_key
+
+
+@lc.func
+def square(x):
+    return x * x
+
+
+@lc.func
+def sum_of_squares(a, b):
+    return square(a) + square(b)
+
+
+class CountingPass(FunctionPass):
+    name = "counting"
+
+    def __init__(self) -> None:
+        self.funcs: list[str] = []
+
+    def run(self, func: hir.Function) -> bool:
+        self.funcs.append(func.name)
+        return False
+
+
+class AppendUnitPass(FunctionPass):
+    name = "append_unit"
+
+    def run(self, func: hir.Function) -> bool:
+        head = func.body.head
+        assert head is not None
+        head.prepend(hir.Unit())
+        return True
+
+
+def trace(a, b) -> hir.Function:
+    return Compiler._trace(sum_of_squares, (a, b), None)
+
+
+def test_clone_is_independent():
+    func = trace(lc.f32(1.0), lc.f32(2.0))
+    num_nodes = count_nodes(func)
+    cloned = clone_function(func)
+    assert structural_key(cloned) == structural_key(func)
+    head = cloned.body.head
+    assert head is not None
+    head.prepend(hir.Unit())
+    assert count_nodes(func) == num_nodes and count_nodes(cloned) == num_nodes + 1
+    assert structural_key(cloned) != structural_key(func)
+    for bb, node in [(cloned.body, n) for n in cloned.body]:
+        assert node.block is bb
+        for operand in node.operands():
+            assert all(user.block is bb for user in operand.uses)
+
+
+def test_structural_key():
+    f32_key = structural_key(trace(lc.f32(1.0), lc.f32(2.0)))
+    assert structural_key(trace(lc.f32(3.0), lc.f32(4.0))) == f32_key
+    assert structural_key(trace(lc.i32(1), lc.i32(2))) != f32_key
+
+
+def test_results_are_memoized():
+    counting = CountingPass()
+    manager = PassManager([counting])
+    first = trace(lc.f32(1.0), lc.f32(2.0))
+    optimized = manager.run(first)
+    assert optimized is not first
+    # the callee is optimized before its caller
+    assert counting.funcs == [calls(first)[0].op.name, first.name]
+    assert all(call.op is not calls(first)[0].op for call in calls(optimized))
+    assert manager.run(first) is optimized
+    assert manager.run(optimized) is optimized
+    # a structurally identical function that is a different object
+    assert manager.run(clone_function(first)) is optimized
+    assert len(counting.funcs) == 2 and manager.cache_hits == 1
+    manager.run(trace(lc.i32(1), lc.i32(2)))
+    assert len(counting.funcs) == 4
+    assert manager.stats["counting"].runs == 4
+
+
+def test_results_are_not_kept_alive():
+    dce = DCE()
+    manager = PassManager([dce])
+    # unlike the traced function, the copy is not held by the template cache
+    func = clone_function(trace(lc.f32(1.0), lc.f32(2.0)))
+    key = structural_key(func)
+    optimized = manager.run(func)
+    assert manager.run(func) is optimized and key in manager._by_key
+    refs = [weakref.ref(func), weakref.ref(optimized)]
+    del func, optimized
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+    assert key not in manager._by_key
+    # the analyses DCE keeps for the pruned callees are still cached, they survive until `clear()`
+    assert len(dce._pruned) > 0
+    manager.clear()
+    assert len(dce._side_effects) == 0 and len(dce._pruned) == 0
+
+
+def test_stats_record_node_deltas():
+    manager = PassManager([AppendUnitPass(), CountingPass()])
+    func = trace(lc.f32(1.0), lc.f32(2.0))
+    num_nodes = count_nodes(func)
+    optimized = manager.run(func)
+    assert count_nodes(optimized) == num_nodes + 1 and count_nodes(func) == num_nodes
+    stats = manager.stats["append_unit"]
+    assert (stats.runs, stats.changed, stats.node_delta) == (2, 2, 2)
+    assert manager.stats["counting"].node_delta == 0
+    assert "append_unit" in manager.report()
+
+
+def test_opt_levels():
+    assert PassManager.for_level(0).passes == []
+    assert PassManager.for_level(2) is PassManager.for_level(2)
+    func = trace(lc.f32(1.0), lc.f32(2.0))
+    assert PassManager.for_level(0).run(func) is func
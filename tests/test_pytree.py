@@ -0,0 +1,142 @@
+import pickle
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+from luisa_lang.lang_runtime import (
+    PyTreeRegistry,
+    tree_flatten,
+    tree_structure,
+    tree_unflatten,
+)
+
+
+def structure_of(obj) -> hir.PyTreeStructure:
+    return tree_structure(obj, [], False)
+
+
+@lc.func
+def difference(a, b):
+    return a - b
+
+
+def test_structures_are_interned():
+    a = structure_of((lc.f32(1.0), (lc.i32(1), 2)))
+    b = structure_of((lc.f32(3.0), (lc.i32(4), 2)))
+    assert a is b
+    assert pickle.loads(pickle.dumps(a)) is a
+
+
+def test_structure_hash_is_order_sensitive():
+    a = hir.FunctionTemplateArgs([structure_of(lc.f32(1.0)), structure_of(lc.i32(1))])
+    b = hir.FunctionTemplateArgs([structure_of(lc.i32(1)), structure_of(lc.f32(1.0))])
+    assert a != b
+    assert hash(a) != hash(b)
+    assert structure_of((1, 1.0)) is not structure_of((1.0, 1))
+
+
+def test_equal_leaves_get_separate_params():
+    # both arguments have the same (interned) structure
+    compiler = Compiler("cpp")
+    compiler.compile(difference, example_inputs=(lc.f32(1.0), lc.f32(2.0)))
+    assert "__arg_0 - __arg_1" in compiler.output()
+
+
+def test_single_pass_matches_flatten():
+    x, y, z = lc.f32(1.0), lc.i32(2), lc.f32(3.0)
+    obj = (x, [y, 1.5, None], {"k": z, "n": "s"})
+    leaves: list = []
+    assert tree_structure(obj, leaves, False) is tree_flatten(obj, False).structure()
+    assert leaves == tree_flatten(obj, False).collect_jitvars() == [x, y, z]
+
+
+def test_unflatten_roundtrip():
+    x = lc.f32(1.0)
+    obj = (x, [1, 2.0], {"a": (x, "b"), 3: None}, True)
+    assert tree_unflatten(tree_flatten(obj, False), False) == obj
+
+
+def test_registry_resolves_base_classes():
+    class Ints(list):
+        pass
+
+    # would be rebuilt as a `list`
+    assert PyTreeRegistry.lookup(Ints) is None
+    ints = Ints([1, 2])
+    assert tree_unflatten(tree_flatten(ints, True), True) is ints
+    flatten, unflatten = PyTreeRegistry.get(list)
+    PyTreeRegistry.register(Ints, flatten, lambda tree: Ints(unflatten(tree)))
+    try:
+        assert PyTreeRegistry.lookup(Ints) is not None
+    finally:
+        del PyTreeRegistry.instance().funcs[Ints]
+        PyTreeRegistry.instance().resolved.clear()
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class NamedPoint(Point):
+    pass
+
+
+PyTreeRegistry.register_fields(Point, ["x", "y"])
+
+
+def test_registered_fields_are_inherited():
+    p = NamedPoint(lc.f32(1.0), 2)
+    q = tree_unflatten(tree_flatten(p, False), False)
+    assert type(q) is NamedPoint and (q.x, q.y) == (p.x, p.y)
+    assert structure_of(p) is not structure_of(Point(lc.f32(1.0), 2))
+
+
+@lc.pytree
+class Config:
+    scale: lc.f32
+    steps: int
+    offsets: list
+
+
+class Pair(NamedTuple):
+    a: lc.f32
+    b: lc.f32
+
+
+@dataclass(frozen=True)
+class Frozen:
+    x: lc.i32
+    name: str
+
+
+@lc.func
+def pair_difference(p):
+    return p.a - p.b
+
+
+def test_pytree_class_is_flattened():
+    x, y = lc.f32(1.0), lc.i32(2)
+    leaves: list = []
+    structure = tree_structure(Config(x, 3, [y]), leaves, False)
+    assert leaves == [x, y]
+    assert structure is tree_flatten(Config(lc.f32(2.0), 3, [lc.i32(0)]), False).structure()
+    assert structure is not structure_of(Config(x, 4, [y]))
+
+
+def test_dataclasses_and_namedtuples_roundtrip():
+    x = lc.f32(1.0)
+    for obj in (Config(x, 3, [x, 2]), Pair(x, x), Frozen(lc.i32(1), "n")):
+        assert tree_unflatten(tree_flatten(obj, False), False) == obj
+    assert type(tree_unflatten(tree_flatten(Pair(x, x), False), False)) is Pair
+    # a NamedTuple is not flattened as a plain tuple
+    assert structure_of(Pair(x, x)) is not structure_of((x, x))
+
+
+def test_namedtuple_argument():
+    compiler = Compiler("cpp")
+    compiler.compile(pair_difference, example_inputs=(Pair(lc.f32(1.0), lc.f32(2.0)),))
+    assert "__arg_0_0 - __arg_0_1" in compiler.output()
@@ -0,0 +1,60 @@
+import ast
+import os
+import pytest
+import luisa_lang
+from luisa_lang import ast_rewrite, utils
+
+
+def sample(a, b):
+    c = a + b
+    return c * a
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    old = ast_rewrite.rewrite_cache_dir()
+    ast_rewrite.set_rewrite_cache_dir(str(tmp_path))
+    yield tmp_path
+    ast_rewrite.set_rewrite_cache_dir(old)
+
+
+def _cached_entries(path) -> list:
+    return [f for _, _, files in os.walk(path) for f in files if f.endswith(".bin")]
+
+
+def test_rewrite_populates_cache(cache_dir):
+    ast_rewrite.rewrite_function(sample, "func")
+    assert len(_cached_entries(cache_dir)) == 1
+    # the decorator name is part of the key
+    ast_rewrite.rewrite_function(sample, "trace")
+    assert len(_cached_entries(cache_dir)) == 2
+
+
+def test_warm_rewrite_skips_parsing(cache_dir, monkeypatch):
+    cold = ast_rewrite.rewrite_function(sample, "func")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parsed on a cache hit")
+
+    # as in a new process, where the source file has not been read yet
+    utils._parsed_source_files.clear()
+    monkeypatch.setattr(ast, "parse", fail)
+    warm = ast_rewrite.rewrite_function(sample, "func")
+    assert warm.__code__.co_code == cold.__code__.co_code
+    assert warm.__code__.co_varnames == cold.__code__.co_varnames
+
+
+def test_corrupted_entry_is_ignored(cache_dir):
+    ast_rewrite.rewrite_function(sample, "func")
+    for root, _, files in os.walk(cache_dir):
+        for f in files:
+            with open(os.path.join(root, f), "wb") as fp:
+                fp.write(b"garbage")
+    rewritten = ast_rewrite.rewrite_function(sample, "func")
+    assert "__lc_ctx__" in rewritten.__code__.co_varnames
+
+
+def test_disabled_cache(cache_dir):
+    ast_rewrite.set_rewrite_cache_dir(None)
+    ast_rewrite.rewrite_function(sample, "func")
+    assert _cached_entries(cache_dir) == []
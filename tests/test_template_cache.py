@@ -0,0 +1,46 @@
+import luisa_lang as lc
+from luisa_lang import hir
+from luisa_lang.compile import Compiler
+
+
+@lc.func(capacity=1)
+def twice(x):
+    return x + x
+
+
+def test_template_evicts_least_recently_used():
+    template = hir.Template(int, lambda i: f"inst_{i}", capacity=2)
+    for i in (0, 1, 0, 2):
+        template.instantiate(i)
+    assert list(template.cache) == [0, 2]
+    stats = template.stats
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 3, 1)
+    template.set_capacity(1)
+    assert list(template.cache) == [2]
+    assert template.stats.evictions == 2
+
+
+def test_global_template_capacity():
+    ctx = hir.GlobalContext.get()
+    template = hir.Template(int, lambda i: f"inst_{i}")
+    for i in range(4):
+        template.instantiate(i)
+    try:
+        ctx.set_template_capacity(3)
+        template.set_capacity(None)
+        assert list(template.cache) == [1, 2, 3]
+        template.instantiate(4)
+        assert list(template.cache) == [2, 3, 4]
+    finally:
+        ctx.set_template_capacity(None)
+
+
+def test_func_capacity_and_report():
+    compiler = Compiler("cpp")
+    compiler.compile(twice, example_inputs=(lc.f32(1.0),))
+    compiler.compile(twice, example_inputs=(lc.i32(1),))
+    stats = lc.template_stats(twice)
+    assert (stats.misses, stats.evictions) == (2, 1)
+    assert stats.instantiation_time > 0
+    report = hir.GlobalContext.get().template_report(top=1000)
+    assert "test_template_cache.twice" in report
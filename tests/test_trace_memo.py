@@ -0,0 +1,98 @@
+import luisa_lang as lc
+from luisa_lang.compile import Compiler
+
+
+@lc.trace(memoize=True)
+def mad(a, b, c):
+    return a * b + c
+
+
+@lc.trace
+def mad_traced(a, b, c):
+    return a * b + c
+
+
+@lc.trace(memoize=True)
+def with_local(a, b):
+    t = a * b
+    return t + a
+
+
+@lc.func
+def use_mad(a, b):
+    x = mad(a, b, a)
+    y = mad(x, b, a)
+    return mad(y, x, b)
+
+
+@lc.func
+def use_mad_traced(a, b):
+    x = mad_traced(a, b, a)
+    y = mad_traced(x, b, a)
+    return mad_traced(y, x, b)
+
+
+@lc.trace
+def with_local_traced(a, b):
+    t = a * b
+    return t + a
+
+
+@lc.func
+def use_with_local(a, b):
+    x = with_local(a, b)
+    return with_local(x, b)
+
+
+@lc.func
+def use_with_local_traced(a, b):
+    x = with_local_traced(a, b)
+    return with_local_traced(x, b)
+
+
+@lc.func
+def use_with_int_local(a, b):
+    t = 1
+    return with_local(a, b)
+
+
+def _compile(f, name):
+    compiler = Compiler("cpp")
+    compiler.compile(f, example_inputs=(lc.f32(1.0), lc.f32(3.0)), name=name)
+    output = compiler.output()
+    # drop the mangled name
+    return output[output.index(f"auto {f.__name__}_"):].split("(", 1)[1]
+
+
+def test_replay_matches_tracing():
+    memoized = _compile(use_mad, "memoized")
+    traced = _compile(use_mad_traced, "traced")
+    assert memoized == traced
+    stats = lc.trace_memo_stats(mad)
+    assert stats is not None
+    # `mad(a, b, a)` aliases its arguments, so it does not share the entry of the other calls
+    assert (stats.hits, stats.misses, stats.rejected) == (1, 2, 0)
+    assert lc.trace_memo_stats(mad_traced) is None
+
+
+def test_memoization_can_be_disabled():
+    stats = lc.trace_memo_stats(mad)
+    assert stats is not None
+    stats.clear()
+    hits = stats.hits
+    with lc.trace_memoization(False):
+        _compile(use_mad, "disabled")
+    assert stats.hits == hits
+    assert stats.entries == {}
+
+
+def test_local_bindings():
+    stats = lc.trace_memo_stats(with_local)
+    assert stats is not None
+    memoized = _compile(use_with_local, "with_local")
+    # the second call assigns the variable `t` created by the first one, as tracing does
+    assert memoized == _compile(use_with_local_traced, "with_local_traced")
+    assert (stats.hits, stats.misses, stats.rejected) == (1, 1, 0)
+    # `t` is not a variable here, the call is traced
+    _compile(use_with_int_local, "with_int_local")
+    assert stats.hits == 1
@@ -0,0 +1,49 @@
+import pickle
+
+from luisa_lang import hir
+
+
+def test_types_are_interned():
+    f32 = hir.FloatType(32)
+    assert hir.FloatType(32) is f32
+    assert hir.VectorType(f32, 3) is hir.VectorType(hir.FloatType(32), 3)
+    assert hir.VectorType(f32, 4) is not hir.VectorType(f32, 4, 16)
+    assert hir.TupleType([f32, hir.IntType(32, True)]) is hir.TupleType([f32, hir.IntType(32, True)])
+    assert hir.TupleType([f32, hir.IntType(32, True)]) is not hir.TupleType([hir.IntType(32, True), f32])
+    fields: list[tuple[str, hir.Type]] = [("a", f32), ("b", hir.IntType(32, False))]
+    assert hir.StructType("S_1", "S", fields) is hir.StructType("S_1", "S", list(fields))
+    assert hir.LiteralType(1) is not hir.LiteralType(True)
+
+
+def test_types_stay_interned_through_pickle():
+    ty = hir.RefType(hir.ArrayType(hir.FloatType(32), 4))
+    assert pickle.loads(pickle.dumps(ty)) is ty
+
+
+def all_subclasses(cls: type) -> list[type]:
+    subclasses = [cls]
+    sub: type
+    for sub in cls.__subclasses__():
+        subclasses.extend(all_subclasses(sub))
+    return subclasses
+
+
+def test_hir_objects_have_no_instance_dict():
+    for cls in all_subclasses(hir.Type) + all_subclasses(hir.Node):
+        assert cls.__dictoffset__ == 0, f"{cls.__name__} is missing __slots__"
+
+
+def not_instantiated(args: hir.FunctionTemplateArgs) -> hir.Function:
+    raise NotImplementedError
+
+
+def test_methods_are_kept_per_type():
+    ty = hir.OpaqueType("MethodsTest")
+    template = hir.FunctionTemplate(hir.FunctionTemplateArgs, not_instantiated)
+    ty.add_method("f", template)
+    assert hir.OpaqueType("MethodsTest").methods is ty.methods
+    assert ty.methods["f"] is template
+    # reading the methods of a type without any does not register it
+    other = hir.OpaqueType("OtherMethodsTest")
+    assert len(other.methods) == 0 and other.methods is not ty.methods
+    assert other not in hir._type_methods
@@ -1,7 +1,15 @@
 import pytest
 from typing import Union, List, Tuple, Optional
 import luisa_lang
-from luisa_lang.utils import check_type
+import ast
+import types
+from luisa_lang.utils import (
+    check_type,
+    compile_type_pattern,
+    parse_source_lines,
+    retrieve_ast_and_filename,
+    retrieve_source_and_filename,
+)
 
 def test_check_type_with_builtin_type():
     assert check_type(int, 5)
@@ -58,4 +66,72 @@ def test_check_type_with_optional():
 def test_check_type_with_non_matching():
     assert not check_type(float, "not a float")
     assert not check_type((list, dict), 42)
-    assert not check_type(Union[bytes, dict], 3.14)
\ No newline at end of file
+    assert not check_type(Union[bytes, dict], 3.14)
+
+def _decorated(f):
+    return f
+
+
+class _Holder:
+    @_decorated
+    def method(self, x):
+        return x + 1
+
+
+def _spans(tree):
+    return sorted(
+        (type(n).__name__, *(getattr(n, a) for a in ("lineno", "col_offset", "end_lineno", "end_col_offset")))
+        for n in ast.walk(tree)
+        if hasattr(n, "lineno")
+    )
+
+
+def test_retrieve_ast_matches_parsing_source_lines():
+    source_lines, lineno, source_file = retrieve_source_and_filename(_Holder.method)
+    assert source_lines[0].strip() == "@_decorated"
+    assert source_file == __file__
+    expected = parse_source_lines(source_lines, lineno, source_file)
+    # the first request is served from the per-file cache, the second one re-parses
+    for _ in range(2):
+        tree, filename = retrieve_ast_and_filename(_Holder.method)
+        assert filename == __file__
+        assert _spans(tree) == _spans(expected)
+        assert all(getattr(n, "source_file") == __file__ for n in ast.walk(tree))
+
+
+def _outer(x):
+    def inner(y):
+        return y * 2
+
+    return inner(x)
+
+
+def test_nested_def_is_not_taken_from_a_mutated_outer_ast():
+    outer_tree, _ = retrieve_ast_and_filename(_outer)
+    assert isinstance(outer_tree, ast.Module)
+    outer_def = outer_tree.body[0]
+    assert isinstance(outer_def, ast.FunctionDef)
+    nested = outer_def.body[0]
+    assert isinstance(nested, ast.FunctionDef) and nested.name == "inner"
+    # callers such as the rewriter mutate the tree they are handed
+    nested.body = [ast.Pass()]
+    code = next(c for c in _outer.__code__.co_consts if getattr(c, "co_name", None) == "inner")
+    inner = types.FunctionType(code, globals())
+    source_lines, lineno, source_file = retrieve_source_and_filename(inner)
+    inner_tree, _ = retrieve_ast_and_filename(inner)
+    assert _spans(inner_tree) == _spans(parse_source_lines(source_lines, lineno, source_file))
+
+
+def test_compiled_type_pattern_matches_check_type():
+    class Sub(int):
+        pass
+
+    patterns = [int, (int, float), Union[int, str], int | None, List[int]]
+    values = [1, 2.5, "a", None, Sub(3), [1], (1,)]
+    for pat in patterns:
+        compiled = compile_type_pattern(pat)
+        assert compile_type_pattern(compiled) is compiled
+        for _ in range(2):
+            for v in values:
+                assert compiled(v) == check_type(pat, v), (pat, v)
+    assert compile_type_pattern(Union[int, str]) is compile_type_pattern(Union[int, str])